@@ -0,0 +1,187 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module is a benchmark for Porechop. It runs Porechop through its real entry point on a set of
+reads (synthetic reads by default, see synthetic_reads.py), with --metrics saving the timing of
+each phase, so the benchmark always measures what a real run does:
+  * loading: reading the input file
+  * discovery: the adapter set search on the check reads
+  * end_trimming: finding adapters at the read ends (and calling barcodes, when binning)
+  * middle_splitting: finding adapters in the middle of reads
+  * output: writing the reads to a file (or to barcode bins)
+The results (with reads/s, bases/s, adapter alignment counts and DP cells, the peak memory use and
+the reads and bases written) are written as JSON, so they can be compared between versions.
+
+Barcoding only happens when the reads are binned: for synthetic reads with --barcodes or with
+--bin_reads. Any options the benchmark doesn't recognise are passed on to Porechop, so the same
+settings can be used as for a real run, e.g.:
+python3 -m benchmark.run_benchmark --reads 5000 --barcodes 12 --json results.json -- --threads 4
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+import porechop.porechop
+import porechop.cpp_function_wrappers
+from porechop import metrics
+from porechop.misc import iterate_fasta_or_fastq
+from porechop.version import __version__
+from .synthetic_reads import add_generator_arguments, check_generator_arguments, \
+    get_generator_settings, generate_reads, write_reads
+
+def main():
+    args, porechop_argv = get_arguments()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        results = run_benchmark(args, porechop_argv, temp_dir)
+    if args.json is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.json, 'wt') as json_file:
+            json.dump(results, json_file, indent=2)
+            json_file.write('\n')
+
+
+def get_arguments():
+    """
+    Returns the benchmark's arguments and the rest of the command line (for Porechop).
+    """
+    parser = argparse.ArgumentParser(description='Time each phase of Porechop on synthetic reads '
+                                                 '(or a read file) - other options are passed on '
+                                                 'to Porechop')
+    group = parser.add_argument_group('Benchmark settings')
+    group.add_argument('-i', '--input',
+                       help='FASTA/FASTQ of reads to use instead of synthetic reads')
+    group.add_argument('--bin_reads', action='store_true',
+                       help='Bin the reads by barcode (default: only for synthetic reads with '
+                            '--barcodes)')
+    group.add_argument('--json',
+                       help='Save the results to this file (default: print them to stdout)')
+    add_generator_arguments(parser)
+    args, porechop_argv = parser.parse_known_args()
+    check_generator_arguments(args)
+    if porechop_argv and porechop_argv[0] == '--':
+        porechop_argv = porechop_argv[1:]
+    if args.input is not None and not os.path.isfile(args.input):
+        sys.exit('Error: could not find ' + args.input)
+    return args, porechop_argv
+
+
+def get_porechop_argv(porechop_argv, input_filename, barcode_dir, output, metrics_filename):
+    """
+    Returns the command line for Porechop. The benchmark sets the input, output and metrics file,
+    and Porechop runs quietly so its output doesn't mix with the results.
+    """
+    for option in ['-i', '--input', '-o', '--output', '-b', '--barcode_dir', '--metrics']:
+        if option in porechop_argv:
+            sys.exit('Error: ' + option + ' cannot be used in the benchmark')
+    argv = ['porechop', '-i', input_filename]
+    if barcode_dir is not None:
+        argv += ['-b', barcode_dir]
+    else:
+        argv += ['-o', output]
+    return argv + porechop_argv + ['--verbosity', '0', '--metrics', metrics_filename]
+
+
+def run_porechop(argv):
+    """
+    Runs Porechop's main function with the given command line.
+    """
+    old_argv = sys.argv
+    sys.argv = argv
+    try:
+        porechop.porechop.main()
+    finally:
+        sys.argv = old_argv
+        metrics.stop_metrics()
+
+
+def run_benchmark(args, porechop_argv, temp_dir):
+    results = OrderedDict()
+    results['porechop_version'] = __version__
+    results['python_version'] = platform.python_version()
+    results['platform'] = platform.platform()
+    results['cpu_count'] = multiprocessing.cpu_count()
+
+    if args.input is None:
+        input_filename = os.path.join(temp_dir, 'synthetic_reads.fastq')
+        generator_settings = get_generator_settings(args)
+        print('Generating synthetic reads', file=sys.stderr, flush=True)
+        start_time = time.perf_counter()
+        with open(input_filename, 'wt') as reads_file:
+            write_reads(generate_reads(*generator_settings), reads_file)
+        results['synthetic_reads'] = OrderedDict(
+            [('reads', args.reads), ('seed', args.seed),
+             ('length_distribution', args.length_distribution),
+             ('mean_length', args.mean_length), ('length_sd', args.length_sd),
+             ('min_length', args.min_length), ('error_rate', args.error_rate),
+             ('error_profile', args.error_profile), ('kit', args.kit),
+             ('barcodes', args.barcodes), ('start_adapter_rate', args.start_adapter_rate),
+             ('end_adapter_rate', args.end_adapter_rate), ('chimera_rate', args.chimera_rate),
+             ('seconds', round(time.perf_counter() - start_time, 3))])
+        bin_reads = args.bin_reads or args.barcodes > 0
+    else:
+        input_filename = args.input
+        results['input'] = os.path.abspath(args.input)
+        bin_reads = args.bin_reads
+
+    barcode_dir = os.path.join(temp_dir, 'bins') if bin_reads else None
+    output = None if bin_reads else os.path.join(temp_dir, 'trimmed_reads.fastq')
+    metrics_filename = os.path.join(temp_dir, 'metrics.json')
+    argv = get_porechop_argv(porechop_argv, input_filename, barcode_dir, output, metrics_filename)
+    results['porechop_arguments'] = argv[1:]
+    run_porechop(argv)
+    results['backend'] = porechop.cpp_function_wrappers.BACKEND
+
+    with open(metrics_filename, 'rt') as metrics_file:
+        porechop_metrics = json.load(metrics_file, object_pairs_hook=OrderedDict)
+    results['reads'] = porechop_metrics['phases']['loading']['reads']
+    results['bases'] = porechop_metrics['phases']['loading']['bases']
+    results['phases'] = porechop_metrics['phases']
+    results['total'] = porechop_metrics['total']
+    results['counts'] = get_output_counts(output, barcode_dir)
+    return results
+
+
+def get_output_counts(output, barcode_dir):
+    """
+    Returns the number of reads and bases Porechop wrote, and (when binning) the reads in each bin
+    and the number which were barcoded (i.e. not in the 'none' bin).
+    """
+    if barcode_dir is None:
+        filenames = [output]
+    else:
+        filenames = sorted(os.path.join(barcode_dir, x) for x in os.listdir(barcode_dir))
+    counts = OrderedDict([('reads', 0), ('bases', 0)])
+    bins = OrderedDict()
+    for filename in filenames:
+        records, _ = iterate_fasta_or_fastq(filename)
+        read_count = 0
+        for record in records:
+            read_count += 1
+            counts['bases'] += len(record[1])
+        counts['reads'] += read_count
+        bins[os.path.basename(filename).split('.')[0]] = read_count
+    if barcode_dir is not None:
+        counts['barcoded'] = sum(count for name, count in bins.items() if name != 'none')
+        counts['bins'] = bins
+    return counts
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module generates synthetic ONT-like reads for benchmarking Porechop. The reads are made from
+the real adapter and barcode sequences in Porechop's ADAPTERS list, so Porechop finds and trims
+them as it would in real reads. Everything comes from one seeded random number generator, so the
+same settings always give the same reads.
+
+Each read is a random sequence (its length drawn from the chosen distribution) which may have a
+start adapter and/or an end adapter. With --barcodes, the adapters are the full native barcoding
+adapters and each read is given one of the barcodes. Chimeric reads are two of these joined by an
+end adapter and a start adapter, which Porechop should find as a middle adapter. The read body is
+random, so sequencing errors are only added to the adapters (where they matter to Porechop). Each
+read's header records what was put in it.
+
+Usage (from Porechop's root directory):
+python3 -m benchmark.synthetic_reads --reads 1000 --barcodes 12 > reads.fastq
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import itertools
+import math
+import random
+import sys
+from porechop.adapters import ADAPTERS, make_full_native_barcode_adapter
+
+# Random bytes are turned into bases four at a time (two bits per base) and into qualities one at a
+# time (Phred scores from 5 to 20).
+FOUR_BASES = [''.join(x) for x in itertools.product('ACGT', repeat=4)]
+QUALITY_TABLE = bytes(33 + 5 + (i % 16) for i in range(256))
+
+# Real adapters are often missing a few bases at the read's very end and can have a few other bases
+# beyond them.
+MAX_ADAPTER_TRUNCATION = 5
+MAX_OUTER_BASES = 10
+
+LENGTH_DISTRIBUTIONS = ['lognormal', 'gamma', 'fixed']
+DEFAULT_KIT = 'SQK-NSK007'
+
+
+def main():
+    args = get_arguments()
+    write_reads(generate_reads(*get_generator_settings(args)), sys.stdout)
+
+
+def get_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic ONT-like reads (FASTQ on '
+                                                 'stdout) for benchmarking Porechop')
+    add_generator_arguments(parser)
+    args = parser.parse_args(argv)
+    check_generator_arguments(args)
+    return args
+
+
+def add_generator_arguments(parser):
+    group = parser.add_argument_group('Synthetic read settings')
+    group.add_argument('--reads', type=int, default=2000,
+                       help='Number of reads')
+    group.add_argument('--seed', type=int, default=0,
+                       help='Random seed (the same settings and seed always give the same reads)')
+    group.add_argument('--length_distribution', choices=LENGTH_DISTRIBUTIONS,
+                       default='lognormal',
+                       help='Distribution of read lengths (before adapters are added)')
+    group.add_argument('--mean_length', type=int, default=5000,
+                       help='Mean read length')
+    group.add_argument('--length_sd', type=int, default=4000,
+                       help='Standard deviation of read lengths (not used for fixed lengths)')
+    group.add_argument('--min_length', type=int, default=200,
+                       help='Shorter read lengths are raised to this')
+    group.add_argument('--error_rate', type=float, default=0.08,
+                       help='Per-base error rate in adapters and barcodes')
+    group.add_argument('--error_profile', type=str, default='0.4,0.3,0.3',
+                       help='Comma-delimited relative rates of substitutions, insertions and '
+                            'deletions')
+    group.add_argument('--kit', type=str,
+                       help='Name of the adapter set (from the known adapters) at the read ends '
+                            '(default: ' + DEFAULT_KIT + ', cannot be used with --barcodes)')
+    group.add_argument('--barcodes', type=int, default=0,
+                       help='Give the reads native barcodes 1 to this number (0 = no barcodes)')
+    group.add_argument('--start_adapter_rate', type=float, default=0.9,
+                       help='Fraction of reads with a start adapter')
+    group.add_argument('--end_adapter_rate', type=float, default=0.5,
+                       help='Fraction of reads with an end adapter')
+    group.add_argument('--chimera_rate', type=float, default=0.02,
+                       help='Fraction of reads which are two reads joined by a middle adapter')
+
+
+def check_generator_arguments(args):
+    barcode_count = sum(1 for x in ADAPTERS if x.name.startswith('Barcode ') and
+                        x.name.endswith(' (reverse)'))
+    if args.reads < 0:
+        sys.exit('Error: --reads cannot be negative')
+    if args.mean_length < 1 or args.length_sd < 0:
+        sys.exit('Error: --mean_length must be positive and --length_sd cannot be negative')
+    if args.barcodes < 0 or args.barcodes > barcode_count:
+        sys.exit('Error: --barcodes must be from 0 to ' + str(barcode_count))
+    if args.kit is not None:
+        if args.barcodes:
+            sys.exit('Error: --kit cannot be used with --barcodes (barcoded reads use the native '
+                     'barcoding adapters)')
+        if not any(x.name == args.kit and x.start_sequence for x in ADAPTERS):
+            sys.exit('Error: ' + args.kit + ' is not the name of a known adapter set')
+    try:
+        args.error_profile = [float(x) for x in args.error_profile.split(',')]
+    except ValueError:
+        sys.exit('Error: incorrectly formatted error profile')
+    if len(args.error_profile) != 3 or min(args.error_profile) < 0 or \
+            sum(args.error_profile) <= 0:
+        sys.exit('Error: incorrectly formatted error profile')
+    for rate in [args.error_rate, args.start_adapter_rate, args.end_adapter_rate,
+                 args.chimera_rate]:
+        if not 0.0 <= rate <= 1.0:
+            sys.exit('Error: rates must be from 0 to 1')
+
+
+def get_generator_settings(args):
+    """
+    Returns the generator's settings from the parsed arguments, in the order generate_reads takes
+    them.
+    """
+    return [args.reads, args.seed, args.length_distribution, args.mean_length, args.length_sd,
+            args.min_length, args.error_rate, args.error_profile, args.kit, args.barcodes,
+            args.start_adapter_rate, args.end_adapter_rate, args.chimera_rate]
+
+
+def generate_reads(read_count, seed, length_distribution, mean_length, length_sd, min_length,
+                   error_rate, error_profile, kit, barcodes, start_adapter_rate, end_adapter_rate,
+                   chimera_rate):
+    """
+    A generator of (header, sequence, qualities) for each synthetic read.
+    """
+    rng = random.Random(seed)
+    if barcodes:
+        adapter_sets = [make_full_native_barcode_adapter(i) for i in range(1, barcodes + 1)]
+    else:
+        kit = DEFAULT_KIT if kit is None else kit
+        adapter_sets = [x for x in ADAPTERS if x.name == kit]
+    for i in range(read_count):
+        adapter_set = rng.choice(adapter_sets)
+        start_seq = adapter_set.start_sequence[1]
+        end_seq = adapter_set.end_sequence[1] if adapter_set.end_sequence else ''
+
+        has_start = rng.random() < start_adapter_rate
+        has_end = end_seq and rng.random() < end_adapter_rate
+        chimera = rng.random() < chimera_rate
+
+        parts = []
+        if has_start:
+            parts.append(random_bases(rng, rng.randint(0, MAX_OUTER_BASES)))
+            start_trunc = rng.randint(0, MAX_ADAPTER_TRUNCATION)
+            parts.append(add_errors(rng, start_seq[start_trunc:], error_rate, error_profile))
+        parts.append(random_bases(rng, get_read_length(rng, length_distribution, mean_length,
+                                                       length_sd, min_length)))
+        if chimera:
+            if end_seq:
+                parts.append(add_errors(rng, end_seq, error_rate, error_profile))
+            parts.append(add_errors(rng, start_seq, error_rate, error_profile))
+            parts.append(random_bases(rng, get_read_length(rng, length_distribution, mean_length,
+                                                           length_sd, min_length)))
+        if has_end:
+            end_trunc = rng.randint(0, MAX_ADAPTER_TRUNCATION)
+            parts.append(add_errors(rng, end_seq[:len(end_seq) - end_trunc], error_rate,
+                                    error_profile))
+            parts.append(random_bases(rng, rng.randint(0, MAX_OUTER_BASES)))
+        seq = ''.join(parts)
+
+        header = 'synthetic_' + str(i + 1) + ' adapters=' + adapter_set.name.replace(' ', '_') + \
+                 ' start=' + ('yes' if has_start else 'no') + \
+                 ' end=' + ('yes' if has_end else 'no') + \
+                 ' chimera=' + ('yes' if chimera else 'no')
+        yield header, seq, random_qualities(rng, len(seq))
+
+
+def get_read_length(rng, length_distribution, mean_length, length_sd, min_length):
+    if length_distribution == 'fixed' or length_sd == 0:
+        length = mean_length
+    elif length_distribution == 'lognormal':
+        sigma_sq = math.log(1.0 + (length_sd / mean_length) ** 2)
+        length = rng.lognormvariate(math.log(mean_length) - sigma_sq / 2.0, math.sqrt(sigma_sq))
+    else:  # gamma
+        length = rng.gammavariate((mean_length / length_sd) ** 2, length_sd ** 2 / mean_length)
+    return max(min_length, int(round(length)))
+
+
+def random_bases(rng, length):
+    byte_count = (length + 3) // 4
+    data = rng.getrandbits(8 * byte_count).to_bytes(byte_count, 'little')
+    return ''.join(map(FOUR_BASES.__getitem__, data))[:length]
+
+
+def random_qualities(rng, length):
+    return rng.getrandbits(8 * length).to_bytes(length, 'little').translate(QUALITY_TABLE).decode()
+
+
+def add_errors(rng, seq, error_rate, error_profile):
+    """
+    Returns the sequence with random substitutions, insertions and deletions at the given total
+    per-base rate, in the given proportions.
+    """
+    if not error_rate:
+        return seq
+    new_seq = []
+    for base in seq:
+        if rng.random() >= error_rate:
+            new_seq.append(base)
+            continue
+        error_type = rng.choices(['substitution', 'insertion', 'deletion'], error_profile)[0]
+        if error_type == 'substitution':
+            new_seq.append(rng.choice([x for x in 'ACGT' if x != base]))
+        elif error_type == 'insertion':
+            new_seq.append(base)
+            new_seq.append(rng.choice('ACGT'))
+    return ''.join(new_seq)
+
+
+def write_reads(reads, out_file):
+    """
+    Writes the reads in FASTQ format and returns the number of reads and bases written.
+    """
+    read_count, base_count = 0, 0
+    for header, seq, quals in reads:
+        out_file.write('@' + header + '\n' + seq + '\n+\n' + quals + '\n')
+        read_count += 1
+        base_count += len(seq)
+    return read_count, base_count
+
+
+if __name__ == '__main__':
+    main()
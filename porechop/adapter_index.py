@@ -0,0 +1,120 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains a k-mer index of adapter sequences, used by the --kmer_prefilter option to
+skip the alignment of adapters which have nothing in common with a read end. It also has the exact
+k-mer seeding used by the seeded middle adapter search (--middle_search seeded).
+
+The prefilter trades some sensitivity for speed, so it is off by default. No k-mer count can
+guarantee that an alignment won't reach Porechop's identity thresholds: at 75% identity a 25 bp
+adapter can have 8 errors, enough to break every k-mer it shares with the read. And end trimming
+is based on the identity of just the aligned part of the adapter, which can be shorter than k when
+the read starts or ends partway through an adapter. Skipping a barcode also drops its score, which
+can change a --barcode_diff call. The loss depends on the reads and can be large even for small k:
+on one set of 500 synthetic reads, k = 6 changed 57 of the 507 output records and found 302
+instead of 344 end adapters.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+from collections import defaultdict
+
+# Seeds shorter than this would be found all over a long read, so adapters which would need them
+# are aligned to the whole read instead.
+MIN_SEED_SIZE = 5
+MAX_SEED_SIZE = 12
+
+
+class AdapterKmerIndex(object):
+    """
+    Maps each k-mer to the adapter sequences which contain it. It is made once for all of the
+    adapter sequences that will be aligned to one end of the reads.
+    """
+
+    def __init__(self, adapter_seqs, k):
+        self.k = k
+        self.kmers = defaultdict(list)
+        for adapter_seq in set(adapter_seqs):
+            for kmer in set(get_kmers(adapter_seq, k)):
+                self.kmers[kmer].append(adapter_seq)
+
+    def get_candidates(self, read_seq):
+        """
+        Returns the set of adapter sequences which share at least one k-mer with the read
+        sequence, i.e. the ones worth aligning.
+        """
+        candidates = set()
+        for kmer in set(get_kmers(read_seq, self.k)):
+            candidates.update(self.kmers.get(kmer, ()))
+        return candidates
+
+
+def get_kmers(seq, k):
+    return [seq[i:i+k] for i in range(len(seq) - k + 1)]
+
+
+def make_end_indices(adapters, k):
+    """
+    Returns one index for the adapters' start sequences and one for their end sequences.
+    """
+    start_index = AdapterKmerIndex([x.start_sequence[1] for x in adapters if x.start_sequence], k)
+    end_index = AdapterKmerIndex([x.end_sequence[1] for x in adapters if x.end_sequence], k)
+    return start_index, end_index
+
+
+def get_max_errors(adapter_length, min_identity):
+    """
+    Returns the most errors (mismatches, unaligned adapter bases and insertions) an alignment can
+    have and still reach min_identity over the adapter's full length. Insertions add to the
+    alignment length, so an identity of t allows at most adapter_length * (1 - t) / t errors.
+    """
+    t = min_identity / 100.0
+    return int(math.floor(adapter_length * (1.0 - t) / t + 1e-9))
+
+
+def get_exact_seed_size(adapter_length, min_identity):
+    """
+    Returns the largest k for which any alignment reaching min_identity must contain an exact match
+    to one of the adapter's first e + 1 non-overlapping k-mers, where e is the most errors allowed
+    (or 0 if there isn't a useful k). Each error falls in at most one of these k-mers, so with e
+    errors at least one of them is untouched.
+    """
+    if min_identity <= 0.0:
+        return 0
+    k = min(MAX_SEED_SIZE, adapter_length // (get_max_errors(adapter_length, min_identity) + 1))
+    return k if k >= MIN_SEED_SIZE else 0
+
+
+def find_seed_windows(read_seq, adapter_seq, k, max_errors):
+    """
+    Finds the adapter's first max_errors + 1 non-overlapping k-mers in the read and returns merged
+    (start, end) windows of the read, each wide enough to hold any alignment of the adapter (with
+    up to max_errors errors) which includes one of the seeds.
+    """
+    adapter_length = len(adapter_seq)
+    margin = max_errors + k
+    windows = []
+    for adapter_pos in range(0, (max_errors + 1) * k, k):
+        kmer = adapter_seq[adapter_pos:adapter_pos+k]
+        read_pos = read_seq.find(kmer)
+        while read_pos != -1:
+            diagonal = read_pos - adapter_pos
+            windows.append((max(0, diagonal - margin),
+                            min(len(read_seq), diagonal + adapter_length + margin)))
+            read_pos = read_seq.find(kmer, read_pos + 1)
+    windows.sort()
+    merged_windows = []
+    for start, end in windows:
+        if merged_windows and start <= merged_windows[-1][1]:
+            merged_windows[-1] = (merged_windows[-1][0], max(merged_windows[-1][1], end))
+        else:
+            merged_windows.append((start, end))
+    return merged_windows
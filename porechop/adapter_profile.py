@@ -0,0 +1,57 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains functions for saving and loading adapter profiles: the results of the adapter
+set search (the matching adapter sets with their scores and the barcode orientation). When a run is
+split into many jobs, the search can be done once with --save_adapter_profile and the other jobs
+can use its results with --adapter_profile instead of each repeating it.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import sys
+from .adapters import adapter_from_dict, get_adapter_catalogue_checksum
+from .version import __version__
+
+
+def save_adapter_profile(filename, matching_sets, forward_or_reverse_barcodes):
+    """
+    Saves the adapter sets found by the search (before the full barcode adapter sets are added).
+    """
+    profile = {'porechop_version': __version__,
+               'adapter_catalogue': get_adapter_catalogue_checksum(),
+               'matching_sets': [x.to_dict() for x in matching_sets],
+               'forward_or_reverse_barcodes': forward_or_reverse_barcodes}
+    with open(filename, 'wt') as profile_file:
+        json.dump(profile, profile_file, indent=1)
+
+
+def load_adapter_profile(filename):
+    """
+    Returns the matching adapter sets and barcode orientation (None if it wasn't chosen) from a
+    saved adapter profile. The profile must have been made with the same known adapters.
+    """
+    if not os.path.isfile(filename):
+        sys.exit('Error: could not find ' + filename)
+    try:
+        with open(filename, 'rt') as profile_file:
+            profile = json.load(profile_file)
+        catalogue = profile['adapter_catalogue']
+        matching_sets = [adapter_from_dict(x) for x in profile['matching_sets']]
+        forward_or_reverse_barcodes = profile['forward_or_reverse_barcodes']
+    except (ValueError, KeyError, TypeError):
+        sys.exit('Error: could not read adapter profile ' + filename)
+    if catalogue != get_adapter_catalogue_checksum():
+        sys.exit('Error: adapter profile ' + filename + ' was made with a different list of known '
+                 'adapters (Porechop v' + str(profile.get('porechop_version')) + ') - please '
+                 'make it again with --save_adapter_profile')
+    return matching_sets, forward_or_reverse_barcodes
@@ -14,6 +14,9 @@ details. You should have received a copy of the GNU General Public License along
 not, see <http://www.gnu.org/licenses/>.
 """
 
+import hashlib
+import json
+
 
 class Adapter(object):
 
@@ -51,6 +54,26 @@ class Adapter(object):
         barcode_name = sorted(possible_names, key=lambda x: len(x))[0]
         return barcode_name.replace(' ', '_')
 
+    def to_dict(self):
+        """
+        Returns the adapter (and its scores from the adapter set search) in a form that can be
+        saved as JSON.
+        """
+        return {'name': self.name,
+                'start_sequence': list(self.start_sequence),
+                'end_sequence': list(self.end_sequence),
+                'best_start_score': self.best_start_score,
+                'best_end_score': self.best_end_score}
+
+
+def adapter_from_dict(adapter_dict):
+    adapter = Adapter(adapter_dict['name'],
+                      start_sequence=tuple(adapter_dict['start_sequence']),
+                      end_sequence=tuple(adapter_dict['end_sequence']))
+    adapter.best_start_score = adapter_dict['best_start_score']
+    adapter.best_end_score = adapter_dict['best_end_score']
+    return adapter
+
 
 # INSTRUCTIONS FOR ADDING CUSTOM ADAPTERS
 # ---------------------------------------
@@ -463,6 +486,41 @@ ADAPTERS = [Adapter('SQK-NSK007',
                     end_sequence=('BC96_rev', 'ATGGTGGACTCTATGACCGTTCAG'))]
 
 
+def get_adapter_catalogue_checksum():
+    """
+    Returns a checksum of the known adapters' names and sequences, which identifies this version of
+    the ADAPTERS list (e.g. so a saved adapter profile isn't used with a different list).
+    """
+    catalogue = [[x.name, list(x.start_sequence), list(x.end_sequence)] for x in ADAPTERS]
+    return hashlib.sha1(json.dumps(catalogue).encode()).hexdigest()
+
+
+def get_adapter_sequence_names(custom_adapters=None):
+    """
+    Returns a dictionary of sequence -> name for every adapter sequence Porechop might align,
+    including the full barcode adapters and any custom adapters (given as (start sequence, end
+    sequence, name) like --custom_adapter).
+    """
+    adapter_sets = list(ADAPTERS)
+    for adapter_set in ADAPTERS:
+        if not adapter_set.is_barcode():
+            continue
+        barcode_num = int(adapter_set.name.split()[1])
+        if adapter_set.barcode_direction() == 'reverse':
+            adapter_sets.append(make_full_native_barcode_adapter(barcode_num))
+        else:
+            adapter_sets.append(make_old_full_rapid_barcode_adapter(barcode_num))
+            adapter_sets.append(make_new_full_rapid_barcode_adapter(barcode_num))
+    for start_seq, end_seq, name in (custom_adapters or []):
+        adapter_sets.append(Adapter(name, start_sequence=(name + '_(start)', start_seq),
+                                    end_sequence=(name + '_(end)', end_seq)))
+    names = {}
+    for adapter_set in adapter_sets:
+        for name, seq in [x for x in (adapter_set.start_sequence, adapter_set.end_sequence) if x]:
+            names.setdefault(seq, name)
+    return names
+
+
 def make_full_native_barcode_adapter(barcode_num):
     barcode = [x for x in ADAPTERS if x.name == 'Barcode ' + str(barcode_num) + ' (reverse)'][0]
     start_barcode_seq = barcode.start_sequence[1]
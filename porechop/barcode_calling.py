@@ -0,0 +1,243 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module calls the barcodes of many reads at once. It gives the same results as calling
+NanoporeRead.determine_barcode on each read, but the read's barcode scores are put into reads x
+barcodes matrices (one for the start and one for the end) and the best and second-best barcodes,
+the threshold and difference rules, --require_two_barcodes agreement and the Albacore check are
+worked out for all of the reads together with NumPy. If NumPy isn't installed, each read's barcode
+is just determined on its own. With dual barcodes, each end's barcode is called separately and the
+pair of calls is looked up in the sample sheet's pair table.
+
+Ties are broken like determine_barcode's stable sorts: of the barcodes with the same score, the one
+which was scored first for that read wins (and without --require_two_barcodes, a start barcode
+wins over an end barcode). So along with each score, the matrices hold the order in which the
+read's barcodes were scored.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Barcodes are called for this many reads at a time, which keeps the matrices small.
+BATCH_SIZE = 10000
+
+# The order given to barcodes which a read doesn't have a score for.
+MISSING_RANK = 2 ** 30
+
+
+def call_barcodes(reads, barcode_threshold, barcode_diff, require_two_barcodes,
+                  correct_read_direction, dual_barcodes=None):
+    """
+    Does the same as determine_barcode for each of the reads, which must have their start and end
+    barcode scores.
+    """
+    if np is None:
+        for read in reads:
+            read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes,
+                                   correct_read_direction, dual_barcodes)
+        return
+    for i in range(0, len(reads), BATCH_SIZE):
+        call_barcode_batch(reads[i:i+BATCH_SIZE], barcode_threshold, barcode_diff,
+                           require_two_barcodes, correct_read_direction, dual_barcodes)
+
+
+def call_barcode_batch(reads, barcode_threshold, barcode_diff, require_two_barcodes,
+                       correct_read_direction, dual_barcodes=None):
+    names, start_scores, start_ranks, end_scores, end_ranks = get_score_matrices(reads)
+    if dual_barcodes is None:
+        calls = call_barcodes_from_scores(start_scores, start_ranks, end_scores, end_ranks,
+                                          barcode_threshold, barcode_diff, require_two_barcodes)
+        call_names = names + ['none']
+    else:
+        calls = call_dual_barcodes_from_scores(names, start_scores, start_ranks, end_scores,
+                                               end_ranks, barcode_threshold, barcode_diff,
+                                               dual_barcodes)
+        call_names = dual_barcodes.sample_names + ['none']
+    best_start, best_start_score, second_start, second_start_score, best_end, best_end_score, \
+        second_end, second_end_score, barcode_call = [x.tolist() for x in calls]
+    names = names + ['none']  # so a column of -1 gives 'none'
+
+    for i, read in enumerate(reads):
+        read.best_start_barcode = (names[best_start[i]], best_start_score[i])
+        read.second_best_start_barcode = (names[second_start[i]], second_start_score[i])
+        read.best_end_barcode = (names[best_end[i]], best_end_score[i])
+        read.second_best_end_barcode = (names[second_end[i]], second_end_score[i])
+        read.barcode_call = call_names[barcode_call[i]]
+        if dual_barcodes is not None:
+            continue
+        if correct_read_direction and read.barcode_call.endswith('reverse'):
+            read.needs_reversing = True
+
+        # If the read has been binned by Albacore, then Porechop and Albacore must agree on the
+        # barcode. If they don't, the read is unclassified.
+        if read.albacore_barcode_call is not None and \
+                read.barcode_call != read.albacore_barcode_call:
+            read.barcode_call = 'none'
+
+
+def get_score_matrices(reads):
+    """
+    Returns the barcode names and the reads' start and end barcode scores as reads x barcodes
+    matrices, along with matrices of the order in which each read's barcodes were scored. Missing
+    scores are -inf.
+
+    Reads usually have their barcodes scored in the same order (the order of the adapter sets), so
+    reads are grouped by that order and each group's scores are put in the matrix at once.
+    """
+    groups = ({}, {})  # for the start and end: barcode names -> (read indices, score dicts)
+    for i, read in enumerate(reads):
+        for barcode_scores, side_groups in [(read.start_barcode_scores, groups[0]),
+                                            (read.end_barcode_scores, groups[1])]:
+            if barcode_scores:
+                group_names = tuple(barcode_scores)
+                try:
+                    group = side_groups[group_names]
+                except KeyError:
+                    group = side_groups[group_names] = ([], [])
+                group[0].append(i)
+                group[1].append(barcode_scores)
+    columns = {}
+    for side_groups in groups:
+        for group_names in side_groups:
+            for name in group_names:
+                columns.setdefault(name, len(columns))
+
+    shape = (len(reads), len(columns))
+    matrices = []
+    for side_groups in groups:
+        score_matrix = np.full(shape, -np.inf)
+        rank_matrix = np.full(shape, MISSING_RANK, dtype=np.int64)
+        for group_names, (rows, scores) in side_groups.items():
+            rows = np.array(rows)[:, np.newaxis]
+            cols = np.array([columns[x] for x in group_names])
+            scores = np.fromiter(itertools.chain.from_iterable(x.values() for x in scores),
+                                 dtype=np.float64, count=len(scores) * len(group_names))
+            score_matrix[rows, cols] = scores.reshape(len(rows), len(group_names))
+            rank_matrix[rows, cols] = np.arange(len(group_names))
+        matrices += [score_matrix, rank_matrix]
+    names = sorted(columns, key=columns.get)
+    return [names] + matrices
+
+
+def call_barcodes_from_scores(start_scores, start_ranks, end_scores, end_ranks,
+                              barcode_threshold, barcode_diff, require_two_barcodes):
+    """
+    Takes reads x barcodes matrices of start and end barcode scores (-inf where a read has no
+    score) and of the order in which each read's barcodes were scored. Returns arrays (one value
+    per read) of the best and second-best start barcodes and their scores, the same for the end
+    barcodes, and the barcode call. Barcodes are given by their column, or -1 for none (which has
+    a score of 0.0).
+    """
+    best_start, best_start_score, second_start, second_start_score = \
+        get_best_two(start_scores, start_ranks)
+    best_end, best_end_score, second_end, second_end_score = get_best_two(end_scores, end_ranks)
+
+    # If the user set --require_two_barcodes, then the criteria are much more stringent. Both the
+    # start and end barcodes need to be over the threshold, they both need to be sufficiently
+    # better than their second-best barcode hit, and they need to match.
+    if require_two_barcodes:
+        good_call = ((best_start_score >= barcode_threshold) &
+                     (best_end_score >= barcode_threshold) &
+                     (best_start_score >= second_start_score + barcode_diff) &
+                     (best_end_score >= second_end_score + barcode_diff) &
+                     (best_start == best_end))
+        barcode_call = np.where(good_call, best_start, -1)
+
+    # If the user didn't set --require_two_barcodes, then the criteria aren't so strict. The
+    # start/end barcodes are analysed all together, only keeping the best score for each barcode.
+    else:
+        rows = np.arange(start_scores.shape[0])
+        best_start_raw = np.where(best_start >= 0, best_start_score, -np.inf)
+        best_end_raw = np.where(best_end >= 0, best_end_score, -np.inf)
+        best_overall_raw = np.maximum(best_start_raw, best_end_raw)
+        has_best = best_overall_raw > -np.inf
+        best_overall = np.where(has_best,
+                                np.where(best_start_raw == best_overall_raw, best_start,
+                                         best_end), -1)
+        best_overall_score = np.where(has_best, best_overall_raw, 0.0)
+        all_scores = np.maximum(start_scores, end_scores)
+        all_scores[rows[has_best], best_overall[has_best]] = -np.inf
+        second_overall_score = get_max_or_zero(all_scores)
+        good_call = ((best_overall_score >= barcode_threshold) &
+                     (best_overall_score >= second_overall_score + barcode_diff))
+        barcode_call = np.where(good_call, best_overall, -1)
+
+    return (best_start, best_start_score, second_start, second_start_score,
+            best_end, best_end_score, second_end, second_end_score, barcode_call)
+
+
+def call_dual_barcodes_from_scores(names, start_scores, start_ranks, end_scores, end_ranks,
+                                   barcode_threshold, barcode_diff, dual_barcodes):
+    """
+    Like call_barcodes_from_scores, but the barcode call is the read's sample in the dual barcode
+    sample sheet (given by its number, or -1 for none). The best start barcode and best end barcode
+    are each called if they pass the threshold and difference rules, then the pair of calls is
+    looked up in the sheet's pair table (which has both orders of each pair).
+    """
+    best_start, best_start_score, second_start, second_start_score = \
+        get_best_two(start_scores, start_ranks)
+    best_end, best_end_score, second_end, second_end_score = get_best_two(end_scores, end_ranks)
+
+    # The sheet's number for each column's barcode, and -1 (the pair table's 'none' row and
+    # column) for a column of -1.
+    numbers = np.array([dual_barcodes.indices.get(x, -1) for x in names] + [-1])
+    start_call = np.where((best_start_score >= barcode_threshold) &
+                          (best_start_score >= second_start_score + barcode_diff),
+                          numbers[best_start], -1)
+    end_call = np.where((best_end_score >= barcode_threshold) &
+                        (best_end_score >= second_end_score + barcode_diff),
+                        numbers[best_end], -1)
+    barcode_call = np.array(dual_barcodes.pair_table)[start_call, end_call]
+
+    return (best_start, best_start_score, second_start, second_start_score,
+            best_end, best_end_score, second_end, second_end_score, barcode_call)
+
+
+def get_best_two(scores, ranks):
+    """
+    Returns the column and score of the best and second-best barcode for each read (the first two
+    after sorting the read's barcodes by score).
+    """
+    read_count = scores.shape[0]
+    if scores.shape[1] == 0:
+        no_barcode, no_score = np.full(read_count, -1), np.zeros(read_count)
+        return no_barcode, no_score, no_barcode, no_score
+    rows = np.arange(read_count)
+    best = get_best_columns(scores, ranks)
+    best_score = scores[rows, best]
+    remaining_scores = scores.copy()
+    remaining_scores[rows, best] = -np.inf
+    second = get_best_columns(remaining_scores, ranks)
+    second_score = remaining_scores[rows, second]
+    has_best, has_second = best_score > -np.inf, second_score > -np.inf
+    return (np.where(has_best, best, -1), np.where(has_best, best_score, 0.0),
+            np.where(has_second, second, -1), np.where(has_second, second_score, 0.0))
+
+
+def get_best_columns(scores, ranks):
+    """
+    Returns the column of each read's top score, choosing the first scored barcode if there is a
+    tie.
+    """
+    top_scores = scores.max(axis=1)
+    tied_ranks = np.where(scores == top_scores[:, np.newaxis], ranks, MISSING_RANK + 1)
+    return tied_ranks.argmin(axis=1)
+
+
+def get_max_or_zero(scores):
+    if scores.shape[1] == 0:
+        return np.zeros(scores.shape[0])
+    top_scores = scores.max(axis=1)
+    return np.where(top_scores > -np.inf, top_scores, 0.0)
@@ -0,0 +1,132 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains a writer for gzipped output in the BGZF format (as used by samtools/htslib).
+BGZF is ordinary multi-member gzip, so any gzip reader can read it, but each member holds at most
+64 kB of data and records its own size, so tools like bgzip and samtools can index it.
+
+Because the blocks are independent, they can be compressed in parallel. The writer hands blocks to
+a pool of threads (zlib releases the GIL while it compresses) and writes them to the file in order
+as they finish, so the output is compressed on the fly while reads are still being produced.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+import zlib
+from collections import deque
+
+# The most uncompressed data htslib puts in one block, and the largest a compressed block (with
+# its 18 byte header and 8 byte footer) can be.
+BGZF_BLOCK_SIZE = 65280
+BGZF_MAX_BLOCK_SIZE = 65536
+
+# The empty block which marks the end of a BGZF file.
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Data is sent to the compression threads in pieces of this many blocks.
+BLOCKS_PER_TASK = 16
+
+COMPRESSION_LEVEL = 6
+
+
+class BgzfWriter(object):
+    """
+    A write-only text file which is saved in the BGZF format. If a multiprocessing ThreadPool is
+    given, blocks are compressed in its threads and at most max_pending pieces of data are waiting
+    to be written at once. The pool can be shared by many writers. If append is True, the blocks
+    are added to the end of an existing BGZF file (which must not have its EOF block).
+    """
+
+    def __init__(self, filename, pool=None, max_pending=1, append=False):
+        self.name = filename
+        self.file = open(filename, 'ab' if append else 'wb')
+        self.pool = pool
+        self.max_pending = max(1, max_pending)
+        self.buffer, self.buffer_size = [], 0
+        self.pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, text):
+        data = text.encode()
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= BLOCKS_PER_TASK * BGZF_BLOCK_SIZE:
+            self.compress_buffer(final=False)
+
+    def flush(self):
+        """
+        Compresses and writes everything written so far. The last block may be smaller than usual.
+        """
+        self.compress_buffer(final=True)
+        self.write_finished(final=True)
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.compress_buffer(final=True)
+        self.write_finished(final=True)
+        self.file.write(BGZF_EOF)
+        self.file.close()
+
+    def compress_buffer(self, final):
+        """
+        Sends the buffered data off to be compressed. Unless this is the end of the file, any data
+        which wouldn't fill a whole block is kept in the buffer.
+        """
+        data = b''.join(self.buffer)
+        end = len(data) if final else len(data) - (len(data) % BGZF_BLOCK_SIZE)
+        self.buffer = [data[end:]]
+        self.buffer_size = len(data) - end
+        if not end:
+            return
+        if self.pool is None:
+            self.file.write(make_bgzf_blocks(data[:end]))
+        else:
+            self.pending.append(self.pool.apply_async(make_bgzf_blocks, (data[:end],)))
+            self.write_finished(final=False)
+
+    def write_finished(self, final):
+        """
+        Writes compressed data to the file, in order. This waits for the compression threads if
+        too much data is pending (or if this is the end of the file).
+        """
+        while self.pending and (final or len(self.pending) > self.max_pending or
+                                self.pending[0].ready()):
+            self.file.write(self.pending.popleft().get())
+
+
+def make_bgzf_blocks(data):
+    return b''.join(make_bgzf_block(data[i:i+BGZF_BLOCK_SIZE])
+                    for i in range(0, len(data), BGZF_BLOCK_SIZE))
+
+
+def make_bgzf_block(data):
+    """
+    Compresses up to BGZF_BLOCK_SIZE bytes of data into a single BGZF block: a gzip member with a
+    'BC' extra field holding the block's size.
+    """
+    compressed = raw_deflate(data, COMPRESSION_LEVEL)
+    if len(compressed) + 26 > BGZF_MAX_BLOCK_SIZE:  # incompressible data
+        compressed = raw_deflate(data, 0)
+    header = struct.pack('<BBBBIBBHBBHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                         len(compressed) + 25)
+    return header + compressed + struct.pack('<II', zlib.crc32(data), len(data))
+
+
+def raw_deflate(data, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
@@ -0,0 +1,202 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the writer for barcode bins. With many barcodes (and more so with dual barcode
+combinations) there can be hundreds of bin files, so they aren't each given an open file which is
+written to as reads arrive. Instead, each bin's reads are buffered in memory and written out in
+large pieces by a background thread. That thread only keeps a limited number of files open at once
+(closing the least recently used one when it needs another), and reopens a file to append to it
+when that bin has more to write.
+
+Gzipped bins are written in the BGZF format, like other gzipped output. BGZF files are just
+independent compressed blocks one after another, so each piece of a bin can be compressed on its
+own (in a thread pool, if one is given) and appended to the file.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import queue
+import threading
+from collections import OrderedDict
+from .bgzf_writer import BGZF_BLOCK_SIZE, BGZF_EOF, BLOCKS_PER_TASK, make_bgzf_blocks
+
+# A bin's reads are written out once this much is buffered (about 1 MB, a whole number of BGZF
+# blocks), and the largest bin is written out whenever all bins together hold more than
+# MAX_BUFFERED_SIZE.
+BIN_BUFFER_SIZE = BLOCKS_PER_TASK * BGZF_BLOCK_SIZE
+MAX_BUFFERED_SIZE = 64 * 1024 * 1024
+
+# The most bin files the writer thread keeps open at once.
+MAX_OPEN_FILES = 64
+
+# Put on the writer thread's queue to make it flush its open files.
+FLUSH = 'flush'
+
+
+class BinWriter(object):
+    """
+    Writes reads to one file per barcode bin in barcode_dir. Use write(bin_name, text) for each
+    read and close() at the end (or use it as a context manager). The files of any append_bins
+    already exist (from a resumed run) and are added to instead of replaced.
+    """
+
+    def __init__(self, barcode_dir, out_format, gzipped, compression_pool=None, threads=1,
+                 max_open_files=MAX_OPEN_FILES, append_bins=()):
+        self.barcode_dir = barcode_dir
+        self.extension = out_format + ('.gz' if gzipped else '')
+        self.gzipped = gzipped
+        self.compression_pool = compression_pool
+        self.max_open_files = max(1, max_open_files)
+
+        self.bin_names = list(append_bins)
+        self.buffers = {bin_name: [] for bin_name in self.bin_names}
+        self.buffer_sizes = {bin_name: 0 for bin_name in self.bin_names}
+        self.total_buffered = 0
+
+        # Only the writer thread uses these.
+        self.open_files = OrderedDict()
+        self.started_files = set(append_bins)
+        self.error = None
+
+        self.queue = queue.Queue(maxsize=max(4, 2 * threads))
+        self.thread = threading.Thread(target=self.write_pieces, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_filename(self, bin_name):
+        return os.path.join(self.barcode_dir, bin_name + '.' + self.extension)
+
+    def get_filenames(self):
+        return [self.get_filename(bin_name) for bin_name in self.bin_names]
+
+    def write(self, bin_name, text):
+        data = text.encode()
+        if bin_name not in self.buffers:
+            self.buffers[bin_name], self.buffer_sizes[bin_name] = [], 0
+            self.bin_names.append(bin_name)
+        self.buffers[bin_name].append(data)
+        self.buffer_sizes[bin_name] += len(data)
+        self.total_buffered += len(data)
+        if self.buffer_sizes[bin_name] >= BIN_BUFFER_SIZE:
+            self.flush_bin(bin_name, whole_blocks_only=True)
+        if self.total_buffered > MAX_BUFFERED_SIZE:
+            self.flush_bin(max(self.buffer_sizes, key=self.buffer_sizes.get),
+                           whole_blocks_only=False)
+
+    def flush(self):
+        """
+        Writes out everything buffered so far and waits until it is in the files.
+        """
+        for bin_name in self.bin_names:
+            self.flush_bin(bin_name, whole_blocks_only=False)
+        self.queue.put(FLUSH)
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """
+        Writes out everything that is still buffered, waits for the writer thread to finish and
+        closes the files.
+        """
+        if self.thread is None:
+            return
+        for bin_name in self.bin_names:
+            self.flush_bin(bin_name, whole_blocks_only=False)
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            raise self.error
+
+    def flush_bin(self, bin_name, whole_blocks_only):
+        """
+        Hands a bin's buffered data to the writer thread. Gzipped bins are usually flushed in whole
+        BGZF blocks (keeping the rest buffered) so their files aren't made of many small blocks.
+        """
+        data = b''.join(self.buffers[bin_name])
+        end = len(data)
+        if whole_blocks_only and self.gzipped:
+            end -= end % BGZF_BLOCK_SIZE
+        self.buffers[bin_name] = [data[end:]] if end < len(data) else []
+        self.buffer_sizes[bin_name] = len(data) - end
+        self.total_buffered -= end
+        if self.error is not None:
+            raise self.error
+        if not end:
+            return
+        if self.gzipped and self.compression_pool is not None:
+            self.queue.put((bin_name, None,
+                            self.compression_pool.apply_async(make_bgzf_blocks, (data[:end],))))
+        else:
+            self.queue.put((bin_name, data[:end], None))
+
+    def write_pieces(self):
+        """
+        The writer thread: takes pieces of bins off the queue (in the order they were flushed) and
+        appends them to the bins' files. If anything goes wrong, the rest of the queue is still
+        taken (so the main thread is never left waiting) but nothing more is written.
+        """
+        while True:
+            piece = self.queue.get()
+            try:
+                if piece is None:
+                    break
+                if self.error is not None:
+                    continue
+                if piece == FLUSH:
+                    for open_file in self.open_files.values():
+                        open_file.flush()
+                    continue
+                bin_name, data, compressed = piece
+                if compressed is not None:
+                    data = compressed.get()
+                elif self.gzipped:
+                    data = make_bgzf_blocks(data)
+                self.get_open_file(bin_name).write(data)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+        try:
+            if self.error is None and self.gzipped:
+                for bin_name in self.started_files:
+                    self.get_open_file(bin_name).write(BGZF_EOF)
+        except Exception as e:
+            self.error = e
+        finally:
+            for open_file in self.open_files.values():
+                open_file.close()
+            self.open_files.clear()
+
+    def get_open_file(self, bin_name):
+        """
+        Returns the bin's file, opening it if necessary. A bin's file is created (replacing any
+        old one) the first time and appended to after that.
+        """
+        try:
+            self.open_files.move_to_end(bin_name)
+            return self.open_files[bin_name]
+        except KeyError:
+            pass
+        while len(self.open_files) >= self.max_open_files:
+            _, least_recent_file = self.open_files.popitem(last=False)
+            least_recent_file.close()
+        mode = 'ab' if bin_name in self.started_files else 'wb'
+        self.started_files.add(bin_name)
+        open_file = open(self.get_filename(bin_name), mode)
+        self.open_files[bin_name] = open_file
+        return open_file
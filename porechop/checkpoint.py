@@ -0,0 +1,171 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the checkpoint file used by --checkpoint, which lets a chunked run be resumed
+if it is stopped partway (e.g. a cluster job which is preempted). The checkpoint file is saved
+after each chunk of reads has been written. It holds the chosen adapter sets, how far through the
+input the run got and how big each output file was at that point, along with the counts needed for
+the summaries.
+
+When a run is resumed, the output files are cut back to those sizes (dropping anything written
+after the checkpoint), the adapter set search is skipped and the input reads which were already
+done are skipped over. The checkpoint file is deleted when the run finishes.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import os
+import sys
+from collections import defaultdict, Counter
+from .adapters import adapter_from_dict
+from .bin_writer import BinWriter
+from .version import __version__
+
+# Settings which don't change the output, so a run can be resumed with different values for them.
+RESUMABLE_SETTINGS = {'threads', 'verbosity', 'print_dest', 'worker_type', 'aligner',
+                      'checkpoint', 'save_adapter_profile', 'metrics', 'metrics_adapters'}
+
+
+class Checkpoint(object):
+
+    def __init__(self, filename, settings):
+        self.filename = filename
+        self.settings = settings
+        self.resumed = False
+
+        self.read_type = None
+        self.matching_sets = []
+        self.forward_or_reverse_barcodes = None
+
+        # How far through the input the run has got: (input file, reads used from that file).
+        self.input_position = None
+        self.reads_done = 0
+        self.output_sizes = {}
+
+        self.end_counts, self.middle_counts = Counter(), Counter()
+        self.barcode_read_counts = defaultdict(int)
+        self.barcode_base_counts = defaultdict(int)
+
+        # The output_reads function sets this to the file (or BinWriter) it is writing to.
+        self.output = None
+
+    def start(self, read_type, matching_sets, forward_or_reverse_barcodes):
+        """
+        Saves the results of the adapter set search, so a resumed run doesn't need to redo it.
+        """
+        self.read_type = read_type
+        self.matching_sets = matching_sets
+        self.forward_or_reverse_barcodes = forward_or_reverse_barcodes
+        self.save()
+
+    def save_after_each_chunk(self, read_chunks):
+        """
+        A generator which passes on the reads of each (reads, input position) chunk. Once all of a
+        chunk's reads have been taken (i.e. written), the output is flushed and the checkpoint is
+        saved.
+        """
+        for reads, input_position in read_chunks:
+            yield from reads
+            self.reads_done += len(reads)
+            self.input_position = input_position
+            if self.output is not None:
+                self.output.flush()
+                if isinstance(self.output, BinWriter):
+                    filenames = self.output.get_filenames()
+                else:
+                    filenames = [self.output.name]
+                self.output_sizes = {os.path.abspath(f): os.path.getsize(f) for f in filenames}
+            self.save()
+
+    def has_output(self, filename):
+        return os.path.abspath(filename) in self.output_sizes
+
+    def save(self):
+        """
+        Writes the checkpoint file. It is written to a temporary file first and then renamed, so
+        the checkpoint file is never left half-written.
+        """
+        state = {'porechop_version': __version__,
+                 'settings': self.settings,
+                 'read_type': self.read_type,
+                 'matching_sets': [x.to_dict() for x in self.matching_sets],
+                 'forward_or_reverse_barcodes': self.forward_or_reverse_barcodes,
+                 'input_position': self.input_position,
+                 'reads_done': self.reads_done,
+                 'output_sizes': self.output_sizes,
+                 'end_counts': self.end_counts,
+                 'middle_counts': self.middle_counts,
+                 'barcode_read_counts': self.barcode_read_counts,
+                 'barcode_base_counts': self.barcode_base_counts}
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'wt') as checkpoint_file:
+            json.dump(state, checkpoint_file, indent=1)
+        os.replace(temp_filename, self.filename)
+
+    def finish(self):
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+
+
+def get_checkpoint_settings(args):
+    """
+    Returns the run's settings which affect its output, in a form that can be saved as JSON.
+    """
+    settings = {key: value for key, value in vars(args).items() if key not in RESUMABLE_SETTINGS}
+    for key in ['input', 'output', 'barcode_dir', 'adapter_profile', 'dual_barcodes']:
+        if settings[key] is not None:
+            settings[key] = os.path.abspath(settings[key])
+    return json.loads(json.dumps(settings))
+
+
+def load_checkpoint(filename, settings):
+    """
+    Returns a Checkpoint for the run. If the checkpoint file already exists, the run is resumed
+    from it: its output files are cut back to their sizes at the checkpoint.
+    """
+    checkpoint = Checkpoint(filename, settings)
+    if not os.path.isfile(filename):
+        return checkpoint
+    try:
+        with open(filename, 'rt') as checkpoint_file:
+            state = json.load(checkpoint_file)
+        version, saved_settings = state['porechop_version'], state['settings']
+        checkpoint.read_type = state['read_type']
+        checkpoint.matching_sets = [adapter_from_dict(x) for x in state['matching_sets']]
+        checkpoint.forward_or_reverse_barcodes = state['forward_or_reverse_barcodes']
+        if state['input_position'] is not None:
+            checkpoint.input_position = tuple(state['input_position'])
+        checkpoint.reads_done = state['reads_done']
+        checkpoint.output_sizes = state['output_sizes']
+        checkpoint.end_counts.update(state['end_counts'])
+        checkpoint.middle_counts.update(state['middle_counts'])
+        checkpoint.barcode_read_counts.update(state['barcode_read_counts'])
+        checkpoint.barcode_base_counts.update(state['barcode_base_counts'])
+    except (ValueError, KeyError, TypeError):
+        sys.exit('Error: could not read checkpoint file ' + filename)
+
+    if version != __version__:
+        sys.exit('Error: checkpoint file ' + filename + ' was made by Porechop v' + version +
+                 ' and cannot be resumed by v' + __version__)
+    changed_settings = sorted(key for key in set(settings) | set(saved_settings)
+                              if settings.get(key) != saved_settings.get(key))
+    if changed_settings:
+        sys.exit('Error: checkpoint file ' + filename + ' is for a run with different settings ('
+                 + ', '.join(changed_settings) + ')')
+
+    for output_filename, size in checkpoint.output_sizes.items():
+        if not os.path.isfile(output_filename) or os.path.getsize(output_filename) < size:
+            sys.exit('Error: cannot resume from checkpoint file ' + filename + ' because ' +
+                     output_filename + ' is missing or incomplete')
+        with open(output_filename, 'r+b') as output_file:
+            output_file.truncate(size)
+    checkpoint.resumed = True
+    return checkpoint
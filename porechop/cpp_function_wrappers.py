@@ -2,8 +2,11 @@
 Copyright 2017 Ryan Wick (rrwick@gmail.com)
 https://github.com/rrwick/Porechop
 
-Porechop makes use of C++ functions which are compiled in cpp_functions.so. This module uses ctypes
-to wrap them in similarly named Python functions.
+Porechop makes use of C++ functions which are compiled in cpp_functions.so. This module wraps them
+in similarly named Python functions. If the cpp_extension module was built (it needs the Python
+headers), the wrappers call the functions through it: it takes the read codes and handle arrays
+from their own buffers and releases the GIL while aligning. Otherwise they use ctypes, which can
+also be chosen with set_backend. cpp_functions.so is only loaded when the ctypes backend is used.
 
 This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
 it under the terms of the GNU General Public License as published by the Free Software Foundation,
@@ -16,48 +19,391 @@ not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
-from ctypes import CDLL, cast, c_char_p, c_int, c_void_p
+import threading
+import time
+from ctypes import CDLL, byref, c_char_p, c_int, c_double, POINTER, Structure
+from . import metrics
+try:
+    from . import cpp_extension
+except ImportError:
+    cpp_extension = None
+
+
+class AlignmentResult(Structure):
+    """
+    The numeric results of one adapter alignment. This must match the AlignmentResult struct in
+    alignment.h.
+    """
+    _fields_ = [('read_start', c_int),
+                ('read_end', c_int),
+                ('adapter_start', c_int),
+                ('adapter_end', c_int),
+                ('raw_score', c_int),
+                ('aligned_region_percent_identity', c_double),
+                ('full_adapter_percent_identity', c_double)]
+
 
 SO_FILE = 'cpp_functions.so'
 SO_FILE_FULL = os.path.join(os.path.dirname(os.path.realpath(__file__)), SO_FILE)
-if not os.path.isfile(SO_FILE_FULL):
-    sys.exit('could not find ' + SO_FILE + ' - please reinstall')
-C_LIB = CDLL(SO_FILE_FULL)
+C_LIB = None
 
-C_LIB.adapterAlignment.argtypes = [c_char_p,  # Read sequence
-                                   c_char_p,  # Adapter sequence
-                                   c_int,     # Match score
-                                   c_int,     # Mismatch score
-                                   c_int,     # Gap open score
-                                   c_int]     # Gap extension score
-C_LIB.adapterAlignment.restype = c_void_p     # String describing alignment
+# The functions of each aligner, for each backend: (single, batch, pairs, all hits).
+ALIGNERS = {}
+
+
+def load_c_lib():
+    """
+    Loads cpp_functions.so and adds the ctypes backend. This is only needed if the cpp_extension
+    module wasn't built or the ctypes backend is chosen with set_backend.
+    """
+    global C_LIB
+    if C_LIB is not None:
+        return
+    if not os.path.isfile(SO_FILE_FULL):
+        sys.exit('could not find ' + SO_FILE + ' - please reinstall')
+    c_lib = CDLL(SO_FILE_FULL)
 
+    c_lib.adapterAlignment.argtypes = [c_char_p,                 # Read sequence
+                                       c_char_p,                 # Adapter sequence
+                                       c_int,                    # Match score
+                                       c_int,                    # Mismatch score
+                                       c_int,                    # Gap open score
+                                       c_int,                    # Gap extension score
+                                       POINTER(AlignmentResult)]  # Result
+    c_lib.adapterAlignment.restype = None
 
-# This function cleans up the heap memory for the C strings returned by the other C functions. It
-# must be called after them.
-C_LIB.freeCString.argtypes = [c_void_p]
-C_LIB.freeCString.restype = None
+    c_lib.adapterAlignmentBatch.argtypes = [c_char_p,                 # Read codes
+                                            c_int,                    # Read window start
+                                            c_int,                    # Read window length
+                                            POINTER(c_int),           # Adapter handles
+                                            c_int,                    # Adapter count
+                                            c_int,                    # Match score
+                                            c_int,                    # Mismatch score
+                                            c_int,                    # Gap open score
+                                            c_int,                    # Gap extension score
+                                            POINTER(AlignmentResult)]  # Results (one per adapter)
+    c_lib.adapterAlignmentBatch.restype = None
+
+    c_lib.adapterAlignmentPairs.argtypes = [POINTER(c_char_p),        # Read codes
+                                            POINTER(c_int),           # Read window starts
+                                            POINTER(c_int),           # Read window lengths
+                                            POINTER(c_int),           # Adapter handles
+                                            c_int,                    # Pair count
+                                            c_int,                    # Match score
+                                            c_int,                    # Mismatch score
+                                            c_int,                    # Gap open score
+                                            c_int,                    # Gap extension score
+                                            POINTER(AlignmentResult)]  # Results (one per pair)
+    c_lib.adapterAlignmentPairs.restype = None
+
+    c_lib.adapterAllHits.argtypes = [c_char_p,                 # Read sequence
+                                     c_char_p,                 # Adapter sequence
+                                     c_int,                    # Match score
+                                     c_int,                    # Mismatch score
+                                     c_int,                    # Gap open score
+                                     c_int,                    # Gap extension score
+                                     c_double,                 # Minimum full adapter identity
+                                     POINTER(AlignmentResult),  # Results (one per hit)
+                                     c_int]                    # Room in results
+    c_lib.adapterAllHits.restype = c_int
+
+    c_lib.registerAdapter.argtypes = [c_char_p,  # Adapter codes
+                                      c_int,     # Adapter length
+                                      c_int,     # Match score
+                                      c_int]     # Mismatch score
+    c_lib.registerAdapter.restype = c_int
+
+    # The fast aligner's functions take the same arguments as the SeqAn ones and give the same
+    # results.
+    c_lib.fastAdapterAlignment.argtypes = c_lib.adapterAlignment.argtypes
+    c_lib.fastAdapterAlignment.restype = None
+    c_lib.fastAdapterAlignmentBatch.argtypes = c_lib.adapterAlignmentBatch.argtypes
+    c_lib.fastAdapterAlignmentBatch.restype = None
+    c_lib.fastAdapterAlignmentPairs.argtypes = c_lib.adapterAlignmentPairs.argtypes
+    c_lib.fastAdapterAlignmentPairs.restype = None
+    c_lib.fastAdapterAllHits.argtypes = c_lib.adapterAllHits.argtypes
+    c_lib.fastAdapterAllHits.restype = c_int
+
+    ALIGNERS['ctypes'] = {'seqan': (c_lib.adapterAlignment, c_lib.adapterAlignmentBatch,
+                                    c_lib.adapterAlignmentPairs, c_lib.adapterAllHits),
+                          'fast': (c_lib.fastAdapterAlignment, c_lib.fastAdapterAlignmentBatch,
+                                   c_lib.fastAdapterAlignmentPairs, c_lib.fastAdapterAllHits)}
+    C_LIB = c_lib
+
+
+if cpp_extension is not None:
+    ALIGNERS['extension'] = {'seqan': (cpp_extension.adapter_alignment,
+                                       cpp_extension.adapter_alignment_batch,
+                                       cpp_extension.adapter_alignment_pairs,
+                                       cpp_extension.adapter_all_hits),
+                             'fast': (cpp_extension.fast_adapter_alignment,
+                                      cpp_extension.fast_adapter_alignment_batch,
+                                      cpp_extension.fast_adapter_alignment_pairs,
+                                      cpp_extension.fast_adapter_all_hits)}
+if cpp_extension is None:
+    load_c_lib()
+BACKEND = 'ctypes' if cpp_extension is None else 'extension'
+ALIGNER = 'seqan'
+ALIGNMENT_FUNCTION, BATCH_ALIGNMENT_FUNCTION, PAIRS_ALIGNMENT_FUNCTION, ALL_HITS_FUNCTION = \
+    ALIGNERS[BACKEND][ALIGNER]
+
+
+def set_aligner(aligner):
+    """
+    Chooses which C++ aligner the wrappers below use: 'seqan' (SeqAn's globalAlignment) or 'fast'
+    (Porechop's own semi-global aligner, which aligns up to eight adapters at once with SIMD).
+    """
+    global ALIGNER, ALIGNMENT_FUNCTION, BATCH_ALIGNMENT_FUNCTION, PAIRS_ALIGNMENT_FUNCTION, \
+        ALL_HITS_FUNCTION
+    ALIGNER = aligner
+    ALIGNMENT_FUNCTION, BATCH_ALIGNMENT_FUNCTION, PAIRS_ALIGNMENT_FUNCTION, ALL_HITS_FUNCTION = \
+        ALIGNERS[BACKEND][aligner]
+
+
+def set_backend(backend):
+    """
+    Chooses how the wrappers below call the C++ functions: 'extension' (the cpp_extension module)
+    or 'ctypes'. Both give the same results. Adapters are registered separately for each backend,
+    as they each have their own copy of the C++ code.
+    """
+    global BACKEND
+    if backend == 'ctypes':
+        load_c_lib()
+    if backend not in ALIGNERS:
+        sys.exit('Error: the ' + backend + ' backend is not available - please reinstall')
+    BACKEND = backend
+    set_aligner(ALIGNER)
 
 
 def adapter_alignment(read_sequence, adapter_sequence, scoring_scheme_vals):
     """
-    Python wrapper for adapterAlignment C++ function.
+    Python wrapper for adapterAlignment C++ function (or fastAdapterAlignment). Returns an
+    AlignmentResult.
     """
     match_score = scoring_scheme_vals[0]
     mismatch_score = scoring_scheme_vals[1]
     gap_open_score = scoring_scheme_vals[2]
     gap_extend_score = scoring_scheme_vals[3]
-    ptr = C_LIB.adapterAlignment(read_sequence.encode('utf-8'), adapter_sequence.encode('utf-8'),
-                                 match_score, mismatch_score, gap_open_score, gap_extend_score)
-    result_string = c_string_to_python_string(ptr)
-    return result_string
+    start_time = time.perf_counter() if metrics.METRICS is not None else None
+    if BACKEND == 'extension':
+        result = ALIGNMENT_FUNCTION(read_sequence, adapter_sequence, match_score, mismatch_score,
+                                    gap_open_score, gap_extend_score)
+    else:
+        result = AlignmentResult()
+        ALIGNMENT_FUNCTION(read_sequence.encode('utf-8'), adapter_sequence.encode('utf-8'),
+                           match_score, mismatch_score, gap_open_score, gap_extend_score,
+                           byref(result))
+    if start_time is not None:
+        record_alignments([adapter_sequence], [len(read_sequence) * len(adapter_sequence)],
+                          start_time)
+    return result
+
+
+def adapter_alignment_batch(read_end, adapter_sequences, scoring_scheme_vals, start=0,
+                            length=None):
+    """
+    Python wrapper for adapterAlignmentBatch C++ function (or fastAdapterAlignmentBatch). Aligns
+    many adapters to an EncodedSequence (or to length bases of it from start) and returns a
+    sequence with one AlignmentResult per adapter, with read positions in the window.
+    """
+    if length is None:
+        length = len(read_end) - start
+    adapter_count = len(adapter_sequences)
+    if not adapter_count:
+        return []
+    start_time = time.perf_counter() if metrics.METRICS is not None else None
+    handle_array = get_adapter_handle_array(adapter_sequences, scoring_scheme_vals)
+    if BACKEND == 'extension':
+        results = BATCH_ALIGNMENT_FUNCTION(read_end.codes, start, length, handle_array,
+                                           scoring_scheme_vals[0], scoring_scheme_vals[1],
+                                           scoring_scheme_vals[2], scoring_scheme_vals[3])
+    else:
+        results = (AlignmentResult * adapter_count)()
+        BATCH_ALIGNMENT_FUNCTION(read_end.codes, start, length, handle_array, adapter_count,
+                                 scoring_scheme_vals[0], scoring_scheme_vals[1],
+                                 scoring_scheme_vals[2], scoring_scheme_vals[3], results)
+    if start_time is not None:
+        record_alignments(adapter_sequences, [length * len(x) for x in adapter_sequences],
+                          start_time)
+    return results
+
+
+def adapter_alignment_pairs(read_windows, adapter_sequences, scoring_scheme_vals):
+    """
+    Python wrapper for adapterAlignmentPairs C++ function (or fastAdapterAlignmentPairs). Each read
+    window is an (EncodedSequence, start, length) tuple, so many windows can share one encoded
+    sequence. Aligns each read window to the adapter sequence at the same index and returns a
+    sequence with one AlignmentResult per pair. The fast aligner packs the pairs into SIMD lanes,
+    so it is quickest to give it many pairs at once.
+    """
+    pair_count = len(read_windows)
+    if not pair_count:
+        return []
+    start_time = time.perf_counter() if metrics.METRICS is not None else None
+    read_codes = [x[0].codes for x in read_windows]
+    read_starts = [x[1] for x in read_windows]
+    read_lengths = [x[2] for x in read_windows]
+    handles = register_adapters(adapter_sequences, scoring_scheme_vals)
+    if BACKEND == 'extension':
+        results = PAIRS_ALIGNMENT_FUNCTION(read_codes, read_starts, read_lengths, handles,
+                                           scoring_scheme_vals[0], scoring_scheme_vals[1],
+                                           scoring_scheme_vals[2], scoring_scheme_vals[3])
+    else:
+        results = (AlignmentResult * pair_count)()
+        PAIRS_ALIGNMENT_FUNCTION((c_char_p * pair_count)(*read_codes),
+                                 (c_int * pair_count)(*read_starts),
+                                 (c_int * pair_count)(*read_lengths),
+                                 (c_int * pair_count)(*handles), pair_count,
+                                 scoring_scheme_vals[0], scoring_scheme_vals[1],
+                                 scoring_scheme_vals[2], scoring_scheme_vals[3], results)
+    if start_time is not None:
+        record_alignments(adapter_sequences, [x * len(y) for x, y in
+                                              zip(read_lengths, adapter_sequences)],
+                          start_time)
+    return results
+
+
+def adapter_all_hits(read_sequence, adapter_sequence, scoring_scheme_vals, min_identity):
+    """
+    Python wrapper for adapterAllHits C++ function (or fastAdapterAllHits). Returns a list of
+    AlignmentResults, one for each hit of the adapter with at least min_identity full adapter
+    identity, in the order they were found.
+    """
+    start_time = time.perf_counter() if metrics.METRICS is not None else None
+    if BACKEND == 'extension':
+        results = ALL_HITS_FUNCTION(read_sequence, adapter_sequence, scoring_scheme_vals[0],
+                                    scoring_scheme_vals[1], scoring_scheme_vals[2],
+                                    scoring_scheme_vals[3], min_identity)
+        alignment_count = len(results) + 1
+    else:
+        results, alignment_count = ctypes_all_hits(read_sequence, adapter_sequence,
+                                                   scoring_scheme_vals, min_identity)
+    if start_time is not None and read_sequence and adapter_sequence:
+        # The whole read is realigned after each hit, and once more to find there are no more.
+        record_alignments([adapter_sequence] * alignment_count,
+                          [len(read_sequence) * len(adapter_sequence)] * alignment_count,
+                          start_time)
+    return results
 
 
-def c_string_to_python_string(c_string):
+def ctypes_all_hits(read_sequence, adapter_sequence, scoring_scheme_vals, min_identity):
     """
-    This function casts a C string to a Python string and then calls a function to delete the C
-    string from the heap.
+    Runs adapterAllHits through ctypes, again with more room for results if there wasn't enough.
+    Returns the hits and the number of alignments done for them.
     """
-    python_string = cast(c_string, c_char_p).value.decode()
-    C_LIB.freeCString(c_string)
-    return python_string
+    read_sequence = read_sequence.encode('utf-8')
+    adapter_sequence = adapter_sequence.encode('utf-8')
+    max_results, alignment_count = 8, 0
+    while True:
+        results = (AlignmentResult * max_results)()
+        hit_count = ALL_HITS_FUNCTION(read_sequence, adapter_sequence, scoring_scheme_vals[0],
+                                      scoring_scheme_vals[1], scoring_scheme_vals[2],
+                                      scoring_scheme_vals[3], min_identity, results, max_results)
+        alignment_count += hit_count + 1
+        if hit_count <= max_results:
+            return results[:hit_count], alignment_count
+        max_results = hit_count
+
+
+def record_alignments(adapter_sequences, dp_cells, start_time):
+    """
+    Adds an alignment call to the --metrics counts: the adapters aligned, the DP cells of each
+    alignment (read length times adapter length) and the time since start_time.
+    """
+    metrics.METRICS.add_alignments(adapter_sequences, dp_cells, time.perf_counter() - start_time)
+
+
+def get_dna5_table():
+    """
+    Bases are given to the C++ aligners as Dna5 codes: A, C, G and T (either case) are 0 to 3 and
+    anything else is N (4). This is the translation table from ASCII to those codes.
+    """
+    table = bytearray([4] * 256)
+    for code, bases in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+        for base in bases:
+            table[ord(base)] = code
+    return bytes(table)
+
+
+DNA5_TABLE = get_dna5_table()
+
+
+def encode_sequence(sequence):
+    return sequence.encode('utf-8').translate(DNA5_TABLE)
+
+
+class EncodedSequence(object):
+    """
+    A sequence (usually one end of a read) with its Dna5 codes, which are made once and then used
+    for every adapter aligned to it, and for any window of it. Both backends pass the codes to C++
+    as a pointer to the bytes object's own buffer, so nothing is copied for each alignment call.
+    """
+    __slots__ = ('seq', 'codes')
+
+    def __init__(self, seq):
+        self.seq = seq
+        self.codes = encode_sequence(seq)
+
+    def __len__(self):
+        return len(self.codes)
+
+
+# Adapters are registered with the C++ code once (for each scoring scheme and backend), which makes
+# their codes and score profiles, and after that they are referred to by their handles. The lists
+# of adapters which are aligned together to every read (see register_adapter_lists) also have their
+# C arrays of handles made once and reused (the extension reads them directly from the array's
+# buffer). Other lists, like the subsets left by --kmer_prefilter, differ from read to read, so
+# their arrays are made for each call and not kept.
+ADAPTER_HANDLES = {}
+ADAPTER_HANDLE_ARRAYS = {}
+REGISTRY_LOCK = threading.Lock()
+
+
+def register_adapters(adapter_sequences, scoring_scheme_vals):
+    """
+    Returns the handles of the adapter sequences for the scoring scheme, registering any which
+    haven't been registered yet. Porechop registers the adapters it will be trimming once they are
+    known, but any other adapter sequences are registered when they are first aligned.
+    """
+    match_score, mismatch_score = scoring_scheme_vals[0], scoring_scheme_vals[1]
+    handles = []
+    for adapter_sequence in adapter_sequences:
+        key = (adapter_sequence, match_score, mismatch_score, BACKEND)
+        try:
+            handles.append(ADAPTER_HANDLES[key])
+        except KeyError:
+            with REGISTRY_LOCK:
+                if key not in ADAPTER_HANDLES:
+                    codes = encode_sequence(adapter_sequence)
+                    if BACKEND == 'extension':
+                        handle = cpp_extension.register_adapter(codes, match_score,
+                                                                mismatch_score)
+                    else:
+                        handle = C_LIB.registerAdapter(codes, len(codes), match_score,
+                                                       mismatch_score)
+                    if handle == -1:
+                        sys.exit('Error: too many adapter sequences')
+                    ADAPTER_HANDLES[key] = handle
+            handles.append(ADAPTER_HANDLES[key])
+    return handles
+
+
+def register_adapter_lists(adapter_lists, scoring_scheme_vals):
+    """
+    Registers the adapters in each list and keeps the list's C array of handles, for lists of
+    adapters which are aligned together to every read (like the start sequences of the adapter sets
+    being trimmed).
+    """
+    for adapter_sequences in adapter_lists:
+        handles = register_adapters(adapter_sequences, scoring_scheme_vals)
+        key = (tuple(adapter_sequences), scoring_scheme_vals[0], scoring_scheme_vals[1], BACKEND)
+        ADAPTER_HANDLE_ARRAYS[key] = (c_int * len(handles))(*handles)
+
+
+def get_adapter_handle_array(adapter_sequences, scoring_scheme_vals):
+    key = (tuple(adapter_sequences), scoring_scheme_vals[0], scoring_scheme_vals[1], BACKEND)
+    try:
+        return ADAPTER_HANDLE_ARRAYS[key]
+    except KeyError:
+        handles = register_adapters(adapter_sequences, scoring_scheme_vals)
+        return (c_int * len(handles))(*handles)
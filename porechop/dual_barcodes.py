@@ -0,0 +1,123 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module handles dual-index (combinatorial) barcoding, where the barcode at the start of a read
+and the barcode at its end are chosen independently and it is the pair which identifies the
+sample. The pairs are given in a sample sheet. A read from the opposite strand has the pair's end
+barcode at its start and its start barcode at its end, so every barcode in the sheet is aligned to
+both read ends: a sheet with N start barcodes and M end barcodes costs N + M alignments per read
+end, not one per pair. The two ends are called separately and the pair is then looked up in a
+table of samples, in either order.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+from .adapters import ADAPTERS
+
+
+class DualBarcodes(object):
+    """
+    The barcode pairs of a sample sheet. The sheet's barcodes (start barcodes, then any end
+    barcodes which aren't also start barcodes) are numbered in the order they first appear, and
+    pair_table[start call][end call] is the number of the pair's sample in sample_names (-1 if the
+    pair isn't in the sheet). The table is symmetric, as a read from the opposite strand has its
+    pair's barcodes the other way round, and it has an extra row and column (the last) for reads
+    without a start or end barcode call.
+    """
+    def __init__(self, pairs):
+        self.start_barcodes, self.end_barcodes, self.sample_names = [], [], []
+        self.samples = {}
+        for start_barcode, end_barcode, sample in pairs:
+            if (start_barcode, end_barcode) in self.samples:
+                raise ValueError('the pair ' + start_barcode + ' ' + end_barcode +
+                                 ' is in the sample sheet more than once')
+            if (end_barcode, start_barcode) in self.samples:
+                raise ValueError('the pairs ' + start_barcode + ' ' + end_barcode + ' and ' +
+                                 end_barcode + ' ' + start_barcode + ' are both in the sample '
+                                 'sheet, but their reads cannot be told apart (reads from the '
+                                 'opposite strand have the barcodes the other way round)')
+            self.samples[(start_barcode, end_barcode)] = sample
+            for barcodes, name in [(self.start_barcodes, start_barcode),
+                                   (self.end_barcodes, end_barcode),
+                                   (self.sample_names, sample)]:
+                if name not in barcodes:
+                    barcodes.append(name)
+        self.barcodes = self.start_barcodes + [x for x in self.end_barcodes
+                                               if x not in self.start_barcodes]
+        self.indices = {x: i for i, x in enumerate(self.barcodes)}
+
+        sample_indices = {x: i for i, x in enumerate(self.sample_names)}
+        self.pair_table = [[-1] * (len(self.barcodes) + 1) for _ in range(len(self.barcodes) + 1)]
+        for (start_barcode, end_barcode), sample in self.samples.items():
+            start_index, end_index = self.indices[start_barcode], self.indices[end_barcode]
+            self.pair_table[start_index][end_index] = sample_indices[sample]
+            self.pair_table[end_index][start_index] = sample_indices[sample]
+
+    def get_sample(self, start_barcode, end_barcode):
+        """
+        Returns the sample for a start and end barcode call (in either order), or 'none' if the
+        pair isn't in the sheet (or either end has no call).
+        """
+        if (start_barcode, end_barcode) in self.samples:
+            return self.samples[(start_barcode, end_barcode)]
+        return self.samples.get((end_barcode, start_barcode), 'none')
+
+
+def load_dual_barcodes(filename):
+    """
+    Loads a sample sheet: one pair per line, with the start barcode, the end barcode and
+    (optionally) the sample name separated by whitespace. Without a sample name, the pair's reads
+    are binned as START_END. Blank lines and lines starting with '#' are skipped.
+    """
+    if not os.path.isfile(filename):
+        sys.exit('Error: could not find ' + filename)
+    known_barcodes = {x.get_barcode_name() for x in ADAPTERS if x.is_barcode()}
+    pairs = []
+    with open(filename, 'rt') as sheet:
+        for line_num, line in enumerate(sheet, start=1):
+            parts = line.split()
+            if not parts or parts[0].startswith('#'):
+                continue
+            if len(parts) not in (2, 3):
+                sys.exit('Error: line ' + str(line_num) + ' of ' + filename + ' should have a '
+                         'start barcode, an end barcode and optionally a sample name')
+            for barcode in parts[:2]:
+                if barcode not in known_barcodes:
+                    sys.exit('Error: ' + barcode + ' (line ' + str(line_num) + ' of ' + filename +
+                             ') is not a known barcode')
+            sample = parts[2] if len(parts) == 3 else parts[0] + '_' + parts[1]
+            if sample == 'none' or '/' in sample:
+                sys.exit('Error: ' + sample + ' (line ' + str(line_num) + ' of ' + filename +
+                         ') cannot be used as a sample name')
+            pairs.append((parts[0], parts[1], sample))
+    if not pairs:
+        sys.exit('Error: ' + filename + ' does not contain any barcode pairs')
+    try:
+        return DualBarcodes(pairs)
+    except ValueError as e:
+        sys.exit('Error: ' + str(e))
+
+
+def make_dual_barcode_adapter_sets(matching_sets, dual_barcodes, forward_or_reverse_barcodes):
+    """
+    Replaces the barcode adapter sets found by the adapter search with the sets for the barcodes
+    in the sample sheet, which are aligned to both read ends. The barcodes are taken from the kit
+    orientation chosen by choose_barcoding_kit.
+    """
+    barcodes = {x.get_barcode_name(): x for x in ADAPTERS
+                if x.is_barcode() and x.barcode_direction() == forward_or_reverse_barcodes}
+    missing = [x for x in dual_barcodes.barcodes if x not in barcodes]
+    if missing:
+        sys.exit('Error: these barcodes are not available in the ' + forward_or_reverse_barcodes +
+                 ' barcode orientation: ' + ', '.join(sorted(missing)))
+    return [x for x in matching_sets if not x.is_barcode()] + \
+        [barcodes[x] for x in dual_barcodes.barcodes]
@@ -10,12 +10,29 @@ using namespace seqan;
 
 // Functions that are called by the Python script must have C linkage, not C++ linkage.
 extern "C" {
-    char * adapterAlignment(char * readSeq, char * adapterSeq,
-                            int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore);
-    void freeCString(char * p);
+    void adapterAlignment(char * readSeq, char * adapterSeq,
+                          int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                          AlignmentResult * result);
+
+    void adapterAlignmentBatch(char * readCodes, int readStart, int readLength,
+                               int * adapterHandles, int adapterCount,
+                               int matchScore, int mismatchScore, int gapOpenScore,
+                               int gapExtensionScore, AlignmentResult * results);
+
+    void adapterAlignmentPairs(char ** readCodes, int * readStarts, int * readLengths,
+                               int * adapterHandles, int pairCount,
+                               int matchScore, int mismatchScore, int gapOpenScore,
+                               int gapExtensionScore, AlignmentResult * results);
+
+    int adapterAllHits(char * readSeq, char * adapterSeq,
+                       int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                       double minIdentity, AlignmentResult * results, int maxResults);
 }
 
-char * cppStringToCString(std::string cpp_string);
+ScoredAlignment alignToAdapter(Dna5String & readSeq, Dna5String & adapterSeq,
+                               Score<int, Simple> & scoringScheme);
+
+void codesToDna5String(char * codes, int length, Dna5String & sequence);
 
 
 #endif // ADAPTER_ALIGN_H
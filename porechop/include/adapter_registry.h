@@ -0,0 +1,33 @@
+#ifndef ADAPTER_REGISTRY_H
+#define ADAPTER_REGISTRY_H
+
+#include <vector>
+#include <cstdint>
+#include <seqan/sequence.h>
+
+using namespace seqan;
+
+
+// An adapter sequence which Python has registered once, with what the aligners need for it made
+// in advance: its Dna5 codes, a Dna5String for SeqAn and a score profile for the fast aligner.
+// The score profile has one row per read base code (0 to 4), holding the match or mismatch score
+// of that base against each adapter position, so the DP doesn't have to compare bases.
+struct RegisteredAdapter {
+    std::vector<uint8_t> codes;
+    Dna5String sequence;
+    std::vector<int> scoreProfile;
+};
+
+
+// Functions that are called by the Python script must have C linkage, not C++ linkage.
+extern "C" {
+    int registerAdapter(char * codes, int length, int matchScore, int mismatchScore);
+}
+
+RegisteredAdapter & getRegisteredAdapter(int handle);
+int registeredAdapterCount();
+
+void makeScoreProfile(std::vector<uint8_t> & codes, int matchScore, int mismatchScore,
+                      std::vector<int> & scoreProfile);
+
+#endif // ADAPTER_REGISTRY_H
@@ -10,11 +10,26 @@
 using namespace seqan;
 
 
+// The numbers describing an alignment, in a plain struct that the Python code can read directly
+// (using ctypes). It must stay in sync with AlignmentResult in cpp_function_wrappers.py.
+extern "C" {
+    struct AlignmentResult {
+        int readStartPos;
+        int readEndPos;
+        int adapterStartPos;
+        int adapterEndPos;
+        int rawScore;
+        double alignedRegionPercentIdentity;
+        double fullAdapterPercentIdentity;
+    };
+}
+
+
 class ScoredAlignment {
 public:
     ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
                     int readLength, int adapterLength, int score);
-    std::string getString();
+    void getResult(AlignmentResult * result);
 
     int m_readLength;
     int m_adapterLength;
@@ -0,0 +1,88 @@
+#ifndef FAST_ALIGN_H
+#define FAST_ALIGN_H
+
+#include <vector>
+#include <cstdint>
+#include "alignment.h"
+#include "adapter_registry.h"
+
+
+// Functions that are called by the Python script must have C linkage, not C++ linkage.
+extern "C" {
+    void fastAdapterAlignment(char * readSeq, char * adapterSeq,
+                              int matchScore, int mismatchScore, int gapOpenScore,
+                              int gapExtensionScore, AlignmentResult * result);
+
+    void fastAdapterAlignmentBatch(char * readCodes, int readStart, int readLength,
+                                   int * adapterHandles, int adapterCount,
+                                   int matchScore, int mismatchScore, int gapOpenScore,
+                                   int gapExtensionScore, AlignmentResult * results);
+
+    void fastAdapterAlignmentPairs(char ** readCodes, int * readStarts, int * readLengths,
+                                   int * adapterHandles, int pairCount,
+                                   int matchScore, int mismatchScore, int gapOpenScore,
+                                   int gapExtensionScore, AlignmentResult * results);
+
+    int fastAdapterAllHits(char * readSeq, char * adapterSeq,
+                           int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore, double minIdentity, AlignmentResult * results,
+                           int maxResults);
+}
+
+
+// The memory used by the alignments. It is kept between alignments (one per thread) so the DP
+// doesn't need to allocate anything once it has warmed up.
+struct FastAlignBuffers {
+    std::vector<uint8_t> readCodes;
+    std::vector<std::vector<uint8_t> > pairReadCodeStorage;
+    std::vector<std::vector<uint8_t> *> pairReadCodes;
+    std::vector<uint8_t> adapterCodes;
+    std::vector<int> scoreProfile;
+    std::vector<RegisteredAdapter *> pairAdapters;
+    std::vector<int> prevScores;
+    std::vector<int> prevHorizontalScores;
+    std::vector<int> currScores;
+    std::vector<int> currHorizontalScores;
+    std::vector<int16_t> laneReadCodes;
+    std::vector<int16_t> laneAdapterCodes;
+    std::vector<int16_t> prevLaneScores;
+    std::vector<int16_t> prevLaneHorizontalScores;
+    std::vector<int16_t> currLaneScores;
+    std::vector<int16_t> currLaneHorizontalScores;
+    std::vector<int> checkpointScores;
+    std::vector<int> checkpointHorizontalScores;
+    std::vector<int> lastRowScores;
+    std::vector<int> lastColumnScores;
+    std::vector<uint8_t> trace;
+    std::vector<uint8_t> ops;
+    std::vector<int> order;
+};
+
+void encodeSequence(char * seq, std::vector<uint8_t> & codes);
+
+void copyCodes(char * codes, int length, std::vector<uint8_t> & buffer);
+
+void fastAlignToAdapter(std::vector<uint8_t> & readCodes, std::vector<uint8_t> & adapterCodes,
+                        const int * scoreProfile, int gapOpenScore, int gapExtensionScore,
+                        FastAlignBuffers & buffers, AlignmentResult * result);
+
+void alignPairs(int pairCount, int matchScore, int mismatchScore, int gapOpenScore,
+                int gapExtensionScore, FastAlignBuffers & buffers, AlignmentResult * results);
+
+void fastAlignToAdapterLanes(std::vector<uint8_t> ** readCodes, RegisteredAdapter ** adapters,
+                             int laneCount,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, FastAlignBuffers & buffers,
+                             AlignmentResult ** results);
+
+bool canUseLanes(int readLength, int adapterLength, int matchScore, int mismatchScore,
+                 int gapOpenScore, int gapExtensionScore);
+
+void traceBack(uint8_t * trace, int rowCount, int laneStride, int lane, int readLength,
+               int adapterLength, int bestRow, int bestColumn, bool linearGaps,
+               std::vector<uint8_t> & ops);
+
+void scoreAlignmentOps(std::vector<uint8_t> & ops, std::vector<uint8_t> & readCodes,
+                       std::vector<uint8_t> & adapterCodes, int score, AlignmentResult * result);
+
+#endif // FAST_ALIGN_H
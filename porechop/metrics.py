@@ -0,0 +1,311 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module collects the performance metrics saved by --metrics. The run is divided into phases
+(loading, discovery, end_trimming, middle_splitting and output) and each phase gets its wall and
+CPU time, the reads and bases it handled, the number of adapter alignments it did (with their total
+dynamic programming cells and time spent in the aligner) and the peak memory use so far.
+
+Phases can be nested (e.g. when reads are processed in chunks, loading and trimming happen while
+the output is being written), in which case the time of the inner phase is not counted in the
+outer one. CPU time includes worker processes once they have finished. Alignments are counted in
+the C++ wrappers, so they are included from every thread, and worker processes send their counts
+back with their results. With --metrics_adapters, the alignments are also broken down by adapter:
+the time of an alignment call covering many adapters is shared between them by their DP cells.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import resource
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from .version import __version__
+
+# The metrics being collected, or None if --metrics wasn't used (in which case nothing is recorded).
+METRICS = None
+
+PHASE_COLUMNS = ['wall_seconds', 'cpu_seconds', 'reads', 'bases', 'reads_per_second',
+                 'bases_per_second', 'alignments', 'dp_cells', 'alignment_seconds',
+                 'peak_rss_mb']
+
+
+class PhaseMetrics(object):
+
+    def __init__(self):
+        self.wall_seconds, self.cpu_seconds = 0.0, 0.0
+        self.reads, self.bases = 0, 0
+        self.alignments, self.dp_cells, self.alignment_seconds = 0, 0, 0.0
+        self.peak_rss_mb = 0.0
+
+        # Adapter sequence -> [alignments, DP cells, alignment seconds]
+        self.adapters = {}
+
+    def add_alignments(self, alignments, dp_cells, alignment_seconds, adapters):
+        self.alignments += alignments
+        self.dp_cells += dp_cells
+        self.alignment_seconds += alignment_seconds
+        for adapter_seq, adapter_stats in adapters.items():
+            totals = self.adapters.setdefault(adapter_seq, [0, 0, 0.0])
+            for i, value in enumerate(adapter_stats):
+                totals[i] += value
+
+    def get_results(self):
+        results = OrderedDict()
+        results['wall_seconds'] = round(self.wall_seconds, 3)
+        results['cpu_seconds'] = round(self.cpu_seconds, 3)
+        results['reads'] = self.reads
+        results['bases'] = self.bases
+        results['reads_per_second'] = get_rate(self.reads, self.wall_seconds)
+        results['bases_per_second'] = get_rate(self.bases, self.wall_seconds)
+        results['alignments'] = self.alignments
+        results['dp_cells'] = self.dp_cells
+        results['alignment_seconds'] = round(self.alignment_seconds, 3)
+        results['peak_rss_mb'] = self.peak_rss_mb
+        return results
+
+
+class Metrics(object):
+
+    def __init__(self, adapter_breakdown):
+        self.adapter_breakdown = adapter_breakdown
+        self.phases = OrderedDict()
+        self.phase_stack = []
+        self.lock = threading.Lock()
+        self.start_time = time.perf_counter()
+        self.start_cpu = get_cpu_time()
+        self.mark_time, self.mark_cpu = self.start_time, self.start_cpu
+
+    def get_phase(self, name=None):
+        if name is None:
+            name = self.phase_stack[-1] if self.phase_stack else 'other'
+        try:
+            return self.phases[name]
+        except KeyError:
+            self.phases[name] = PhaseMetrics()
+            return self.phases[name]
+
+    def start_phase(self, name):
+        self.charge_time()
+        self.phase_stack.append(name)
+        self.get_phase(name)
+
+    def end_phase(self):
+        self.charge_time()
+        current_phase = self.get_phase()
+        current_phase.peak_rss_mb = max(current_phase.peak_rss_mb,
+                                        get_peak_rss_mb(resource.RUSAGE_SELF))
+        self.phase_stack.pop()
+
+    def charge_time(self):
+        """
+        Adds the time since the last phase change to the current phase.
+        """
+        now, cpu = time.perf_counter(), get_cpu_time()
+        if self.phase_stack:
+            current_phase = self.get_phase()
+            current_phase.wall_seconds += now - self.mark_time
+            current_phase.cpu_seconds += cpu - self.mark_cpu
+        self.mark_time, self.mark_cpu = now, cpu
+
+    def add_alignments(self, adapter_seqs, dp_cells, seconds):
+        """
+        Records an alignment call: one alignment per adapter sequence, with its DP cells.
+        """
+        total_cells = sum(dp_cells)
+        adapters = {}
+        if self.adapter_breakdown:
+            for adapter_seq, cells in zip(adapter_seqs, dp_cells):
+                adapter_stats = adapters.setdefault(adapter_seq, [0, 0, 0.0])
+                adapter_stats[0] += 1
+                adapter_stats[1] += cells
+                adapter_stats[2] += seconds * cells / total_cells if total_cells else 0.0
+        with self.lock:
+            self.get_phase().add_alignments(len(adapter_seqs), total_cells, seconds, adapters)
+
+    def take_alignment_stats(self):
+        """
+        Returns the alignments recorded so far (for sending back from a worker process) and starts
+        counting again.
+        """
+        with self.lock:
+            current_phase = self.get_phase()
+            stats = (current_phase.alignments, current_phase.dp_cells,
+                     current_phase.alignment_seconds, current_phase.adapters)
+            self.phases.clear()
+        return stats
+
+    def get_results(self, adapter_names):
+        """
+        Returns the metrics as a dictionary. Adapters are named using adapter_names (adapter
+        sequence -> name).
+        """
+        results = OrderedDict()
+        results['porechop_version'] = __version__
+        results['command'] = ' '.join(sys.argv)
+        total = OrderedDict()
+        total['wall_seconds'] = round(time.perf_counter() - self.start_time, 3)
+        total['cpu_seconds'] = round(get_cpu_time() - self.start_cpu, 3)
+        total['peak_rss_mb'] = get_peak_rss_mb(resource.RUSAGE_SELF)
+        total['peak_child_rss_mb'] = get_peak_rss_mb(resource.RUSAGE_CHILDREN)
+        results['total'] = total
+        results['phases'] = OrderedDict()
+        for name, phase_metrics in self.phases.items():
+            phase_results = phase_metrics.get_results()
+            if self.adapter_breakdown:
+                phase_results['adapters'] = get_adapter_results(phase_metrics, adapter_names)
+            results['phases'][name] = phase_results
+        return results
+
+
+def start_metrics(adapter_breakdown):
+    global METRICS
+    METRICS = Metrics(adapter_breakdown)
+
+
+def stop_metrics():
+    global METRICS
+    METRICS = None
+
+
+@contextmanager
+def phase(name):
+    """
+    Times the code in a with block as a phase of the run.
+    """
+    if METRICS is None:
+        yield
+        return
+    METRICS.start_phase(name)
+    try:
+        yield
+    finally:
+        METRICS.end_phase()
+
+
+def timed_iterator(name, iterable):
+    """
+    Passes on the items of an iterable, counting the time spent getting each one as a phase (e.g.
+    loading the reads of each chunk).
+    """
+    if METRICS is None:
+        return iterable
+    return timed_iterator_items(name, iter(iterable))
+
+
+def timed_iterator_items(name, iterator):
+    while True:
+        with phase(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def add_reads(reads, phase_name=None):
+    """
+    Counts the reads (and their bases) handled by the current phase (or the named phase).
+    """
+    if METRICS is None:
+        return
+    current_phase = METRICS.get_phase(phase_name)
+    current_phase.reads += len(reads)
+    current_phase.bases += sum(x.seq_length() for x in reads)
+
+
+def add_worker_alignment_stats(stats):
+    if METRICS is None or stats is None:
+        return
+    with METRICS.lock:
+        METRICS.get_phase().add_alignments(*stats)
+
+
+def collect_worker_alignment_stats(batch_results):
+    """
+    Worker processes return (results, alignment stats) for each batch. This generator records the
+    stats and passes on the results.
+    """
+    for results, stats in batch_results:
+        add_worker_alignment_stats(stats)
+        yield results
+
+
+def take_worker_alignment_stats():
+    if METRICS is None:
+        return None
+    return METRICS.take_alignment_stats()
+
+
+def save_metrics(filename, adapter_names):
+    """
+    Saves the metrics as TSV (if the filename ends in .tsv) or JSON. In a TSV file, there is a row
+    for each phase and (with the adapter breakdown) a row for each adapter in each phase.
+    """
+    if METRICS is None:
+        return
+    METRICS.charge_time()
+    results = METRICS.get_results(adapter_names)
+    if filename.lower().endswith('.tsv'):
+        with open(filename, 'wt') as metrics_file:
+            metrics_file.write('\t'.join(['phase', 'adapter'] + PHASE_COLUMNS) + '\n')
+            rows = [('total', '', results['total'])]
+            for name, phase_results in results['phases'].items():
+                rows.append((name, '', phase_results))
+                for adapter_name, adapter_results in phase_results.get('adapters', {}).items():
+                    rows.append((name, adapter_name, adapter_results))
+            for name, adapter_name, row in rows:
+                values = ['' if row.get(x) is None else str(row[x]) for x in PHASE_COLUMNS]
+                metrics_file.write('\t'.join([name, adapter_name] + values) + '\n')
+    else:
+        with open(filename, 'wt') as metrics_file:
+            json.dump(results, metrics_file, indent=2)
+            metrics_file.write('\n')
+
+
+def get_adapter_results(phase_metrics, adapter_names):
+    """
+    Returns the per-adapter alignment metrics of a phase, most costly first.
+    """
+    adapter_results = OrderedDict()
+    for adapter_seq, (alignments, dp_cells, seconds) in \
+            sorted(phase_metrics.adapters.items(), key=lambda x: (-x[1][2], x[0])):
+        name = adapter_names.get(adapter_seq, adapter_seq)
+        if name in adapter_results:
+            name += ' (' + adapter_seq + ')'
+        adapter_results[name] = OrderedDict([('alignments', alignments),
+                                             ('dp_cells', dp_cells),
+                                             ('alignment_seconds', round(seconds, 3))])
+    return adapter_results
+
+
+def get_rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0.0 else None
+
+
+def get_cpu_time():
+    """
+    The CPU time of this process (all threads) and of its worker processes which have finished.
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def get_peak_rss_mb(who):
+    """
+    ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+    """
+    peak_rss = resource.getrusage(who).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_rss /= 1024
+    return round(peak_rss / 1024, 1)
@@ -20,6 +20,7 @@ import re
 import textwrap
 import shutil
 import argparse
+from . import seq_parser
 
 
 def float_to_str(num, decimals, max_num=0):
@@ -120,52 +121,56 @@ def load_fasta_or_fastq(filename):
         sys.exit('\nError: ' + filename + ' could not be parsed - is it formatted correctly?')
 
 
+def iterate_fasta_or_fastq(filename):
+    """
+    Like load_fasta_or_fastq, but returns a generator of records instead of a list, so large files
+    can be processed piece by piece.
+    """
+    file_type = get_sequence_file_type(filename)
+    if file_type == 'FASTA':
+        records = iterate_fasta(filename)
+    else:  # FASTQ
+        records = iterate_fastq(filename)
+    return exit_on_parse_error(records, filename), file_type
+
+
+def exit_on_parse_error(records, filename):
+    try:
+        yield from records
+    except IndexError:
+        sys.exit('\nError: ' + filename + ' could not be parsed - is it formatted correctly?')
+
+
 def load_fasta(fasta_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fasta file.
     """
-    if get_compression_type(fasta_filename) == 'gz':
-        open_func = gzip.open
-    else:  # plain text
-        open_func = open
-    fasta_seqs = []
-    with open_func(fasta_filename, 'rt') as fasta_file:
-        name = ''
-        sequence = ''
-        for line in fasta_file:
-            line = line.strip()
-            if not line:
-                continue
-            if line[0] == '>':  # Header line = start of new contig
-                if name:
-                    fasta_seqs.append((name.split()[0], sequence, name))
-                    sequence = ''
-                name = line[1:]
-            else:
-                sequence += line
-        if name:
-            fasta_seqs.append((name.split()[0], sequence, name))
-    return fasta_seqs
+    return list(iterate_fasta(fasta_filename))
+
+
+def iterate_fasta(fasta_filename):
+    """
+    Yields a tuple (short name, seq, full name) for each record in the fasta file, without holding
+    the whole file in memory.
+    """
+    gzipped = get_compression_type(fasta_filename) == 'gz'
+    return seq_parser.iterate_fasta(fasta_filename, gzipped)
 
 
 def load_fastq(fastq_filename):
     """
     Returns a list of tuples (header, seq) for each record in the fastq file.
     """
-    if get_compression_type(fastq_filename) == 'gz':
-        open_func = gzip.open
-    else:  # plain text
-        open_func = open
-    reads = []
-    with open_func(fastq_filename, 'rt') as fastq:
-        for line in fastq:
-            full_name = line.strip()[1:]
-            short_name = full_name.split()[0]
-            sequence = next(fastq).strip()
-            spacer = next(fastq).strip()
-            qualities = next(fastq).strip()
-            reads.append((short_name, sequence, spacer, qualities, full_name))
-    return reads
+    return list(iterate_fastq(fastq_filename))
+
+
+def iterate_fastq(fastq_filename):
+    """
+    Yields a tuple (short name, seq, spacer, quals, full name) for each record in the fastq file,
+    without holding the whole file in memory.
+    """
+    gzipped = get_compression_type(fastq_filename) == 'gz'
+    return seq_parser.iterate_fastq(fastq_filename, gzipped)
 
 
 def print_table(table, print_dest, alignments='', max_col_width=30, col_separation=3, indent=2,
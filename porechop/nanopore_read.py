@@ -14,33 +14,38 @@ details. You should have received a copy of the GNU General Public License along
 not, see <http://www.gnu.org/licenses/>.
 """
 
-from .cpp_function_wrappers import adapter_alignment
+import bisect
+from .cpp_function_wrappers import adapter_alignment, adapter_alignment_batch, \
+    adapter_alignment_pairs, adapter_all_hits, EncodedSequence
+from .adapter_index import get_exact_seed_size, get_max_errors, find_seed_windows
+from .read_store import ReadStore, RNA_FLAG, NEEDS_REVERSING_FLAG
 from .misc import yellow, red, add_line_breaks_to_sequence, END_FORMATTING, RED, YELLOW, reverse_complement
 
 
 class NanoporeRead(object):
-
-    def __init__(self, name, seq, quals):
-        self.name = name
-
-        self.seq = seq.upper()
-        if self.seq.count('U') > self.seq.count('T'):
-            self.rna = True
-            self.seq = self.seq.replace('U', 'T')
-        else:
-            self.rna = False
-
-        self.quals = quals
-        if len(quals) < len(seq):
-            self.quals += '+' * (len(seq) - len(quals))
-
-        self.start_trim_amount = 0
-        self.end_trim_amount = 0
-        self.start_adapter_alignments = []
-        self.end_adapter_alignments = []
-
-        self.middle_adapter_positions = set()
-        self.middle_trim_positions = set()
+    """
+    A read and its trimming results. The sequence, qualities and trim amounts live in a ReadStore
+    (shared by many reads when they are loaded together), so each NanoporeRead only holds the
+    results that most reads don't have.
+    """
+    __slots__ = ('store', 'index', 'start_adapter_alignments', 'end_adapter_alignments',
+                 'middle_adapter_ranges', 'middle_trim_ranges', 'middle_hit_str',
+                 'start_barcode_scores', 'end_barcode_scores', 'best_start_barcode',
+                 'best_end_barcode', 'second_best_start_barcode', 'second_best_end_barcode',
+                 'barcode_call', 'albacore_barcode_call')
+
+    def __init__(self, name, seq, quals, store=None):
+        if store is None:
+            store = ReadStore()
+        self.store = store
+        self.index = store.add(name, seq, quals)
+
+        # These are only made into lists when an adapter is found, as most reads don't need them.
+        # The middle ranges are sorted lists of non-overlapping (start, end) ranges.
+        self.start_adapter_alignments = ()
+        self.end_adapter_alignments = ()
+        self.middle_adapter_ranges = ()
+        self.middle_trim_ranges = ()
         self.middle_hit_str = ''
 
         self.start_barcode_scores = {}
@@ -51,21 +56,68 @@ class NanoporeRead(object):
         self.second_best_start_barcode = ('none', 0.0)
         self.second_best_end_barcode = ('none', 0.0)
         self.barcode_call = 'none'
-        
-        self.needs_reversing = False
 
         self.albacore_barcode_call = None
 
+    @property
+    def name(self):
+        return self.store.names[self.index]
+
+    @property
+    def seq(self):
+        return self.store.get_seq(self.index)
+
+    @property
+    def quals(self):
+        return self.store.get_quals(self.index)
+
+    @property
+    def rna(self):
+        return self.store.get_flag(self.index, RNA_FLAG)
+
+    @property
+    def start_trim_amount(self):
+        return self.store.start_trims[self.index]
+
+    @start_trim_amount.setter
+    def start_trim_amount(self, value):
+        self.store.start_trims[self.index] = value
+
+    @property
+    def end_trim_amount(self):
+        return self.store.end_trims[self.index]
+
+    @end_trim_amount.setter
+    def end_trim_amount(self, value):
+        self.store.end_trims[self.index] = value
+
+    @property
+    def needs_reversing(self):
+        return self.store.get_flag(self.index, NEEDS_REVERSING_FLAG)
+
+    @needs_reversing.setter
+    def needs_reversing(self, value):
+        self.store.set_flag(self.index, NEEDS_REVERSING_FLAG, value)
+
+    def seq_length(self):
+        return self.store.get_seq_length(self.index)
+
+    def get_seq_part(self, start=None, end=None):
+        """
+        Returns self.seq[start:end], decoding only that part of the sequence.
+        """
+        return self.store.get_seq(self.index, start, end)
+
     def get_seq_with_start_end_adapters_trimmed(self):
         if not self.start_trim_amount and not self.end_trim_amount:
             return self.seq
         start_pos = self.start_trim_amount
-        end_pos = len(self.seq) - self.end_trim_amount
-        trimmed_seq = self.seq[start_pos:end_pos]
-        return trimmed_seq
+        end_pos = self.seq_length() - self.end_trim_amount
+        return self.get_seq_part(start_pos, end_pos)
 
     def seq_length_with_start_end_adapters_trimmed(self):
-        return len(self.get_seq_with_start_end_adapters_trimmed())
+        seq_length = self.seq_length()
+        return len(range(seq_length)[self.start_trim_amount:seq_length - self.end_trim_amount])
 
     def get_quals_with_start_end_adapters_trimmed(self):
         if not self.start_trim_amount and not self.end_trim_amount:
@@ -77,27 +129,25 @@ class NanoporeRead(object):
 
     def get_split_read_parts(self, min_split_read_size):
         """
-        Returns the read split into parts as determined by the middle_trim_positions set.
+        Returns the read split into parts as determined by the middle_trim_ranges list. The parts
+        are the slices of the read between the trimmed ranges.
         """
         trimmed_seq = self.get_seq_with_start_end_adapters_trimmed()
         trimmed_quals = self.get_quals_with_start_end_adapters_trimmed()
+        seq_length = len(trimmed_seq)
         split_read_parts = []
-        part_seq, part_quals = [], []
-        for i in range(len(trimmed_seq)):
-            if i in self.middle_trim_positions:
-                if part_seq:
-                    split_read_parts.append((''.join(part_seq), ''.join(part_quals)))
-                    part_seq, part_quals = [], []
-            else:
-                part_seq.append(trimmed_seq[i])
-                part_quals.append(trimmed_quals[i])
-        if part_seq:
-            split_read_parts.append((''.join(part_seq), ''.join(part_quals)))
+        part_start = 0
+        for trim_start, trim_end in list(self.middle_trim_ranges) + [(seq_length, seq_length)]:
+            part_end = min(trim_start, seq_length)
+            if part_end > part_start:
+                split_read_parts.append((trimmed_seq[part_start:part_end],
+                                         trimmed_quals[part_start:part_end]))
+            part_start = max(part_start, trim_end)
         split_read_parts = [x for x in split_read_parts if len(x[0]) >= min_split_read_size]
         return split_read_parts
 
     def get_fasta(self, min_split_read_size, discard_middle, untrimmed=False, tail_crop=0, trimmed_only=False, min_length=0, head_crop=0, max_length=1000000, correct_read_direction=False):
-        if not self.middle_trim_positions:
+        if not self.middle_trim_ranges:
             if untrimmed:
                 seq = self.seq
             else:
@@ -106,7 +156,7 @@ class NanoporeRead(object):
                 seq = seq[head_crop:-tail_crop]
             else:
                 seq = seq[head_crop:]
-            if not seq or (len(seq)+tail_crop+head_crop >= len(self.seq) and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
+            if not seq or (len(seq)+tail_crop+head_crop >= self.seq_length() and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
                 return ''
             if correct_read_direction and self.needs_reversing:
                 seq = reverse_complement(seq)
@@ -126,7 +176,7 @@ class NanoporeRead(object):
                     seq = seq[head_crop:-tail_crop]
                 else:
                     seq = seq[head_crop:]
-                if not seq or (len(seq)+tail_crop+head_crop >= len(self.seq) and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
+                if not seq or (len(seq)+tail_crop+head_crop >= self.seq_length() and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
                     continue
                 if self.rna:
                     seq = seq.replace('T', 'U')
@@ -135,7 +185,7 @@ class NanoporeRead(object):
             return fasta_str
 
     def get_fastq(self, min_split_read_size, discard_middle, untrimmed=False, tail_crop=0, trimmed_only=False, min_length=0, head_crop=0, max_length=1000000, correct_read_direction=False):
-        if not self.middle_trim_positions:
+        if not self.middle_trim_ranges:
             if untrimmed:
                 seq = self.seq
                 quals = self.quals
@@ -148,7 +198,7 @@ class NanoporeRead(object):
             else:
                 seq = seq[head_crop:]
                 quals = quals[head_crop:]
-            if not seq or (len(seq)+tail_crop+head_crop >= len(self.seq) and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
+            if not seq or (len(seq)+tail_crop+head_crop >= self.seq_length() and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
                 return ''
             if correct_read_direction and self.needs_reversing:
                 seq = reverse_complement(seq)
@@ -171,115 +221,200 @@ class NanoporeRead(object):
                 else:
                     seq = seq[head_crop:]
                     qual = qual[head_crop:]
-                if not seq or (len(seq)+tail_crop+head_crop >= len(self.seq) and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
+                if not seq or (len(seq)+tail_crop+head_crop >= self.seq_length() and trimmed_only) or len(seq) < min_length or len(seq) > max_length:  # Don't return empty sequences
                     continue
                 if self.rna:
                     seq = seq.replace('T', 'U')
                 fastq_str += ''.join(['@', read_name, '\n', seq, '\n+\n', qual, '\n'])
             return fastq_str
 
-    def align_adapter_set(self, adapter_set, end_size, scoring_scheme_vals):
-        """
-        This function aligns the adapter to the reads and updates the best score for the adapter.
-        This is not to determine where to trim the reads, but rather to figure out which adapter
-        sets are present in the data.
-        """
-        if adapter_set.start_sequence:
-            read_seq_start = self.seq[:end_size]
-            score, _, _, _ = align_adapter(read_seq_start, adapter_set.start_sequence[1],
-                                           scoring_scheme_vals)
-            adapter_set.best_start_score = max(adapter_set.best_start_score, score)
-        if adapter_set.end_sequence:
-            read_seq_end = self.seq[-end_size:]
-            score, _, _, _ = align_adapter(read_seq_end, adapter_set.end_sequence[1],
-                                           scoring_scheme_vals)
-            adapter_set.best_end_score = max(adapter_set.best_end_score, score)
-
     def find_start_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                        scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse, correct_read_direction):
+                        scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse, correct_read_direction,
+                        kmer_index=None):
         """
         Aligns one or more adapter sequences and possibly adjusts the read's start trim amount based
-        on the result.
+        on the result. If a k-mer index is given, adapters which share no k-mers with the read start
+        are skipped. The read start is encoded for the aligner once and used for every adapter.
         """
-        read_seq_start = self.seq[:end_size]
-        for adapter in adapters:
-            if not adapter.start_sequence:
-                continue
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_start, adapter.start_sequence[1], scoring_scheme_vals)
+        read_seq_start = EncodedSequence(self.get_seq_part(None, end_size))
+        start_adapters = [x for x in adapters if x.start_sequence]
+        if kmer_index is not None:
+            candidates = kmer_index.get_candidates(read_seq_start.seq)
+            start_adapters = [x for x in start_adapters if x.start_sequence[1] in candidates]
+        adapter_seqs = [x.start_sequence[1] for x in start_adapters]
+        alignments = align_adapters(read_seq_start, adapter_seqs, scoring_scheme_vals)
+        for adapter, alignment in zip(start_adapters, alignments):
+            full_score, partial_score, read_start, read_end = alignment
             if partial_score > end_threshold and read_end != end_size and \
                     read_end - read_start >= min_trim_size:
                 trim_amount = read_end + extra_trim_size
                 self.start_trim_amount = max(self.start_trim_amount, trim_amount)
+                if not self.start_adapter_alignments:
+                    self.start_adapter_alignments = []
                 self.start_adapter_alignments.append((adapter, full_score, partial_score,
                                                       read_start, read_end))
-            if (check_barcodes and adapter.is_barcode() and \
-                    adapter.barcode_direction() == forward_or_reverse) or correct_read_direction:
+            if needs_barcode_score(adapter, check_barcodes, forward_or_reverse,
+                                   correct_read_direction):
                 self.start_barcode_scores[adapter.get_barcode_name()] = full_score
             
 
     def find_end_trim(self, adapters, end_size, extra_trim_size, end_threshold,
-                      scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse, correct_read_direction):
+                      scoring_scheme_vals, min_trim_size, check_barcodes, forward_or_reverse, correct_read_direction,
+                      kmer_index=None):
         """
         Aligns one or more adapter sequences and possibly adjusts the read's end trim amount based
-        on the result.
+        on the result. If a k-mer index is given, adapters which share no k-mers with the read end
+        are skipped. The read end is encoded for the aligner once and used for every adapter.
         """
-        read_seq_end = self.seq[-end_size:]
-        for adapter in adapters:
-            if not adapter.end_sequence:
-                continue
-            full_score, partial_score, read_start, read_end = \
-                align_adapter(read_seq_end, adapter.end_sequence[1], scoring_scheme_vals)
+        read_seq_end = EncodedSequence(self.get_seq_part(-end_size))
+        end_adapters = [x for x in adapters if x.end_sequence]
+        if kmer_index is not None:
+            candidates = kmer_index.get_candidates(read_seq_end.seq)
+            end_adapters = [x for x in end_adapters if x.end_sequence[1] in candidates]
+        adapter_seqs = [x.end_sequence[1] for x in end_adapters]
+        alignments = align_adapters(read_seq_end, adapter_seqs, scoring_scheme_vals)
+        for adapter, alignment in zip(end_adapters, alignments):
+            full_score, partial_score, read_start, read_end = alignment
             if partial_score > end_threshold and read_start != 0 and \
                     read_end - read_start >= min_trim_size:
                 trim_amount = (end_size - read_start) + extra_trim_size
                 self.end_trim_amount = max(self.end_trim_amount, trim_amount)
+                if not self.end_adapter_alignments:
+                    self.end_adapter_alignments = []
                 self.end_adapter_alignments.append((adapter, full_score, partial_score,
                                                     read_start, read_end))
-            if (check_barcodes and adapter.is_barcode() and \
-                    adapter.barcode_direction() == forward_or_reverse) or correct_read_direction:
+            if needs_barcode_score(adapter, check_barcodes, forward_or_reverse,
+                                   correct_read_direction):
                 self.end_barcode_scores[adapter.get_barcode_name()] = full_score
 
     def find_middle_adapters(self, adapters, middle_threshold, extra_middle_trim_good_side,
                              extra_middle_trim_bad_side, scoring_scheme_vals,
-                             start_sequence_names, end_sequence_names):
+                             start_sequence_names, end_sequence_names, middle_search='full'):
         """
         Aligns an adapter sequence to the whole read to find places where the read should be split.
+        If middle_search is 'seeded', adapters are only aligned to the parts of the read which
+        contain an exact k-mer match, where possible.
         """
         masked_seq = self.get_seq_with_start_end_adapters_trimmed()
         for adapter_name, adapter_seq in adapters:
+            seed_size = 0
+            if middle_search == 'seeded':
+                seed_size = get_exact_seed_size(len(adapter_seq), middle_threshold)
+
+            # We keep aligning adapters as long we get strong hits (masking each one before the
+            # next alignment), so we can find multiple occurrences in a single read. This loop
+            # happens in C++, but with the SeqAn aligner each pass is a full alignment of the masked
+            # read, so k hits cost k + 1 alignments. Only the fast aligner reuses the columns
+            # before the masked part of the read.
+            if not seed_size:
+                hits = align_adapter_all_hits(masked_seq, adapter_seq, scoring_scheme_vals,
+                                              middle_threshold)
+                for full_score, _, read_start, read_end in hits:
+                    self.add_middle_hit(adapter_name, full_score, read_start, read_end,
+                                        extra_middle_trim_good_side, extra_middle_trim_bad_side,
+                                        start_sequence_names, end_sequence_names)
+                masked_seq = mask_hits(masked_seq, [(x[2], x[3]) for x in hits])
+                continue
 
-            # We keep aligning adapters as long we get strong hits, so we can find multiple
-            # occurrences in a single read.
-            while True:
-                full_score, _, read_start, read_end = align_adapter(masked_seq, adapter_seq,
-                                                                    scoring_scheme_vals)
-                if full_score >= middle_threshold:
-                    masked_seq = masked_seq[:read_start] + '-' * (read_end - read_start) + \
-                        masked_seq[read_end:]
-                    self.middle_adapter_positions.update(range(read_start, read_end))
-
-                    self.middle_hit_str += '  ' + adapter_name + ' (read coords: ' + \
-                                           str(read_start) + '-' + str(read_end) + ', ' + \
-                                           'identity: ' + '%.1f' % full_score + '%)\n'
-
-                    trim_start = read_start - extra_middle_trim_good_side
-                    if adapter_name in start_sequence_names:
-                        trim_start = read_start - extra_middle_trim_bad_side
-
-                    trim_end = read_end + extra_middle_trim_good_side
-                    if adapter_name in end_sequence_names:
-                        trim_end = read_end + extra_middle_trim_bad_side
-
-                    self.middle_trim_positions.update(range(trim_start, trim_end))
-                else:
-                    break
+            # For the seeded search, the windows around the seeds are first aligned all at once.
+            # Any window with a hit is then searched for all of its hits, like the whole read above.
+            max_errors = get_max_errors(len(adapter_seq), middle_threshold)
+            windows = find_seed_windows(masked_seq, adapter_seq, seed_size, max_errors)
+            if not windows:
+                continue
+            encoded_seq = EncodedSequence(masked_seq)
+            alignments = align_adapter_pairs([(encoded_seq, start, end - start)
+                                              for start, end in windows],
+                                             [adapter_seq] * len(windows), scoring_scheme_vals)
+            hit_ranges = []
+            for (window_start, window_end), alignment in zip(windows, alignments):
+                if alignment[0] < middle_threshold:
+                    continue
+                hits = align_adapter_all_hits(masked_seq[window_start:window_end], adapter_seq,
+                                              scoring_scheme_vals, middle_threshold)
+                for full_score, _, read_start, read_end in hits:
+                    self.add_middle_hit(adapter_name, full_score, window_start + read_start,
+                                        window_start + read_end, extra_middle_trim_good_side,
+                                        extra_middle_trim_bad_side, start_sequence_names,
+                                        end_sequence_names)
+                    hit_ranges.append((window_start + read_start, window_start + read_end))
+            masked_seq = mask_hits(masked_seq, hit_ranges)
+
+    def add_middle_hit(self, adapter_name, full_score, read_start, read_end,
+                       extra_middle_trim_good_side, extra_middle_trim_bad_side,
+                       start_sequence_names, end_sequence_names):
+        self.middle_adapter_ranges = add_range(self.middle_adapter_ranges, read_start, read_end)
+
+        self.middle_hit_str += '  ' + adapter_name + ' (read coords: ' + \
+                               str(read_start) + '-' + str(read_end) + ', ' + \
+                               'identity: ' + '%.1f' % full_score + '%)\n'
+
+        trim_start = read_start - extra_middle_trim_good_side
+        if adapter_name in start_sequence_names:
+            trim_start = read_start - extra_middle_trim_bad_side
+
+        trim_end = read_end + extra_middle_trim_good_side
+        if adapter_name in end_sequence_names:
+            trim_end = read_end + extra_middle_trim_bad_side
+
+        self.middle_trim_ranges = add_range(self.middle_trim_ranges, trim_start, trim_end)
+
+    def get_end_trim_results(self, adapters, include_all_scores):
+        """
+        Packs the results of end trimming and barcode calling into a tuple, so they can be sent
+        back from a worker process. Adapters are referred to by their index in the adapters list.
+        The alignments and per-barcode scores are only used for the most verbose output, so they
+        are left out unless include_all_scores is True.
+        """
+        if include_all_scores:
+            adapter_indices = {id(a): i for i, a in enumerate(adapters)}
+            start_alignments = [(adapter_indices[id(a[0])],) + a[1:]
+                                for a in self.start_adapter_alignments]
+            end_alignments = [(adapter_indices[id(a[0])],) + a[1:]
+                              for a in self.end_adapter_alignments]
+            start_barcode_scores = self.start_barcode_scores
+            end_barcode_scores = self.end_barcode_scores
+        else:
+            start_alignments, end_alignments = [], []
+            start_barcode_scores, end_barcode_scores = {}, {}
+        return (self.start_trim_amount, self.end_trim_amount, start_alignments, end_alignments,
+                start_barcode_scores, end_barcode_scores, self.best_start_barcode,
+                self.best_end_barcode, self.second_best_start_barcode,
+                self.second_best_end_barcode, self.barcode_call, self.needs_reversing)
+
+    def set_end_trim_results(self, results, adapters):
+        """
+        The reverse of get_end_trim_results.
+        """
+        self.start_trim_amount, self.end_trim_amount, start_alignments, end_alignments, \
+            self.start_barcode_scores, self.end_barcode_scores, self.best_start_barcode, \
+            self.best_end_barcode, self.second_best_start_barcode, \
+            self.second_best_end_barcode, self.barcode_call, self.needs_reversing = results
+        self.start_adapter_alignments = [(adapters[a[0]],) + a[1:] for a in start_alignments]
+        self.end_adapter_alignments = [(adapters[a[0]],) + a[1:] for a in end_alignments]
+
+    def get_middle_trim_results(self):
+        """
+        Packs the results of the middle adapter search into a tuple, so they can be sent back from
+        a worker process. Returns None if no middle adapters were found.
+        """
+        if not self.middle_adapter_ranges:
+            return None
+        return self.middle_adapter_ranges, self.middle_trim_ranges, self.middle_hit_str
+
+    def set_middle_trim_results(self, results):
+        """
+        The reverse of get_middle_trim_results.
+        """
+        if results is not None:
+            self.middle_adapter_ranges, self.middle_trim_ranges, self.middle_hit_str = \
+                results
 
     def formatted_start_seq(self, end_size, extra_trim_size):
         """
         Returns the start of the read sequence, with any found adapters highlighted in red.
         """
-        start_seq = self.seq[:end_size]
+        start_seq = self.get_seq_part(None, end_size)
         if not self.start_trim_amount:
             return start_seq
         red_bases = self.start_trim_amount - extra_trim_size
@@ -294,7 +429,7 @@ class NanoporeRead(object):
         """
         Returns the end of the read sequence, with any found adapters highlighted in red.
         """
-        end_seq = self.seq[-end_size:]
+        end_seq = self.get_seq_part(-end_size)
         if not self.end_trim_amount:
             return end_seq
         red_bases = self.end_trim_amount - extra_trim_size
@@ -312,20 +447,21 @@ class NanoporeRead(object):
         if not self.start_trim_amount and not self.end_trim_amount:
             return self.seq
 
+        seq = self.seq
         red_start_bases, red_end_bases = 0, 0
         if self.start_trim_amount:
             red_start_bases = self.start_trim_amount - extra_trim_size
         if self.end_trim_amount:
             red_end_bases = self.end_trim_amount - extra_trim_size
-        if red_start_bases + red_end_bases >= len(self.seq):
-            return red(self.seq)
+        if red_start_bases + red_end_bases >= len(seq):
+            return red(seq)
 
         formatted_start, formatted_end = '', ''
         if self.start_trim_amount:
-            formatted_start = red(self.seq[:red_start_bases])
+            formatted_start = red(seq[:red_start_bases])
         if self.end_trim_amount:
-            formatted_end = red(self.seq[-red_end_bases:])
-        middle = self.seq[red_start_bases:len(self.seq)-red_end_bases]
+            formatted_end = red(seq[-red_end_bases:])
+        middle = seq[red_start_bases:len(seq)-red_end_bases]
 
         if len(middle) <= extra_trim_size * 2:
             middle = yellow(middle)
@@ -344,7 +480,7 @@ class NanoporeRead(object):
             read_seq += 'start: ' + start_name + ' (' + '%.1f' % start_id + '%), '
             read_seq += 'end: ' + end_name + ' (' + '%.1f' % end_id + '%), '
             read_seq += 'barcode call: ' + self.barcode_call + '   '
-        if len(self.seq) <= 2 * end_size:
+        if self.seq_length() <= 2 * end_size:
             read_seq += self.formatted_whole_seq(extra_trim_size)
         else:
             read_seq += (self.formatted_start_seq(end_size, extra_trim_size) + '...' +
@@ -388,22 +524,28 @@ class NanoporeRead(object):
         If a middle adapter was found, this returns the relevant part of the read sequence, with
         the adapter highlighted in red.
         """
-        if not self.middle_adapter_positions:
+        if not self.middle_adapter_ranges:
             return
 
         trimmed_seq = self.get_seq_with_start_end_adapters_trimmed()
 
-        range_start = max(0, min(self.middle_trim_positions) - 100)
-        range_end = min(len(trimmed_seq),
-                        max(self.middle_trim_positions) + 100)
+        range_start = max(0, self.middle_trim_ranges[0][0] - 100)
+        range_end = min(len(trimmed_seq), self.middle_trim_ranges[-1][1] - 1 + 100)
         formatted_str = '' if range_start == 0 else '(' + str(range_start) + ' bp)...'
 
+        # The colour can only change at the edge of a range, so the sequence is added in pieces
+        # between those positions.
+        boundaries = {range_start, range_end}
+        for start, end in self.middle_trim_ranges + self.middle_adapter_ranges:
+            boundaries.update(x for x in (start, end) if range_start < x < range_end)
+        boundaries = sorted(boundaries)
+
         last_colour = None
-        for i in range(range_start, range_end):
+        for piece_start, piece_end in zip(boundaries, boundaries[1:]):
             char_colour = None
-            if i in self.middle_trim_positions:
+            if in_ranges(self.middle_trim_ranges, piece_start):
                 char_colour = 'yellow'
-            if i in self.middle_adapter_positions:
+            if in_ranges(self.middle_adapter_ranges, piece_start):
                 char_colour = 'red'
             if char_colour != last_colour:
                 formatted_str += END_FORMATTING
@@ -412,7 +554,7 @@ class NanoporeRead(object):
                 if char_colour == 'red':
                     formatted_str += RED
 
-            formatted_str += trimmed_seq[i]
+            formatted_str += trimmed_seq[piece_start:piece_end]
             last_colour = char_colour
         if last_colour is not None:
             formatted_str += END_FORMATTING
@@ -422,17 +564,19 @@ class NanoporeRead(object):
         return formatted_str
 
     def middle_adapter_results(self, verbosity):
-        if not self.middle_adapter_positions:
+        if not self.middle_adapter_ranges:
             return ''
         results = self.name + '\n' + self.middle_hit_str
         if verbosity > 1:
             results += self.formatted_middle_seq() + '\n'
         return results
 
-    def determine_barcode(self, barcode_threshold, barcode_diff, require_two_barcodes, correct_read_direction):
+    def determine_barcode(self, barcode_threshold, barcode_diff, require_two_barcodes, correct_read_direction,
+                          dual_barcodes=None):
         """
         This function works through the logic of choosing a barcode for the read based on the
         settings and the read's barcode alignments. It stores its result in self.barcode_call.
+        With dual_barcodes (a DualBarcodes sample sheet), the result is the read's sample.
         """
         start_barcode_scores = sorted(self.start_barcode_scores.items(), reverse=True,
                                       key=lambda x: x[1])
@@ -448,6 +592,20 @@ class NanoporeRead(object):
         if len(end_barcode_scores) >= 2:
             self.second_best_end_barcode = end_barcode_scores[1]
 
+        # With dual barcodes, the start and end barcodes are called separately (each must be over
+        # the threshold and sufficiently better than the second-best barcode at its end) and the
+        # pair of calls is looked up in the sample sheet.
+        if dual_barcodes is not None:
+            start_call, end_call = 'none', 'none'
+            if self.best_start_barcode[1] >= barcode_threshold and \
+                    self.best_start_barcode[1] >= self.second_best_start_barcode[1] + barcode_diff:
+                start_call = self.best_start_barcode[0]
+            if self.best_end_barcode[1] >= barcode_threshold and \
+                    self.best_end_barcode[1] >= self.second_best_end_barcode[1] + barcode_diff:
+                end_call = self.best_end_barcode[0]
+            self.barcode_call = dual_barcodes.get_sample(start_call, end_call)
+            return
+
         try:
             # If the user set --require_two_barcodes, then the criteria are much more stringent.
             # Both the start and end barcodes need to be over the threshold, they both need to be
@@ -510,21 +668,127 @@ class NanoporeRead(object):
 
 
 def align_adapter(read_seq, adapter_seq, scoring_scheme_vals):
-    alignment_result = adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals)
-    result_parts = alignment_result.split(',')
-    read_start = int(result_parts[0])
-
+    return get_alignment_scores(adapter_alignment(read_seq, adapter_seq, scoring_scheme_vals))
+
+
+def align_adapters(read_seq, adapter_seqs, scoring_scheme_vals, start=0, length=None):
+    """
+    Aligns many adapters to the same read sequence (an EncodedSequence, or length bases of it from
+    start) using a single C++ call. Returns a list of tuples, one per adapter, in the same format
+    as align_adapter.
+    """
+    return [get_alignment_scores(x)
+            for x in adapter_alignment_batch(read_seq, adapter_seqs, scoring_scheme_vals, start,
+                                             length)]
+
+
+def needs_barcode_score(adapter, check_barcodes, forward_or_reverse, correct_read_direction):
+    """
+    Whether an adapter's full score is kept for barcode calling.
+    """
+    return (check_barcodes and adapter.is_barcode() and
+            adapter.barcode_direction() == forward_or_reverse) or correct_read_direction
+
+
+def align_adapter_pairs(read_windows, adapter_seqs, scoring_scheme_vals):
+    """
+    Aligns each read window ((EncodedSequence, start, length) tuple) to the adapter sequence at the
+    same index using a single C++ call. Returns a list of tuples, one per pair, in the same format
+    as align_adapter.
+    """
+    return [get_alignment_scores(x)
+            for x in adapter_alignment_pairs(read_windows, adapter_seqs, scoring_scheme_vals)]
+
+
+def align_adapter_all_hits(read_seq, adapter_seq, scoring_scheme_vals, min_identity):
+    """
+    Repeatedly aligns the adapter to the read, masking each hit before the next alignment, until
+    the full adapter identity falls below min_identity. Returns a list of tuples, one per hit, in
+    the same format as align_adapter. The hits are still found one alignment at a time: finding
+    them all (and declumping them) in a single pass over the read was not implemented.
+    """
+    return [get_alignment_scores(x)
+            for x in adapter_all_hits(read_seq, adapter_seq, scoring_scheme_vals, min_identity)]
+
+
+def mask_hits(seq, hit_ranges):
+    """
+    Replaces each (start, end) range of the sequence with dashes. The ranges may overlap.
+    """
+    if not hit_ranges:
+        return seq
+    parts, pos = [], 0
+    for start, end in sorted(hit_ranges):
+        start = max(start, pos)
+        if end > start:
+            parts.append(seq[pos:start])
+            parts.append('-' * (end - start))
+            pos = end
+    parts.append(seq[pos:])
+    return ''.join(parts)
+
+
+def get_adapter_set_scores(read_seqs, adapter_sets, end_size, scoring_scheme_vals):
+    """
+    Aligns the adapter sets to the start/end of each read and returns the best start and end score
+    for each adapter set. This is not to determine where to trim the reads, but rather to figure
+    out which adapter sets are present in the data. All of the alignments are done with a single
+    C++ call, which lets the fast aligner pack them into SIMD lanes.
+    """
+    pair_read_windows, pair_adapter_seqs, pair_targets = [], [], []
+    for read_seq in read_seqs:
+        read_seq_start = EncodedSequence(read_seq[:end_size])
+        read_seq_end = EncodedSequence(read_seq[-end_size:])
+        start_window = (read_seq_start, 0, len(read_seq_start))
+        end_window = (read_seq_end, 0, len(read_seq_end))
+        for i, adapter_set in enumerate(adapter_sets):
+            if adapter_set.start_sequence:
+                pair_read_windows.append(start_window)
+                pair_adapter_seqs.append(adapter_set.start_sequence[1])
+                pair_targets.append((i, 0))
+        for i, adapter_set in enumerate(adapter_sets):
+            if adapter_set.end_sequence:
+                pair_read_windows.append(end_window)
+                pair_adapter_seqs.append(adapter_set.end_sequence[1])
+                pair_targets.append((i, 1))
+
+    best_scores = [[0.0, 0.0] for _ in adapter_sets]
+    alignments = align_adapter_pairs(pair_read_windows, pair_adapter_seqs, scoring_scheme_vals)
+    for (i, start_or_end), alignment in zip(pair_targets, alignments):
+        best_scores[i][start_or_end] = max(best_scores[i][start_or_end], alignment[0])
+    return [tuple(x) for x in best_scores]
+
+
+def get_alignment_scores(result):
+    """
+    Turns an AlignmentResult into a tuple of the values Porechop uses: full adapter identity,
+    aligned region identity, read start and read end.
+    """
     # If the read start is -1, that indicates that the alignment failed completely.
-    if read_start == -1:
-        read_end = 0
-        aligned_region_percent_identity = 0.0
-        full_adapter_percent_identity = 0.0
-    else:
-        read_end = int(result_parts[1]) + 1
-        aligned_region_percent_identity = float(result_parts[5])
-        full_adapter_percent_identity = float(result_parts[6])
-
-    return full_adapter_percent_identity, aligned_region_percent_identity, read_start, read_end
+    if result.read_start == -1:
+        return 0.0, 0.0, -1, 0
+    return result.full_adapter_percent_identity, result.aligned_region_percent_identity, \
+        result.read_start, result.read_end + 1
+
+
+def add_range(ranges, start, end):
+    """
+    Returns a sorted list of non-overlapping (start, end) ranges with the given range added. Ranges
+    which overlap or touch the new one are merged with it.
+    """
+    if start >= end:
+        return ranges
+    before = [x for x in ranges if x[1] < start]
+    after = [x for x in ranges if x[0] > end]
+    overlapping = ranges[len(before):len(ranges) - len(after)]
+    if overlapping:
+        start, end = min(start, overlapping[0][0]), max(end, overlapping[-1][1])
+    return before + [(start, end)] + after
+
+
+def in_ranges(ranges, position):
+    i = bisect.bisect_right(ranges, (position, float('inf'))) - 1
+    return i >= 0 and ranges[i][1] > position
 
 
 def add_number_to_read_name(read_name, number):
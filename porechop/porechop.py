@@ -17,71 +17,276 @@ not, see <http://www.gnu.org/licenses/>.
 import argparse
 import os
 import sys
-import subprocess
 import multiprocessing
-import shutil
 import re
+import itertools
 from multiprocessing.dummy import Pool as ThreadPool
-from collections import defaultdict
-from .misc import load_fasta_or_fastq, print_table, red, bold_underline, MyHelpFormatter, int_to_str, reverse_complement
+from collections import defaultdict, Counter, deque
+from .misc import load_fasta_or_fastq, iterate_fasta_or_fastq, get_sequence_file_type, print_table, red, bold_underline, MyHelpFormatter, int_to_str, reverse_complement
 from .adapters import ADAPTERS, make_full_native_barcode_adapter,\
-    make_old_full_rapid_barcode_adapter, make_new_full_rapid_barcode_adapter, Adapter
-from .nanopore_read import NanoporeRead
+    make_old_full_rapid_barcode_adapter, make_new_full_rapid_barcode_adapter, Adapter, \
+    get_adapter_sequence_names
+from .nanopore_read import NanoporeRead, get_adapter_set_scores
+from .read_store import ReadStore
+from .bgzf_writer import BgzfWriter
+from .bin_writer import BinWriter
+from .checkpoint import load_checkpoint, get_checkpoint_settings
+from .adapter_profile import save_adapter_profile, load_adapter_profile
+from .adapter_index import make_end_indices
+from .barcode_calling import call_barcodes
+from .dual_barcodes import load_dual_barcodes, make_dual_barcode_adapter_sets
+from .cpp_function_wrappers import set_aligner, register_adapter_lists
+from .metrics import start_metrics, save_metrics, phase, timed_iterator, add_reads, \
+    collect_worker_alignment_stats
+from .process_pool import make_process_pool, make_batches, get_read_ends, \
+    align_adapter_subset_batch, trim_read_ends_batch, find_middle_adapters_batch
 from .version import __version__
 
 
+# The adaptive adapter search aligns the check reads in increments of this many reads, and an
+# adapter set is only decided once its score is at least this far from --adapter_threshold.
+ADAPTIVE_SEARCH_INCREMENT = 250
+ADAPTIVE_SEARCH_MARGIN = 5.0
+
+
 def main():
     args = get_arguments()
-    reads, check_reads, read_type = load_reads(args.input, args.verbosity, args.print_dest,
-                                               args.check_reads)
+    set_aligner(args.aligner)
+    if args.metrics:
+        start_metrics(args.metrics_adapters)
+    trim_reads(args)
+    if args.metrics:
+        save_metrics(args.metrics, get_adapter_sequence_names(args.custom_adapter))
+
+
+def trim_reads(args):
+    dual_barcodes = load_dual_barcodes(args.dual_barcodes) if args.dual_barcodes else None
+    checkpoint = None
+    if args.checkpoint:
+        checkpoint = load_checkpoint(args.checkpoint, get_checkpoint_settings(args))
+        if checkpoint.resumed:
+            if args.verbosity > 0:
+                print('Resuming from checkpoint: ' + int_to_str(checkpoint.reads_done) +
+                      ' reads already done\n', file=args.print_dest)
+            register_adapter_sets(checkpoint.matching_sets, args.scoring_scheme_vals)
+            process_reads_in_chunks(args, checkpoint.matching_sets,
+                                    checkpoint.forward_or_reverse_barcodes, checkpoint.read_type,
+                                    checkpoint, dual_barcodes)
+            return
+
+    with phase('loading'):
+        if args.chunk_size and args.adapter_profile:  # no check reads are needed
+            reads, check_reads, read_type = None, [], get_input_read_type(args.input)
+        elif args.chunk_size:
+            reads = None
+            check_reads, read_type = load_check_reads(args.input, args.verbosity,
+                                                      args.print_dest, args.check_reads,
+                                                      args.threads)
+        else:
+            reads, check_reads, read_type = load_reads(args.input, args.verbosity,
+                                                       args.print_dest, args.check_reads,
+                                                       args.threads)
+        if reads is not None:
+            add_reads(reads)
     
-    if args.custom_adapter is not None and len(args.custom_adapter) > 0:
-        matching_sets = [Adapter(name, start_sequence=(name+"_(start)",forward), end_sequence=(name+"_(end)", reverse)) for forward, reverse, name in args.custom_adapter]
-
-        forward_or_reverse_barcodes = None # can be ignored because we dont use barcode binning
-    else:
-
-        matching_sets = find_matching_adapter_sets(check_reads, args.verbosity, args.end_size,
-                                               args.scoring_scheme_vals, args.print_dest,
-                                               args.adapter_threshold, args.threads)
-        matching_sets = fix_up_1d2_sets(matching_sets)
-
-        if args.barcode_dir:
-            forward_or_reverse_barcodes = choose_barcoding_kit(matching_sets, args.verbosity,
-                                                           args.print_dest)
+    with phase('discovery'):
+        if args.custom_adapter is not None and len(args.custom_adapter) > 0:
+            matching_sets = [Adapter(name, start_sequence=(name+"_(start)",forward), end_sequence=(name+"_(end)", reverse)) for forward, reverse, name in args.custom_adapter]
+
+            forward_or_reverse_barcodes = None # can be ignored because we dont use barcode binning
+        elif args.adapter_profile:
+            matching_sets, forward_or_reverse_barcodes = load_adapter_profile(args.adapter_profile)
+            display_adapter_profile(matching_sets, args.adapter_profile, args.verbosity,
+                                    args.print_dest)
+            if not args.barcode_dir:
+                forward_or_reverse_barcodes = None
+            elif forward_or_reverse_barcodes is None:
+                forward_or_reverse_barcodes = choose_barcoding_kit(matching_sets, args.verbosity,
+                                                                   args.print_dest)
+            matching_sets = add_full_barcode_adapter_sets(matching_sets)
         else:
-            forward_or_reverse_barcodes = None
-
-        display_adapter_set_results(matching_sets, args.verbosity, args.print_dest)
-        matching_sets = add_full_barcode_adapter_sets(matching_sets)
+            add_reads(check_reads)
+            matching_sets = find_matching_adapter_sets(check_reads, args.verbosity,
+                                                       args.end_size, args.scoring_scheme_vals,
+                                                       args.print_dest, args.adapter_threshold,
+                                                       args.threads, args.worker_type,
+                                                       args.adapter_search)
+            matching_sets = fix_up_1d2_sets(matching_sets)
+
+            if args.barcode_dir:
+                forward_or_reverse_barcodes = choose_barcoding_kit(matching_sets, args.verbosity,
+                                                               args.print_dest)
+            else:
+                forward_or_reverse_barcodes = None
+
+            display_adapter_set_results(matching_sets, args.verbosity, args.print_dest)
+            if args.save_adapter_profile:
+                save_adapter_profile(args.save_adapter_profile, matching_sets,
+                                     forward_or_reverse_barcodes)
+            matching_sets = add_full_barcode_adapter_sets(matching_sets)
+        if dual_barcodes is not None:
+            matching_sets = make_dual_barcode_adapter_sets(matching_sets, dual_barcodes,
+                                                           forward_or_reverse_barcodes)
+    register_adapter_sets(matching_sets, args.scoring_scheme_vals)
 
     if args.verbosity > 0:
         print('\n', file=args.print_dest)
 
+    if args.chunk_size:
+        if checkpoint is not None:
+            checkpoint.start(read_type, matching_sets, forward_or_reverse_barcodes)
+        process_reads_in_chunks(args, matching_sets, forward_or_reverse_barcodes, read_type,
+                                checkpoint, dual_barcodes)
+        return
+
     if matching_sets:
         check_barcodes = (args.barcode_dir is not None)
-        find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
-                                   args.extra_end_trim, args.end_threshold,
-                                   args.scoring_scheme_vals, args.print_dest, args.min_trim_size,
-                                   args.threads, check_barcodes, args.barcode_threshold,
-                                   args.barcode_diff, args.require_two_barcodes,
-                                   forward_or_reverse_barcodes, args.correct_read_direction)
-        display_read_end_trimming_summary(reads, args.verbosity, args.print_dest, args.head_crop, args.tail_crop, args.min_length, args.max_length, args.trimmed_only)
+        with phase('end_trimming'):
+            add_reads(reads)
+            find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
+                                       args.extra_end_trim, args.end_threshold,
+                                       args.scoring_scheme_vals, args.print_dest,
+                                       args.min_trim_size, args.threads, check_barcodes,
+                                       args.barcode_threshold, args.barcode_diff,
+                                       args.require_two_barcodes, forward_or_reverse_barcodes,
+                                       args.correct_read_direction, args.worker_type,
+                                       args.kmer_prefilter,
+                                       dual_barcodes=dual_barcodes)
+        display_read_end_trimming_summary(get_read_end_trimming_counts(reads, args.head_crop, args.tail_crop, args.min_length, args.max_length, args.trimmed_only), args.verbosity, args.print_dest)
 
         if not args.no_split:
-            find_adapters_in_read_middles(reads, matching_sets, args.verbosity,
-                                          args.middle_threshold, args.extra_middle_trim_good_side,
-                                          args.extra_middle_trim_bad_side, args.scoring_scheme_vals,
-                                          args.print_dest, args.threads, args.discard_middle)
-            display_read_middle_trimming_summary(reads, args.discard_middle, args.verbosity,
+            with phase('middle_splitting'):
+                add_reads(reads)
+                find_adapters_in_read_middles(reads, matching_sets, args.verbosity,
+                                              args.middle_threshold,
+                                              args.extra_middle_trim_good_side,
+                                              args.extra_middle_trim_bad_side,
+                                              args.scoring_scheme_vals, args.print_dest,
+                                              args.threads, args.discard_middle,
+                                              args.worker_type, args.middle_search)
+            display_read_middle_trimming_summary(get_read_middle_trimming_counts(reads),
+                                                 args.discard_middle, args.verbosity,
                                                  args.print_dest)
     elif args.verbosity > 0:
         print('No adapters found - output reads are unchanged from input reads\n',
               file=args.print_dest)
-    output_reads(reads, args.format, args.output, read_type, args.verbosity,
-                 args.discard_middle, args.min_split_read_size, args.print_dest,
-                 args.barcode_dir, args.input, args.untrimmed, args.threads,
-                 args.discard_unassigned, args.tail_crop, args.trimmed_only, args.min_length, args.head_crop, args.max_length, args.correct_read_direction)
+    with phase('output'):
+        add_reads(reads)
+        output_reads(reads, args.format, args.output, read_type, args.verbosity,
+                     args.discard_middle, args.min_split_read_size, args.print_dest,
+                     args.barcode_dir, args.input, args.untrimmed, args.threads,
+                     args.discard_unassigned, args.tail_crop, args.trimmed_only, args.min_length, args.head_crop, args.max_length, args.correct_read_direction)
+
+
+def register_adapter_sets(adapter_sets, scoring_scheme_vals):
+    """
+    Registers the sequences of the adapter sets which will be trimmed with the C++ aligners, so the
+    per-read alignments can refer to them by handle.
+    """
+    register_adapter_lists(get_adapter_lists(adapter_sets), scoring_scheme_vals)
+
+
+def get_adapter_lists(adapter_sets):
+    """
+    Returns the lists of adapter sequences which are aligned together to each read end when the
+    adapter sets are trimmed: their start sequences and their end sequences.
+    """
+    return [[x.start_sequence[1] for x in adapter_sets if x.start_sequence],
+            [x.end_sequence[1] for x in adapter_sets if x.end_sequence]]
+
+
+def process_reads_in_chunks(args, matching_sets, forward_or_reverse_barcodes, read_type,
+                            checkpoint=None, dual_barcodes=None):
+    """
+    The streaming alternative to the main trimming steps: reads are loaded, trimmed, split and
+    written one chunk at a time, so only --chunk_size reads are ever held in memory. The adapter
+    sets must already have been chosen (using the check reads). With a checkpoint, the run carries
+    on from where the checkpoint got to and the checkpoint is saved after each chunk.
+    """
+    if args.verbosity > 0:
+        if matching_sets:
+            display_adapters_to_trim(matching_sets, args.print_dest)
+        else:
+            print('No adapters found - output reads are unchanged from input reads\n',
+                  file=args.print_dest)
+
+    if checkpoint is None:
+        end_counts, middle_counts, start_position = Counter(), Counter(), None
+    else:
+        end_counts, middle_counts = checkpoint.end_counts, checkpoint.middle_counts
+        start_position = checkpoint.input_position
+    read_chunks = trim_read_chunks(timed_iterator('loading',
+                                                  load_read_chunks(args.input, args.chunk_size,
+                                                                   args.threads, start_position)),
+                                   matching_sets, forward_or_reverse_barcodes, args, end_counts,
+                                   middle_counts, dual_barcodes)
+    if checkpoint is None:
+        reads = itertools.chain.from_iterable(reads for reads, _ in read_chunks)
+    else:
+        reads = checkpoint.save_after_each_chunk(read_chunks)
+    with phase('output'):
+        output_reads(reads, args.format, args.output, read_type, args.verbosity,
+                     args.discard_middle, args.min_split_read_size, args.print_dest,
+                     args.barcode_dir, args.input, args.untrimmed, args.threads,
+                     args.discard_unassigned, args.tail_crop, args.trimmed_only, args.min_length, args.head_crop, args.max_length, args.correct_read_direction,
+                     checkpoint)
+
+    if matching_sets:
+        display_read_end_trimming_summary(end_counts, args.verbosity, args.print_dest)
+        if not args.no_split:
+            display_read_middle_trimming_summary(middle_counts, args.discard_middle,
+                                                 args.verbosity, args.print_dest)
+    if checkpoint is not None:
+        checkpoint.finish()
+
+
+def trim_read_chunks(read_chunks, matching_sets, forward_or_reverse_barcodes, args, end_counts,
+                     middle_counts, dual_barcodes=None):
+    """
+    A generator which finds adapters in each chunk of reads and then passes the chunk (with its
+    input position) on. The counts used for the trimming summaries are accumulated in end_counts
+    and middle_counts.
+    """
+    check_barcodes = (args.barcode_dir is not None)
+    reads_done = 0
+    for reads, input_position in read_chunks:
+        add_reads(reads, 'loading')
+        add_reads(reads, 'output')
+        if matching_sets:
+            with phase('end_trimming'):
+                add_reads(reads)
+                find_adapters_at_read_ends(reads, matching_sets, args.verbosity, args.end_size,
+                                           args.extra_end_trim, args.end_threshold,
+                                           args.scoring_scheme_vals, args.print_dest,
+                                           args.min_trim_size, args.threads, check_barcodes,
+                                           args.barcode_threshold, args.barcode_diff,
+                                           args.require_two_barcodes,
+                                           forward_or_reverse_barcodes,
+                                           args.correct_read_direction, args.worker_type,
+                                           args.kmer_prefilter, chunked=True,
+                                           dual_barcodes=dual_barcodes)
+            end_counts.update(get_read_end_trimming_counts(reads, args.head_crop, args.tail_crop,
+                                                           args.min_length, args.max_length,
+                                                           args.trimmed_only))
+            if not args.no_split:
+                with phase('middle_splitting'):
+                    add_reads(reads)
+                    find_adapters_in_read_middles(reads, matching_sets, args.verbosity,
+                                                  args.middle_threshold,
+                                                  args.extra_middle_trim_good_side,
+                                                  args.extra_middle_trim_bad_side,
+                                                  args.scoring_scheme_vals, args.print_dest,
+                                                  args.threads, args.discard_middle,
+                                                  args.worker_type, args.middle_search,
+                                                  chunked=True)
+                middle_counts.update(get_read_middle_trimming_counts(reads))
+        reads_done += len(reads)
+        if args.verbosity == 1:
+            print('\r' + int_to_str(reads_done) + ' reads processed', end='', flush=True,
+                  file=args.print_dest)
+        yield reads, input_position
+    if args.verbosity == 1:
+        print('', flush=True, file=args.print_dest)
 
 
 def get_arguments():
@@ -111,7 +316,8 @@ def get_arguments():
                                  '3 = full - output will go to stdout if reads are saved to '
                                  'a file and stderr if reads are printed to stdout')
     main_group.add_argument('-t', '--threads', type=int, default=default_threads,
-                            help='Number of threads to use for adapter alignment')
+                            help='Number of threads to use for adapter alignment and for '
+                                 'loading the files of a directory input')
     main_group.add_argument('--custom_adapter', action='append', nargs=3, help="specify custom adapter consisting of start-adapter; end-adapter and a name.")
     main_group.add_argument('--correct_read_direction', help="tries to correct read direction (does not work for sequences with middle adapters)", action="store_true")
     main_group.add_argument('--trimmed_only', action="store_true", help="using this option discards all reads that were not trimmed.")
@@ -139,6 +345,11 @@ def get_arguments():
                                help='Reads will only be put in barcode bins if they have a strong '
                                     'match for the barcode on both their start and end (default: '
                                     'a read can be binned with a match at its start or end)')
+    barcode_group.add_argument('--dual_barcodes', type=str,
+                               help='Bin reads by the pair of barcodes at their start and end, '
+                                    'using this sample sheet of start barcode, end barcode and '
+                                    'sample name (name optional) lines - each end must pass '
+                                    '--barcode_threshold and --barcode_diff on its own')
     barcode_group.add_argument('--untrimmed', action='store_true',
                                help='Bin reads but do not trim them (default: trim the reads)')
     barcode_group.add_argument('--discard_unassigned', action='store_true',
@@ -154,6 +365,18 @@ def get_arguments():
     adapter_search_group.add_argument('--check_reads', type=int, default=10000,
                                       help='This many reads will be aligned to all possible '
                                            'adapters to determine which adapter sets are present')
+    adapter_search_group.add_argument('--adapter_search', choices=['full', 'adaptive'],
+                                      default='full',
+                                      help='Align all of the check reads to every adapter set, or '
+                                           'align them in increments and stop once each set is '
+                                           'clearly above or below --adapter_threshold (faster, '
+                                           'but a set in very few reads may be missed)')
+    adapter_search_group.add_argument('--save_adapter_profile', type=str,
+                                      help='Save the adapter sets found by the search to this '
+                                           'file, for use with --adapter_profile')
+    adapter_search_group.add_argument('--adapter_profile', type=str,
+                                      help='Use the adapter sets saved in this file (by '
+                                           '--save_adapter_profile) instead of searching for them')
     adapter_search_group.add_argument('--scoring_scheme', type=str, default='3,-6,-5,-2',
                                       help='Comma-delimited string of alignment scores: match, '
                                            'mismatch, gap open, gap extend')
@@ -171,6 +394,11 @@ def get_arguments():
     end_trim_group.add_argument('--end_threshold', type=float, default=75.0,
                                 help='Adapters at the ends of reads must have at least this '
                                      'percent identity to be removed (0 to 100)')
+    end_trim_group.add_argument('--kmer_prefilter', type=int, default=0,
+                                help='Only align adapters which share at least one k-mer of this '
+                                     'size with the read end - faster with many barcodes, but '
+                                     'not lossless: adapter hits can be missed, changing trims '
+                                     'and barcode calls (0 = align all adapters)')
 
     middle_trim_group = parser.add_argument_group('Middle adapter settings',
                                                   'Control the splitting of read from middle '
@@ -196,6 +424,37 @@ def get_arguments():
     middle_trim_group.add_argument('--min_split_read_size', type=int, default=1000,
                                    help='Post-split read pieces smaller than this many base pairs '
                                         'will not be outputted')
+    middle_trim_group.add_argument('--middle_search', choices=['full', 'seeded'], default='full',
+                                   help='Align adapters to the whole read or only to the parts '
+                                        'with an exact k-mer match (much faster for long reads, '
+                                        'and k is chosen so no hits over the threshold are lost)')
+
+    performance_group = parser.add_argument_group('Performance settings',
+                                                  'Control memory use and parallelism (these do '
+                                                  'not change the trimming results)')
+    performance_group.add_argument('--chunk_size', type=int, default=0,
+                                   help='Load, trim and output reads in chunks of this many reads, '
+                                        'so memory use does not grow with the input size (0 = load '
+                                        'all reads into memory at once)')
+    performance_group.add_argument('--checkpoint', type=str,
+                                   help='Save progress to this file after each chunk, and resume '
+                                        'from it if it already exists (requires --chunk_size and '
+                                        '--output or --barcode_dir)')
+    performance_group.add_argument('--worker_type', choices=['threads', 'processes'],
+                                   default='threads',
+                                   help='Run adapter alignment in a pool of threads or of '
+                                        'separate processes - processes make better use of many '
+                                        'cores but have some extra start-up and copying cost')
+    performance_group.add_argument('--aligner', choices=['seqan', 'fast'], default='seqan',
+                                   help='Adapter alignment engine: SeqAn or a specialised aligner '
+                                        'which is much faster and gives the same alignments')
+    performance_group.add_argument('--metrics', type=str,
+                                   help='Save the time, throughput, alignment counts and memory '
+                                        'use of each phase to this file (TSV if it ends in .tsv, '
+                                        'otherwise JSON)')
+    performance_group.add_argument('--metrics_adapters', action='store_true',
+                                   help='Include a breakdown of alignment time by adapter in '
+                                        '--metrics')
 
     help_args = parser.add_argument_group('Help')
     help_args.add_argument('-h', '--help', action='help', default=argparse.SUPPRESS,
@@ -219,6 +478,14 @@ def get_arguments():
     if args.untrimmed and args.barcode_dir is None:
         sys.exit('Error: --untrimmed can only be used with --barcode_dir')
 
+    if args.dual_barcodes is not None:
+        if args.barcode_dir is None:
+            sys.exit('Error: --dual_barcodes can only be used with --barcode_dir')
+        if args.custom_adapter:
+            sys.exit('Error: --dual_barcodes cannot be used with --custom_adapter')
+        if args.correct_read_direction:
+            sys.exit('Error: --dual_barcodes cannot be used with --correct_read_direction')
+
     if args.barcode_dir is not None:
         args.discard_middle = True
 
@@ -230,10 +497,33 @@ def get_arguments():
     if args.threads < 1:
         sys.exit('Error: at least one thread required')
 
+    if args.chunk_size < 0:
+        sys.exit('Error: --chunk_size cannot be negative')
+
+    if args.adapter_profile is not None and args.save_adapter_profile is not None:
+        sys.exit('Error: only one of the following options may be used: --adapter_profile, '
+                 '--save_adapter_profile')
+
+    if args.custom_adapter and (args.adapter_profile is not None or
+                                args.save_adapter_profile is not None):
+        sys.exit('Error: adapter profiles cannot be used with --custom_adapter')
+
+    if args.checkpoint is not None:
+        if not args.chunk_size:
+            sys.exit('Error: --checkpoint can only be used with --chunk_size')
+        if args.output is None and args.barcode_dir is None:
+            sys.exit('Error: --checkpoint requires --output or --barcode_dir')
+
+    if args.kmer_prefilter < 0:
+        sys.exit('Error: --kmer_prefilter cannot be negative')
+
+    if args.metrics_adapters and not args.metrics:
+        sys.exit('Error: --metrics_adapters can only be used with --metrics')
+
     return args
 
 
-def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count):
+def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count, threads=1):
 
     # If the input is a file, just load reads from that file. The check reads will just be the
     # first reads from that file.
@@ -242,10 +532,11 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
             print('\n' + bold_underline('Loading reads'), flush=True, file=print_dest)
             print(input_file_or_directory, flush=True, file=print_dest)
         reads, read_type = load_fasta_or_fastq(input_file_or_directory)
+        store = ReadStore()
         if read_type == 'FASTA':
-            reads = [NanoporeRead(x[2], x[1], '') for x in reads]
+            reads = [NanoporeRead(x[2], x[1], '', store) for x in reads]
         else:  # FASTQ
-            reads = [NanoporeRead(x[4], x[1], x[3]) for x in reads]
+            reads = [NanoporeRead(x[4], x[1], x[3], store) for x in reads]
         check_reads = reads[:check_read_count]
 
     # If the input is a directory, assume it's an Albacore directory and search it recursively for
@@ -253,25 +544,14 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     elif os.path.isdir(input_file_or_directory):
         if verbosity > 0:
             print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
-        fastqs = sorted([os.path.join(dir_path, f)
-                         for dir_path, _, filenames in os.walk(input_file_or_directory)
-                         for f in filenames
-                         if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
-        if not fastqs:
-            sys.exit('Error: could not find fastq files in ' + input_file_or_directory)
+        fastqs = find_fastq_files(input_file_or_directory)
         reads = []
         read_type = 'FASTQ'
         check_reads = []
         check_reads_per_file = int(round(check_read_count / len(fastqs)))
-        for fastq_file in fastqs:
+        for fastq_file, file_reads in load_fastq_files(fastqs, threads):
             if verbosity > 0:
                 print(fastq_file, flush=True, file=print_dest)
-            file_reads, _ = load_fasta_or_fastq(fastq_file)
-            file_reads = [NanoporeRead(x[4], x[1], x[3]) for x in file_reads]
-
-            albacore_barcode = get_albacore_barcode_from_path(fastq_file)
-            for read in file_reads:
-                read.albacore_barcode_call = albacore_barcode
             reads += file_reads
             check_reads += file_reads[:check_reads_per_file]
         if verbosity > 0:
@@ -285,6 +565,169 @@ def load_reads(input_file_or_directory, verbosity, print_dest, check_read_count)
     return reads, check_reads, read_type
 
 
+def load_check_reads(input_file_or_directory, verbosity, print_dest, check_read_count,
+                     threads=1):
+    """
+    When processing reads in chunks, only the check reads (used to find the adapter sets) are
+    loaded up front. They are taken from the input in the same way as in load_reads.
+    """
+    if os.path.isfile(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Loading check reads'), flush=True, file=print_dest)
+            print(input_file_or_directory, flush=True, file=print_dest)
+        records, read_type = iterate_fasta_or_fastq(input_file_or_directory)
+        store = ReadStore()
+        check_reads = [make_nanopore_read(x, read_type, store)
+                       for x in itertools.islice(records, check_read_count)]
+        records.close()
+
+    elif os.path.isdir(input_file_or_directory):
+        if verbosity > 0:
+            print('\n' + bold_underline('Searching for FASTQ files'), flush=True, file=print_dest)
+        fastqs = find_fastq_files(input_file_or_directory)
+        read_type = 'FASTQ'
+        check_reads = []
+        check_reads_per_file = int(round(check_read_count / len(fastqs)))
+        for fastq_file, file_reads in load_fastq_files(fastqs, threads, check_reads_per_file):
+            if verbosity > 0:
+                print(fastq_file, flush=True, file=print_dest)
+            check_reads += file_reads
+        if verbosity > 0:
+            print('', flush=True, file=print_dest)
+
+    else:
+        sys.exit('Error: could not find ' + input_file_or_directory)
+
+    if verbosity > 0:
+        print(int_to_str(len(check_reads)) + ' check reads loaded\n\n', flush=True,
+              file=print_dest)
+    return check_reads, read_type
+
+
+def load_read_chunks(input_file_or_directory, chunk_size, threads=1, start_position=None):
+    """
+    A generator which yields the input reads as lists of (at most) chunk_size NanoporeRead objects.
+    Each chunk from a single input file has its own ReadStore, so its memory is freed once the
+    chunk has been written. Directory input is loaded a whole file at a time (basecaller output
+    files are small), using threads to load the next few files in the background. A chunk can
+    contain reads from more than one file.
+
+    Each chunk is given with the input position it ends at: (input file, number of reads used from
+    that file). If a start_position is given (from a checkpoint), the reads before it are skipped.
+    """
+    start_file, start_read = start_position if start_position else (None, 0)
+    if os.path.isfile(input_file_or_directory):
+        input_file = os.path.abspath(input_file_or_directory)
+        records, read_type = iterate_fasta_or_fastq(input_file_or_directory)
+        reads_done = start_read
+        chunk, store = [], ReadStore()
+        for record in itertools.islice(records, start_read, None):
+            chunk.append(make_nanopore_read(record, read_type, store))
+            if len(chunk) == chunk_size:
+                reads_done += len(chunk)
+                yield chunk, (input_file, reads_done)
+                chunk, store = [], ReadStore()
+        end_position = (input_file, reads_done + len(chunk))
+    else:
+        fastqs = find_fastq_files(input_file_or_directory)
+        if start_file is not None:
+            fastq_paths = [os.path.abspath(f) for f in fastqs]
+            if start_file not in fastq_paths:
+                sys.exit('Error: ' + start_file + ' is no longer in the input directory')
+            fastqs = fastqs[fastq_paths.index(start_file):]
+        chunk = []
+        for fastq_file, file_reads in load_fastq_files(fastqs, threads):
+            fastq_file = os.path.abspath(fastq_file)
+            reads_done = start_read if fastq_file == start_file else 0
+            file_reads = file_reads[reads_done:]
+            while file_reads:
+                space = chunk_size - len(chunk)
+                chunk += file_reads[:space]
+                reads_done += len(file_reads[:space])
+                file_reads = file_reads[space:]
+                if len(chunk) == chunk_size:
+                    yield chunk, (fastq_file, reads_done)
+                    chunk = []
+            end_position = (fastq_file, reads_done)
+    if chunk:
+        yield chunk, end_position
+
+
+def load_fastq_files(fastqs, threads, max_reads_per_file=None):
+    """
+    A generator which loads the reads from the fastq files of a directory input, using a pool of
+    threads, and yields (file name, reads) for each file in the given order. At most a few files
+    are loaded ahead of the one being used, so memory use doesn't grow with the number of files.
+    """
+    pool = ThreadPool(threads)
+    pending = deque()
+    try:
+        for fastq_file in fastqs:
+            pending.append((fastq_file, pool.apply_async(load_fastq_file,
+                                                         (fastq_file, max_reads_per_file))))
+            if len(pending) > threads:
+                yield get_loaded_fastq_file(*pending.popleft())
+        while pending:
+            yield get_loaded_fastq_file(*pending.popleft())
+    finally:
+        pool.terminate()
+
+
+def load_fastq_file(fastq_file, max_reads):
+    """
+    Loads the reads (or the first max_reads reads) of one file of a directory input, giving them
+    the file's Albacore barcode call. Each file has its own ReadStore, as the files are loaded in
+    separate threads. A sys.exit (e.g. for a badly formatted file) is returned instead of raised,
+    so it can be raised again in the main thread.
+    """
+    try:
+        records, read_type = iterate_fasta_or_fastq(fastq_file)
+        store = ReadStore()
+        albacore_barcode = get_albacore_barcode_from_path(fastq_file)
+        reads = []
+        for record in itertools.islice(records, max_reads):
+            read = make_nanopore_read(record, read_type, store)
+            read.albacore_barcode_call = albacore_barcode
+            reads.append(read)
+        records.close()
+        return reads
+    except SystemExit as e:
+        return e
+
+
+def get_loaded_fastq_file(fastq_file, result):
+    reads = result.get()
+    if isinstance(reads, SystemExit):
+        raise reads
+    return fastq_file, reads
+
+
+def get_input_read_type(input_file_or_directory):
+    if os.path.isfile(input_file_or_directory):
+        return get_sequence_file_type(input_file_or_directory)
+    elif os.path.isdir(input_file_or_directory):
+        return 'FASTQ'
+    else:
+        sys.exit('Error: could not find ' + input_file_or_directory)
+
+
+def make_nanopore_read(record, read_type, store=None):
+    if read_type == 'FASTA':
+        return NanoporeRead(record[2], record[1], '', store)
+    else:  # FASTQ
+        return NanoporeRead(record[4], record[1], record[3], store)
+
+
+def find_fastq_files(directory):
+    fastqs = sorted([os.path.join(dir_path, f)
+                     for dir_path, _, filenames in os.walk(directory)
+                     for f in filenames
+                     if f.lower().endswith('.fastq') or f.lower().endswith('.fastq.gz')])
+    if not fastqs:
+        sys.exit('Error: could not find fastq files in ' + directory)
+    return fastqs
+
+
 def get_albacore_barcode_from_path(albacore_path):
     if '/unclassified/' in albacore_path:
         return 'none'
@@ -296,9 +739,13 @@ def get_albacore_barcode_from_path(albacore_path):
 
 
 def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_vals, print_dest,
-                               adapter_threshold, threads):
+                               adapter_threshold, threads, worker_type='threads',
+                               adapter_search='full'):
     """
     Aligns all of the adapter sets to the start/end of reads to see which (if any) matches best.
+    With adapter_search='adaptive', the check reads are aligned in increments and adapter sets are
+    dropped from the search once they are clearly present or absent (see is_adapter_set_decided),
+    so the search can stop well before using all of the check reads.
     """
     read_count = len(check_reads)
     if verbosity > 0:
@@ -306,39 +753,90 @@ def find_matching_adapter_sets(check_reads, verbosity, end_size, scoring_scheme_
         output_progress_line(0, read_count, print_dest)
 
     search_adapters = [a for a in ADAPTERS if '(full sequence)' not in a.name]
-    search_adapter_count = len(search_adapters)
+    if adapter_search == 'adaptive':
+        increment_size = ADAPTIVE_SEARCH_INCREMENT
+    else:
+        increment_size = max(1, read_count)
+
+    # The reads are aligned in batches, each giving the best start/end score of every adapter set
+    # being searched for, and the batches are combined by taking the maximum.
+    finished_count = 0
+
+    def combine_batch_scores(batch, adapters, batch_scores):
+        nonlocal finished_count
+        for adapter_set, (start_score, end_score) in zip(adapters, batch_scores):
+            adapter_set.best_start_score = max(adapter_set.best_start_score, start_score)
+            adapter_set.best_end_score = max(adapter_set.best_end_score, end_score)
+        finished_count += len(batch)
+        if verbosity > 0:
+            output_progress_line(finished_count, read_count, print_dest, step=1)
 
-    # If single-threaded, do the work in a simple loop.
+    # If single-threaded, do the work in a simple loop. If using worker processes, send them just
+    # the read ends and the indices of the adapter sets to align. If multi-threaded, use a thread
+    # pool.
     if threads == 1:
-        for read_num, read in enumerate(check_reads):
-            for adapter_set in search_adapters:
-                read.align_adapter_set(adapter_set, end_size, scoring_scheme_vals)
-            if verbosity > 0:
-                output_progress_line(read_num+1, read_count, print_dest)
-
-    # If multi-threaded, use a thread pool.
+        pool = None
+    elif worker_type == 'processes':
+        settings = {'end_size': end_size, 'scoring_scheme_vals': scoring_scheme_vals}
+        pool = make_process_pool(threads, search_adapters, settings)
     else:
-        def align_adapter_set_one_arg(all_args):
-            r, a, b, c = all_args
-            r.align_adapter_set(a, b, c)
-        with ThreadPool(threads) as pool:
-            arg_list = []
-            for read in check_reads:
-                for adapter_set in search_adapters:
-                    arg_list.append((read, adapter_set, end_size, scoring_scheme_vals))
-            finished_count = 0
-            for _ in pool.imap(align_adapter_set_one_arg, arg_list):
-                finished_count += 1
-                if verbosity > 0 and finished_count % search_adapter_count == 0:
-                    output_progress_line(finished_count // search_adapter_count,
-                                         read_count, print_dest)
+        pool = ThreadPool(threads)
+
+    adapters = search_adapters
+
+    def align_adapter_sets_one_arg(batch):
+        return get_adapter_set_scores([r.seq for r in batch], adapters, end_size,
+                                      scoring_scheme_vals)
+
+    try:
+        for i in range(0, read_count, increment_size):
+            batches = make_batches(check_reads[i:i+increment_size], threads)
+            previous_scores = [(a.best_start_score, a.best_end_score) for a in adapters]
+            if pool is None:
+                batch_scores = map(align_adapter_sets_one_arg, batches)
+            elif worker_type == 'processes':
+                adapter_indices = [search_adapters.index(a) for a in adapters]
+                batch_scores = collect_worker_alignment_stats(
+                    pool.imap(align_adapter_subset_batch,
+                              (([get_read_ends(r, end_size) for r in batch], adapter_indices)
+                               for batch in batches)))
+            else:
+                batch_scores = pool.imap(align_adapter_sets_one_arg, batches)
+            for batch, scores in zip(batches, batch_scores):
+                combine_batch_scores(batch, adapters, scores)
+
+            if adapter_search == 'adaptive':
+                adapters = [a for a, previous in zip(adapters, previous_scores)
+                            if not is_adapter_set_decided(a, previous, adapter_threshold)]
+                if not adapters:
+                    break
+    finally:
+        if pool is not None:
+            pool.terminate()
 
     if verbosity > 0:
-        output_progress_line(read_count, read_count, print_dest, end_newline=True)
+        if finished_count < read_count:
+            output_progress_line(finished_count, read_count, print_dest, end_newline=True)
+            print('All adapter sets decided after ' + int_to_str(finished_count) +
+                  ' check reads', file=print_dest)
+        else:
+            output_progress_line(read_count, read_count, print_dest, end_newline=True)
 
     return [x for x in search_adapters if x.best_start_or_end_score() >= adapter_threshold]
 
 
+def is_adapter_set_decided(adapter_set, previous_scores, adapter_threshold):
+    """
+    In the adaptive adapter search, an adapter set is decided (and no longer searched for) once its
+    best scores didn't change over the last increment of check reads and are clearly above or below
+    the threshold.
+    """
+    if (adapter_set.best_start_score, adapter_set.best_end_score) != previous_scores:
+        return False
+    score = adapter_set.best_start_or_end_score()
+    return abs(score - adapter_threshold) >= ADAPTIVE_SEARCH_MARGIN
+
+
 def choose_barcoding_kit(adapter_sets, verbosity, print_dest):
     """
     If the user is sorting reads by barcode bin, choose one barcode configuration (rev comp
@@ -420,6 +918,23 @@ def display_adapter_set_results(matching_sets, verbosity, print_dest):
                     fixed_col_widths=[35, 8, 8])
 
 
+def display_adapter_profile(matching_sets, profile_filename, verbosity, print_dest):
+    if verbosity < 1:
+        return
+    print(bold_underline('Loading adapter profile'), flush=True, file=print_dest)
+    print(profile_filename, file=print_dest)
+    if not matching_sets:
+        print('No adapter sets', file=print_dest)
+        return
+    table = [['Set', 'Best read start %ID', 'Best read end %ID']]
+    for adapter_set in matching_sets:
+        table.append([adapter_set.name, '%.1f' % adapter_set.best_start_score,
+                      '%.1f' % adapter_set.best_end_score])
+    print_table(table, print_dest, alignments='LRR',
+                row_colour={i: 'green' for i in range(1, len(table))},
+                fixed_col_widths=[35, 8, 8])
+
+
 def add_full_barcode_adapter_sets(matching_sets):
     """
     This function adds some new 'full' adapter sequences based on what was already found. For
@@ -450,39 +965,48 @@ def add_full_barcode_adapter_sets(matching_sets):
 def find_adapters_at_read_ends(reads, matching_sets, verbosity, end_size, extra_trim_size,
                                end_threshold, scoring_scheme_vals, print_dest, min_trim_size,
                                threads, check_barcodes, barcode_threshold, barcode_diff,
-                               require_two_barcodes, forward_or_reverse_barcodes, correct_read_direction):
-    if verbosity > 0:
-        print(bold_underline('Trimming adapters from read ends'),
-              file=print_dest)
-        name_len = max(max(len(x.start_sequence[0])
-                           if x.start_sequence else 0 for x in matching_sets),
-                       max(len(x.end_sequence[0])
-                           if x.end_sequence else 0 for x in matching_sets))
-        for matching_set in matching_sets:
-            if matching_set.start_sequence:
-                print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
-                      red(matching_set.start_sequence[1]), file=print_dest)
-            if matching_set.end_sequence:
-                print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
-                      red(matching_set.end_sequence[1]), file=print_dest)
-        print('', file=print_dest)
+                               require_two_barcodes, forward_or_reverse_barcodes, correct_read_direction,
+                               worker_type='threads', kmer_prefilter=0,
+                               chunked=False, dual_barcodes=None):
+    """
+    When chunked is True, the reads are one chunk of a larger input, so the header and progress
+    lines are left to the caller. If kmer_prefilter is set, it is the k-mer size used to skip
+    adapters which share nothing with a read end. If dual_barcodes (a DualBarcodes sample sheet)
+    is given, reads are called by their pair of barcodes.
+    """
+    if verbosity > 0 and not chunked:
+        display_adapters_to_trim(matching_sets, print_dest)
+
+    if kmer_prefilter:
+        start_kmer_index, end_kmer_index = make_end_indices(matching_sets, kmer_prefilter)
+    else:
+        start_kmer_index, end_kmer_index = None, None
 
     read_count = len(reads)
-    if verbosity == 1:
+    show_progress = verbosity == 1 and not chunked
+    if show_progress:
         output_progress_line(0, read_count, print_dest)
 
+    # Barcodes are called for many reads at once after their ends are trimmed (see barcode_calling),
+    # except when each read's call is needed for the verbose output as it is trimmed.
+    need_barcodes = check_barcodes or correct_read_direction
+    call_barcodes_per_read = need_barcodes and verbosity > 1
+
     # If single-threaded, do the work in a simple loop.
     if threads == 1:
         for read_num, read in enumerate(reads):
             read.find_start_trim(matching_sets, end_size, extra_trim_size, end_threshold,
                                  scoring_scheme_vals, min_trim_size, check_barcodes,
-                                 forward_or_reverse_barcodes, correct_read_direction)
+                                 forward_or_reverse_barcodes, correct_read_direction,
+                                 start_kmer_index)
             read.find_end_trim(matching_sets, end_size, extra_trim_size, end_threshold,
                                scoring_scheme_vals, min_trim_size, check_barcodes,
-                               forward_or_reverse_barcodes, correct_read_direction)
-            if check_barcodes or correct_read_direction:
-                read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes, correct_read_direction)
-            if verbosity == 1:
+                               forward_or_reverse_barcodes, correct_read_direction,
+                               end_kmer_index)
+            if call_barcodes_per_read:
+                read.determine_barcode(barcode_threshold, barcode_diff, require_two_barcodes,
+                                       correct_read_direction, dual_barcodes)
+            if show_progress:
                 output_progress_line(read_num+1, read_count, print_dest)
             elif verbosity == 2:
                 print(read.formatted_start_and_end_seq(end_size, extra_trim_size, check_barcodes),
@@ -491,14 +1015,48 @@ def find_adapters_at_read_ends(reads, matching_sets, verbosity, end_size, extra_
                 print(read.full_start_end_output(end_size, extra_trim_size, check_barcodes),
                       file=print_dest)
 
+    # If using worker processes, send them just the read ends and apply their results here.
+    elif worker_type == 'processes':
+        settings = {'end_size': end_size, 'extra_trim_size': extra_trim_size,
+                    'end_threshold': end_threshold, 'scoring_scheme_vals': scoring_scheme_vals,
+                    'min_trim_size': min_trim_size, 'check_barcodes': check_barcodes,
+                    'forward_or_reverse_barcodes': forward_or_reverse_barcodes,
+                    'correct_read_direction': correct_read_direction,
+                    'barcode_threshold': barcode_threshold, 'barcode_diff': barcode_diff,
+                    'require_two_barcodes': require_two_barcodes, 'verbosity': verbosity,
+                    'start_kmer_index': start_kmer_index, 'end_kmer_index': end_kmer_index,
+                    'dual_barcodes': dual_barcodes}
+        batches = make_batches(reads, threads)
+        with make_process_pool(threads, matching_sets, settings,
+                               get_adapter_lists(matching_sets)) as pool:
+            finished_count = 0
+            read_ends_batches = ([(get_read_ends(r, end_size), r.albacore_barcode_call)
+                                  for r in batch] for batch in batches)
+            batch_results_iter = collect_worker_alignment_stats(pool.imap(trim_read_ends_batch,
+                                                                          read_ends_batches))
+            for batch, batch_results in zip(batches, batch_results_iter):
+                for read, results in zip(batch, batch_results):
+                    read.set_end_trim_results(results, matching_sets)
+                    if verbosity == 2:
+                        print(read.formatted_start_and_end_seq(end_size, extra_trim_size,
+                                                               check_barcodes),
+                              file=print_dest, flush=True)
+                    elif verbosity > 2:
+                        print(read.full_start_end_output(end_size, extra_trim_size,
+                                                         check_barcodes),
+                              file=print_dest, flush=True)
+                finished_count += len(batch)
+                if show_progress:
+                    output_progress_line(finished_count, read_count, print_dest, step=1)
+
     # If multi-threaded, use a thread pool.
     else:
         def start_end_trim_one_arg(all_args):
             r, a, b, c, d, e, f, g, h, i, j, k, v, w = all_args
-            r.find_start_trim(a, b, c, d, e, f, g, k, w)
-            r.find_end_trim(a, b, c, d, e, f, g, k, w)
-            if check_barcodes or correct_read_direction:
-                r.determine_barcode(h, i, j, w)
+            r.find_start_trim(a, b, c, d, e, f, g, k, w, start_kmer_index)
+            r.find_end_trim(a, b, c, d, e, f, g, k, w, end_kmer_index)
+            if call_barcodes_per_read:
+                r.determine_barcode(h, i, j, w, dual_barcodes)
             if v == 2:
                 return r.formatted_start_and_end_seq(b, c, g)
             if v > 2:
@@ -515,43 +1073,78 @@ def find_adapters_at_read_ends(reads, matching_sets, verbosity, end_size, extra_
             finished_count = 0
             for out in pool.imap(start_end_trim_one_arg, arg_list):
                 finished_count += 1
-                if verbosity == 1:
+                if show_progress:
                     output_progress_line(finished_count, read_count, print_dest)
                 elif verbosity > 1:
                     print(out, file=print_dest, flush=True)
 
-    if verbosity == 1:
+    # Worker processes call the barcodes themselves, for each batch of reads.
+    if need_barcodes and not call_barcodes_per_read and \
+            (threads == 1 or worker_type != 'processes'):
+        call_barcodes(reads, barcode_threshold, barcode_diff, require_two_barcodes,
+                      correct_read_direction, dual_barcodes)
+
+    if show_progress:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
-    if verbosity > 0:
+    if verbosity > 0 and not chunked:
         print('', file=print_dest)
 
 
-def display_read_end_trimming_summary(reads, verbosity, print_dest, head_crop, tail_crop, min_length, max_length, trimmed_only):
+def display_adapters_to_trim(matching_sets, print_dest):
+    print(bold_underline('Trimming adapters from read ends'),
+          file=print_dest)
+    name_len = max(max(len(x.start_sequence[0])
+                       if x.start_sequence else 0 for x in matching_sets),
+                   max(len(x.end_sequence[0])
+                       if x.end_sequence else 0 for x in matching_sets))
+    for matching_set in matching_sets:
+        if matching_set.start_sequence:
+            print('  ' + matching_set.start_sequence[0].rjust(name_len) + ': ' +
+                  red(matching_set.start_sequence[1]), file=print_dest)
+        if matching_set.end_sequence:
+            print('  ' + matching_set.end_sequence[0].rjust(name_len) + ': ' +
+                  red(matching_set.end_sequence[1]), file=print_dest)
+    print('', file=print_dest)
+
+
+def get_read_end_trimming_counts(reads, head_crop, tail_crop, min_length, max_length, trimmed_only):
+    """
+    Tallies up the end trimming results. The counts are returned in a Counter, so the results for
+    separate chunks of reads can be added together.
+    """
+    counts = Counter()
+    counts['reads'] = len(reads)
+    counts['start_trim_total'] = sum(x.start_trim_amount for x in reads)
+    counts['start_trim_count'] = sum(1 if x.start_trim_amount else 0 for x in reads)
+    counts['end_trim_total'] = sum(x.end_trim_amount for x in reads)
+    counts['end_trim_count'] = sum(1 if x.end_trim_amount else 0 for x in reads)
+    counts['cropping_total'] = len(reads)*tail_crop+len(reads)*head_crop
+    counts['reversed_total'] = sum(1 if x.needs_reversing else 0 for x in reads)
+    counts['discarded_total'] = sum(1 if min_length > x.seq_length()-x.start_trim_amount-x.end_trim_amount-head_crop-tail_crop or x.seq_length()-x.start_trim_amount-x.end_trim_amount-head_crop-tail_crop > max_length or (x.seq_length()-x.start_trim_amount-x.end_trim_amount == x.seq_length() and trimmed_only) else 0 for x in reads)
+    return counts
+
+
+def display_read_end_trimming_summary(counts, verbosity, print_dest):
     if verbosity < 1:
         return
-    start_trim_total = sum(x.start_trim_amount for x in reads)
-    start_trim_count = sum(1 if x.start_trim_amount else 0 for x in reads)
-    end_trim_total = sum(x.end_trim_amount for x in reads)
-    end_trim_count = sum(1 if x.end_trim_amount else 0 for x in reads)
-    cropping_total = len(reads)*tail_crop+len(reads)*head_crop
-    reversed_total = sum(1 if x.needs_reversing else 0 for x in reads)
-    discarded_total = sum(1 if min_length > len(x.seq)-x.start_trim_amount-x.end_trim_amount-head_crop-tail_crop or len(x.seq)-x.start_trim_amount-x.end_trim_amount-head_crop-tail_crop > max_length or (len(x.seq)-x.start_trim_amount-x.end_trim_amount == len(x.seq) and trimmed_only) else 0 for x in reads)
-    print(int_to_str(start_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their start (' +
-          int_to_str(start_trim_total) + ' bp removed)', file=print_dest)
-    print(int_to_str(end_trim_count).rjust(len(int_to_str(len(reads)))) + ' / ' +
-          int_to_str(len(reads)) + ' reads had adapters trimmed from their end (' +
-          int_to_str(end_trim_total) + ' bp removed)', file=print_dest)
-    print(str(cropping_total)+" bp are removed due to cropping. (Might be more if sequences contain middle adapters)", file=print_dest)
-    print(str(reversed_total)+" sequences are reversed. (Sequences containing middle adapters won't be reversed)", file=print_dest)
-    print(str(discarded_total)+" sequences are discarded due not meeting filter requirements. (This includes sequences containing middle adapters)", file=print_dest)
+    read_count = counts['reads']
+    print(int_to_str(counts['start_trim_count']).rjust(len(int_to_str(read_count))) + ' / ' +
+          int_to_str(read_count) + ' reads had adapters trimmed from their start (' +
+          int_to_str(counts['start_trim_total']) + ' bp removed)', file=print_dest)
+    print(int_to_str(counts['end_trim_count']).rjust(len(int_to_str(read_count))) + ' / ' +
+          int_to_str(read_count) + ' reads had adapters trimmed from their end (' +
+          int_to_str(counts['end_trim_total']) + ' bp removed)', file=print_dest)
+    print(str(counts['cropping_total'])+" bp are removed due to cropping. (Might be more if sequences contain middle adapters)", file=print_dest)
+    print(str(counts['reversed_total'])+" sequences are reversed. (Sequences containing middle adapters won't be reversed)", file=print_dest)
+    print(str(counts['discarded_total'])+" sequences are discarded due not meeting filter requirements. (This includes sequences containing middle adapters)", file=print_dest)
     print('\n', file=print_dest)
 
 
 def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_threshold,
                                   extra_trim_good_side, extra_trim_bad_side, scoring_scheme_vals,
-                                  print_dest, threads, discard_middle):
-    if verbosity > 0:
+                                  print_dest, threads, discard_middle, worker_type='threads',
+                                  middle_search='full', chunked=False):
+    if verbosity > 0 and not chunked:
         verb = 'Discarding' if discard_middle else 'Splitting'
         print(bold_underline(verb + ' reads containing middle adapters'),
               file=print_dest)
@@ -574,7 +1167,8 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
             end_sequence_names.add(matching_set.end_sequence[0])
 
     read_count = len(reads)
-    if verbosity == 1:
+    show_progress = verbosity == 1 and not chunked
+    if show_progress:
         output_progress_line(0, read_count, print_dest)
 
     # If single-threaded, do the work in a simple loop.
@@ -582,49 +1176,81 @@ def find_adapters_in_read_middles(reads, matching_sets, verbosity, middle_thresh
         for read_num, read in enumerate(reads):
             read.find_middle_adapters(adapters, middle_threshold, extra_trim_good_side,
                                       extra_trim_bad_side, scoring_scheme_vals,
-                                      start_sequence_names, end_sequence_names)
-            if verbosity == 1:
+                                      start_sequence_names, end_sequence_names, middle_search)
+            if show_progress:
                 output_progress_line(read_num+1, read_count, print_dest)
-            if read.middle_adapter_positions and verbosity > 1:
+            if read.middle_adapter_ranges and verbosity > 1:
                 print(read.middle_adapter_results(verbosity), file=print_dest, flush=True)
 
+    # If using worker processes, send them the end-trimmed reads and apply their results here.
+    elif worker_type == 'processes':
+        settings = {'middle_threshold': middle_threshold,
+                    'extra_trim_good_side': extra_trim_good_side,
+                    'extra_trim_bad_side': extra_trim_bad_side,
+                    'scoring_scheme_vals': scoring_scheme_vals,
+                    'start_sequence_names': start_sequence_names,
+                    'end_sequence_names': end_sequence_names, 'middle_search': middle_search}
+        batches = make_batches(reads, threads)
+        with make_process_pool(threads, adapters, settings) as pool:
+            finished_count = 0
+            trimmed_seq_batches = ([r.get_seq_with_start_end_adapters_trimmed() for r in batch]
+                                   for batch in batches)
+            batch_results_iter = collect_worker_alignment_stats(
+                pool.imap(find_middle_adapters_batch, trimmed_seq_batches))
+            for batch, batch_results in zip(batches, batch_results_iter):
+                for read, results in zip(batch, batch_results):
+                    read.set_middle_trim_results(results)
+                    if read.middle_adapter_ranges and verbosity > 1:
+                        print(read.middle_adapter_results(verbosity), file=print_dest,
+                              flush=True)
+                finished_count += len(batch)
+                if show_progress:
+                    output_progress_line(finished_count, read_count, print_dest, step=1)
+
     # If multi-threaded, use a thread pool.
     else:
         def find_middle_adapters_one_arg(all_args):
-            r, a, b, c, d, e, f, g, v = all_args
-            r.find_middle_adapters(a, b, c, d, e, f, g)
+            r, a, b, c, d, e, f, g, v, m = all_args
+            r.find_middle_adapters(a, b, c, d, e, f, g, m)
             return r.middle_adapter_results(v)
         with ThreadPool(threads) as pool:
             arg_list = []
             for read in reads:
                 arg_list.append((read, adapters, middle_threshold, extra_trim_good_side,
                                  extra_trim_bad_side, scoring_scheme_vals, start_sequence_names,
-                                 end_sequence_names, verbosity))
+                                 end_sequence_names, verbosity, middle_search))
             finished_count = 0
             for out in pool.imap(find_middle_adapters_one_arg, arg_list):
                 finished_count += 1
-                if verbosity == 1:
+                if show_progress:
                     output_progress_line(finished_count + 1, read_count, print_dest)
                 if verbosity > 1 and out:
                     print(out, file=print_dest, flush=True)
 
-    if verbosity == 1:
+    if show_progress:
         output_progress_line(read_count, read_count, print_dest, end_newline=True)
         print('', flush=True, file=print_dest)
 
 
-def display_read_middle_trimming_summary(reads, discard_middle, verbosity, print_dest):
+def get_read_middle_trimming_counts(reads):
+    counts = Counter()
+    counts['reads'] = len(reads)
+    counts['middle_trim_count'] = sum(1 if x.middle_adapter_ranges else 0 for x in reads)
+    return counts
+
+
+def display_read_middle_trimming_summary(counts, discard_middle, verbosity, print_dest):
     if verbosity < 1:
         return
-    middle_trim_count = sum(1 if x.middle_adapter_positions else 0 for x in reads)
     verb = 'discarded' if discard_middle else 'split'
-    print(int_to_str(middle_trim_count) + ' / ' + int_to_str(len(reads)) + ' reads were ' + verb +
-          ' based on middle adapters\n\n', file=print_dest)
+    print(int_to_str(counts['middle_trim_count']) + ' / ' + int_to_str(counts['reads']) +
+          ' reads were ' + verb + ' based on middle adapters\n\n', file=print_dest)
 
 
 def output_reads(reads, out_format, output, read_type, verbosity, discard_middle,
                  min_split_size, print_dest, barcode_dir, input_filename,
-                 untrimmed, threads, discard_unassigned, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction):
+                 untrimmed, threads, discard_unassigned, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction,
+                 checkpoint=None):
     if verbosity > 0:
         trimmed_or_untrimmed = 'untrimmed' if untrimmed else 'trimmed'
         if barcode_dir is not None:
@@ -656,65 +1282,70 @@ def output_reads(reads, out_format, output, read_type, verbosity, discard_middle
             out_format = read_type.lower()
 
     gzipped_out = False
-    gzip_command = 'gzip'
     if out_format.endswith('.gz') and (barcode_dir is not None or output is not None):
         gzipped_out = True
         out_format = out_format[:-3]
-        if shutil.which('pigz'):
-            if verbosity > 0:
-                print('pigz found - using it to compress instead of gzip')
-            gzip_command = 'pigz -p ' + str(threads)
-        else:
-            if verbosity > 0:
-                print('pigz not found - using gzip to compress')
 
+    # Gzipped output is compressed as it is written, using a pool of threads shared by all of the
+    # output files.
+    compression_pool = ThreadPool(threads) if gzipped_out and threads > 1 else None
+    try:
+        write_output_reads(reads, out_format, output, verbosity, discard_middle, min_split_size,
+                           print_dest, barcode_dir, untrimmed, threads, discard_unassigned,
+                           tail_crop, trimmed_only, min_length, head_crop, max_length,
+                           correct_read_direction, gzipped_out, compression_pool, checkpoint)
+    finally:
+        if compression_pool is not None:
+            compression_pool.terminate()
+
+    if verbosity > 0:
+        print('', flush=True, file=print_dest)
+
+
+def write_output_reads(reads, out_format, output, verbosity, discard_middle, min_split_size,
+                       print_dest, barcode_dir, untrimmed, threads, discard_unassigned, tail_crop,
+                       trimmed_only, min_length, head_crop, max_length, correct_read_direction,
+                       gzipped_out, compression_pool, checkpoint):
+    """
+    If there is a checkpoint, the output continues from where it got to: the per-barcode counts
+    carry on from its counts and reads are added to the end of its output files.
+    """
     # Output reads to barcode bins.
     if barcode_dir is not None:
         if not os.path.isdir(barcode_dir):
             os.makedirs(barcode_dir)
-        barcode_files = {}
-        barcode_read_counts, barcode_base_counts = defaultdict(int), defaultdict(int)
-        for read in reads:
-            barcode_name = read.barcode_call
-            if discard_unassigned and barcode_name == 'none':
-                continue
-            if out_format == 'fasta':
-                read_str = read.get_fasta(min_split_size, discard_middle, untrimmed, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction)
-            else:
-                read_str = read.get_fastq(min_split_size, discard_middle, untrimmed, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction)
-            if not read_str:
-                continue
-            if barcode_name not in barcode_files:
-                barcode_files[barcode_name] = \
-                    open(os.path.join(barcode_dir, barcode_name + '.' + out_format), 'wt')
-            barcode_files[barcode_name].write(read_str)
-            barcode_read_counts[barcode_name] += 1
-            if untrimmed:
-                seq_length = len(read.seq)
-            else:
-                seq_length = read.seq_length_with_start_end_adapters_trimmed()
-            barcode_base_counts[barcode_name] += seq_length
-        table = [['Barcode', 'Reads', 'Bases', 'File']]
-
-        for barcode_name in sorted(barcode_files.keys()):
-            barcode_files[barcode_name].close()
-            bin_filename = os.path.join(barcode_dir, barcode_name + '.' + out_format)
-
-            if gzipped_out:
-                if not os.path.isfile(bin_filename):
+        if checkpoint is None:
+            barcode_read_counts, barcode_base_counts = defaultdict(int), defaultdict(int)
+        else:
+            barcode_read_counts = checkpoint.barcode_read_counts
+            barcode_base_counts = checkpoint.barcode_base_counts
+        with BinWriter(barcode_dir, out_format, gzipped_out, compression_pool, threads,
+                       append_bins=list(barcode_read_counts)) as bin_writer:
+            if checkpoint is not None:
+                checkpoint.output = bin_writer
+            for read in reads:
+                barcode_name = read.barcode_call
+                if discard_unassigned and barcode_name == 'none':
+                    continue
+                if out_format == 'fasta':
+                    read_str = read.get_fasta(min_split_size, discard_middle, untrimmed, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction)
+                else:
+                    read_str = read.get_fastq(min_split_size, discard_middle, untrimmed, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction)
+                if not read_str:
                     continue
-                bin_filename_gz = bin_filename + '.gz'
-                if os.path.isfile(bin_filename_gz):
-                    os.remove(bin_filename_gz)
-                try:
-                    subprocess.check_output(gzip_command + ' ' + bin_filename,
-                                            stderr=subprocess.STDOUT, shell=True)
-                except subprocess.CalledProcessError:
-                    pass
-                bin_filename = bin_filename_gz
+                bin_writer.write(barcode_name, read_str)
+                barcode_read_counts[barcode_name] += 1
+                if untrimmed:
+                    seq_length = read.seq_length()
+                else:
+                    seq_length = read.seq_length_with_start_end_adapters_trimmed()
+                barcode_base_counts[barcode_name] += seq_length
+        table = [['Barcode', 'Reads', 'Bases', 'File']]
 
+        for barcode_name in sorted(barcode_read_counts.keys()):
             table_row = [barcode_name, int_to_str(barcode_read_counts[barcode_name]),
-                         int_to_str(barcode_base_counts[barcode_name]), bin_filename]
+                         int_to_str(barcode_base_counts[barcode_name]),
+                         bin_writer.get_filename(barcode_name)]
             table.append(table_row)
 
         if verbosity > 0:
@@ -732,24 +1363,27 @@ def output_reads(reads, out_format, output, read_type, verbosity, discard_middle
 
     # Output to all reads to file.
     else:
-        if gzipped_out:
-            out_filename = 'TEMP_' + str(os.getpid()) + '.fastq'
-        else:
-            out_filename = output
-        with open(out_filename, 'wt') as out:
+        append = checkpoint is not None and checkpoint.has_output(output)
+        with open_output_file(output, gzipped_out, compression_pool, threads, append) as out:
+            if checkpoint is not None:
+                checkpoint.output = out
             for read in reads:
                 read_str = read.get_fasta(min_split_size, discard_middle, False, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction) if out_format == 'fasta' \
                     else read.get_fastq(min_split_size, discard_middle, False, tail_crop, trimmed_only, min_length, head_crop, max_length, correct_read_direction)
                 out.write(read_str)
-        if gzipped_out:
-            subprocess.check_output(gzip_command + ' -c ' + out_filename + ' > ' + output,
-                                    stderr=subprocess.STDOUT, shell=True)
-            os.remove(out_filename)
         if verbosity > 0:
             print('\nSaved result to ' + os.path.abspath(output), file=print_dest)
 
-    if verbosity > 0:
-        print('', flush=True, file=print_dest)
+
+def open_output_file(filename, gzipped_out, compression_pool, threads, append=False):
+    """
+    Opens an output file for writing (or appending) text. Gzipped files are written in the BGZF
+    format (which tools like samtools can index) and are compressed in the given thread pool, if
+    there is one.
+    """
+    if gzipped_out:
+        return BgzfWriter(filename, compression_pool, max_pending=2 * threads, append=append)
+    return open(filename, 'at' if append else 'wt')
 
 
 def output_progress_line(completed, total, print_dest, end_newline=False, step=10):
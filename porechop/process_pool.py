@@ -0,0 +1,136 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains the functions which run in worker processes when Porechop is used with
+`--worker_type processes`. Unlike threads, worker processes aren't held back by Python's GIL, so
+they can keep many more cores busy. To keep the cost of sending data between processes down, the
+workers are only given the part of each read they need (e.g. just the read ends for end trimming)
+and they send back compact tuples of results instead of whole NanoporeRead objects.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import multiprocessing
+from . import cpp_function_wrappers, metrics
+from .nanopore_read import NanoporeRead, get_adapter_set_scores
+from .barcode_calling import call_barcodes
+
+
+# Each worker process gets its own copy of the adapters and settings when it starts (in
+# init_worker), so they don't need to be sent along with every batch of reads. The workers also
+# use the same aligner and backend as the main process and, if --metrics is on, count their
+# alignments and send the counts back with each batch's results (see
+# metrics.collect_worker_alignment_stats).
+ADAPTERS = []
+SETTINGS = {}
+
+
+def init_worker(adapters, settings, aligner, backend, metrics_adapter_breakdown, adapter_lists):
+    global ADAPTERS, SETTINGS
+    ADAPTERS = adapters
+    SETTINGS = settings
+    cpp_function_wrappers.set_backend(backend)
+    cpp_function_wrappers.set_aligner(aligner)
+    if adapter_lists:
+        cpp_function_wrappers.register_adapter_lists(adapter_lists, settings['scoring_scheme_vals'])
+    if metrics_adapter_breakdown is None:
+        metrics.stop_metrics()
+    else:
+        metrics.start_metrics(metrics_adapter_breakdown)
+
+
+def make_process_pool(processes, adapters, settings, adapter_lists=()):
+    """
+    Makes a pool of worker processes which each hold the adapters and settings. The adapter_lists
+    are registered in each worker (see register_adapter_lists).
+    """
+    if metrics.METRICS is None:
+        metrics_adapter_breakdown = None
+    else:
+        metrics_adapter_breakdown = metrics.METRICS.adapter_breakdown
+    return multiprocessing.Pool(processes, initializer=init_worker,
+                                initargs=(adapters, settings, cpp_function_wrappers.ALIGNER,
+                                          cpp_function_wrappers.BACKEND,
+                                          metrics_adapter_breakdown, adapter_lists))
+
+
+def make_batches(items, processes):
+    """
+    Splits the items into batches which are big enough to keep the per-batch overhead low but small
+    enough to spread evenly over the workers (and to give regular progress updates).
+    """
+    batch_size = max(1, min(1000, len(items) // (processes * 4)))
+    return [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
+
+
+def get_read_ends(read, end_size):
+    """
+    The adapter search and end trimming only look at the first and last end_size bases of a read,
+    so a long read can be replaced by just those parts.
+    """
+    if read.seq_length() <= 2 * end_size:
+        return read.seq
+    return read.get_seq_part(None, end_size) + read.get_seq_part(-end_size)
+
+
+def align_adapter_subset_batch(batch):
+    """
+    Takes (read ends batch, adapter indices) and returns the best start/end score of each of those
+    adapter sets for this batch of reads. The main process combines the batches by taking the
+    maximum. The adaptive adapter search only sends the indices of the sets it still needs.
+    """
+    read_ends_batch, adapter_indices = batch
+    scores = get_adapter_set_scores(read_ends_batch, [ADAPTERS[i] for i in adapter_indices],
+                                    SETTINGS['end_size'], SETTINGS['scoring_scheme_vals'])
+    return scores, metrics.take_worker_alignment_stats()
+
+
+def trim_read_ends_batch(batch):
+    """
+    Takes (read ends, Albacore barcode call) tuples and returns a tuple of end trimming results for
+    each, as made by NanoporeRead.get_end_trim_results (along with the alignment stats).
+    """
+    s = SETTINGS
+    reads = []
+    for read_ends, albacore_barcode_call in batch:
+        read = NanoporeRead('', read_ends, '')
+        read.albacore_barcode_call = albacore_barcode_call
+        read.find_start_trim(ADAPTERS, s['end_size'], s['extra_trim_size'], s['end_threshold'],
+                             s['scoring_scheme_vals'], s['min_trim_size'], s['check_barcodes'],
+                             s['forward_or_reverse_barcodes'], s['correct_read_direction'],
+                             s['start_kmer_index'])
+        read.find_end_trim(ADAPTERS, s['end_size'], s['extra_trim_size'], s['end_threshold'],
+                           s['scoring_scheme_vals'], s['min_trim_size'], s['check_barcodes'],
+                           s['forward_or_reverse_barcodes'], s['correct_read_direction'],
+                           s['end_kmer_index'])
+        reads.append(read)
+    if s['check_barcodes'] or s['correct_read_direction']:
+        call_barcodes(reads, s['barcode_threshold'], s['barcode_diff'],
+                      s['require_two_barcodes'], s['correct_read_direction'], s['dual_barcodes'])
+    results = [read.get_end_trim_results(ADAPTERS, s['verbosity'] > 2) for read in reads]
+    return results, metrics.take_worker_alignment_stats()
+
+
+def find_middle_adapters_batch(trimmed_seqs):
+    """
+    Takes end-trimmed read sequences and returns the middle adapter results for each, as made by
+    NanoporeRead.get_middle_trim_results (None for reads without middle adapters), along with the
+    alignment stats.
+    """
+    s = SETTINGS
+    results = []
+    for trimmed_seq in trimmed_seqs:
+        read = NanoporeRead('', trimmed_seq, '')
+        read.find_middle_adapters(ADAPTERS, s['middle_threshold'], s['extra_trim_good_side'],
+                                  s['extra_trim_bad_side'], s['scoring_scheme_vals'],
+                                  s['start_sequence_names'], s['end_sequence_names'],
+                                  s['middle_search'])
+        results.append(read.get_middle_trim_results())
+    return results, metrics.take_worker_alignment_stats()
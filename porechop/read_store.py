@@ -0,0 +1,96 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains a columnar store for reads. Instead of each read holding its own Python
+strings and result attributes, the sequences and qualities of many reads are kept end to end in
+two byte buffers (with an array of offsets for each) and the per-read trimming results are kept in
+typed arrays. NanoporeRead objects are small views into a store, so millions of reads don't each
+pay for Python object overhead.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+from array import array
+
+# Sequences and qualities are stored one byte per character, so positions in the buffers match
+# positions in the strings.
+ENCODING = 'latin-1'
+
+# Bits of the per-read flags.
+RNA_FLAG = 1
+NEEDS_REVERSING_FLAG = 2
+
+
+class ReadStore(object):
+
+    def __init__(self):
+        self.names = []
+        self.seq_data = bytearray()
+        self.seq_offsets = array('Q', [0])
+        self.qual_data = bytearray()
+        self.qual_offsets = array('Q', [0])
+        self.start_trims = array('i')
+        self.end_trims = array('i')
+        self.flags = bytearray()
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, seq, quals):
+        """
+        Adds a read to the store and returns its index. The sequence is made uppercase and RNA
+        reads are stored as DNA (their U bases are turned back into U on output).
+        """
+        seq = seq.upper()
+        flags = 0
+        if seq.count('U') > seq.count('T'):
+            flags |= RNA_FLAG
+            seq = seq.replace('U', 'T')
+        self.names.append(name)
+        self.seq_data += seq.encode(ENCODING)
+        self.seq_offsets.append(len(self.seq_data))
+        self.qual_data += quals.encode(ENCODING)
+        self.qual_offsets.append(len(self.qual_data))
+        self.start_trims.append(0)
+        self.end_trims.append(0)
+        self.flags.append(flags)
+        return len(self.names) - 1
+
+    def get_seq_length(self, i):
+        return self.seq_offsets[i+1] - self.seq_offsets[i]
+
+    def get_seq(self, i, start=None, end=None):
+        """
+        Returns the read's sequence, or the part of it given by start and end (which work like a
+        Python slice), without decoding the rest of the read.
+        """
+        seq_start = self.seq_offsets[i]
+        start, end, _ = slice(start, end).indices(self.seq_offsets[i+1] - seq_start)
+        return self.seq_data[seq_start+start:seq_start+end].decode(ENCODING)
+
+    def get_quals(self, i):
+        """
+        Returns the read's qualities. Reads without qualities (e.g. from FASTA files) or with too
+        few are padded to the sequence length with '+'.
+        """
+        quals = self.qual_data[self.qual_offsets[i]:self.qual_offsets[i+1]].decode(ENCODING)
+        seq_length = self.get_seq_length(i)
+        if len(quals) < seq_length:
+            quals += '+' * (seq_length - len(quals))
+        return quals
+
+    def get_flag(self, i, flag):
+        return bool(self.flags[i] & flag)
+
+    def set_flag(self, i, flag, value):
+        if value:
+            self.flags[i] |= flag
+        else:
+            self.flags[i] &= ~flag
@@ -0,0 +1,147 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains Porechop's FASTA/FASTQ parser. Gzipped files are decompressed outside of the
+main thread: by pigz or igzip in a separate process when one of them is installed, or else by
+Python's gzip module in a background thread (zlib releases the GIL while it works, so decompression
+and parsing overlap). Either way, the decompressed data arrives through a pipe in large blocks.
+
+The records are then split using Python's own line reading, which is done in C. FASTQ records are
+taken four lines at a time with zip_longest, so there is very little Python work per line.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import contextlib
+import gzip
+import itertools
+import os
+import shutil
+import subprocess
+import threading
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# External decompressors which are used (in this order of preference) if they are installed.
+GZIP_DECOMPRESSORS = ['pigz', 'igzip']
+
+
+def iterate_fasta(filename, gzipped):
+    """
+    Yields a tuple (short name, seq, full name) for each record in the fasta file.
+    """
+    with open_sequence_file(filename, gzipped) as fasta_file:
+        name = ''
+        sequence_parts = []
+        for line in fasta_file:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '>':  # Header line = start of new contig
+                if name:
+                    yield name.split()[0], ''.join(sequence_parts), name
+                    sequence_parts = []
+                name = line[1:]
+            else:
+                sequence_parts.append(line)
+        if name:
+            yield name.split()[0], ''.join(sequence_parts), name
+
+
+def iterate_fastq(filename, gzipped):
+    """
+    Yields a tuple (short name, seq, spacer, quals, full name) for each record in the fastq file.
+    Raises IndexError if the file ends partway through a record.
+    """
+    with open_sequence_file(filename, gzipped) as fastq:
+        for header, sequence, spacer, qualities in itertools.zip_longest(fastq, fastq, fastq,
+                                                                         fastq):
+            if qualities is None:  # truncated record
+                raise IndexError
+            full_name = header.strip()[1:]
+            yield full_name.split()[0], sequence.strip(), spacer.strip(), qualities.strip(), \
+                full_name
+
+
+@contextlib.contextmanager
+def open_sequence_file(filename, gzipped):
+    """
+    Opens a (possibly gzipped) file for reading as text.
+    """
+    if not gzipped:
+        with open(filename, 'rt', buffering=BLOCK_SIZE) as text_file:
+            yield text_file
+        return
+    decompressor = get_gzip_decompressor()
+    if decompressor is not None:
+        with open_process_output([decompressor, '-dc', filename]) as text_file:
+            yield text_file
+    elif (os.cpu_count() or 1) > 1:
+        with open_thread_output(filename) as text_file:
+            yield text_file
+    else:  # with only one CPU, a background thread would just get in the way
+        with gzip.open(filename, 'rt') as text_file:
+            yield text_file
+
+
+def get_gzip_decompressor():
+    for decompressor in GZIP_DECOMPRESSORS:
+        if shutil.which(decompressor) is not None:
+            return decompressor
+    return None
+
+
+@contextlib.contextmanager
+def open_process_output(command):
+    """
+    Runs an external decompressor and gives its output as text.
+    """
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               bufsize=BLOCK_SIZE)
+    try:
+        with open(process.stdout.fileno(), 'rt', buffering=BLOCK_SIZE,
+                  closefd=False) as text_file:
+            yield text_file
+        _, error = process.communicate()
+        if process.returncode != 0:
+            raise OSError(' '.join(command) + ' failed: ' + error.decode().strip())
+    finally:
+        if process.poll() is None:  # the file wasn't read to the end
+            process.kill()
+            process.communicate()
+
+
+@contextlib.contextmanager
+def open_thread_output(filename):
+    """
+    Decompresses a gzipped file in a background thread, which writes to a pipe, and gives the
+    other end of the pipe as text.
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def decompress():
+        try:
+            with gzip.open(filename, 'rb') as gzip_file, open(write_fd, 'wb') as pipe:
+                shutil.copyfileobj(gzip_file, pipe, BLOCK_SIZE)
+        except BrokenPipeError:  # the reader stopped early
+            pass
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=decompress, daemon=True)
+    thread.start()
+    try:
+        with open(read_fd, 'rt', buffering=BLOCK_SIZE) as text_file:
+            yield text_file
+    finally:
+        thread.join()
+    if errors:
+        raise errors[0]
@@ -1,4 +1,5 @@
 #include "adapter_align.h"
+#include "adapter_registry.h"
 
 #include <seqan/align.h>
 #include <iostream>
@@ -8,37 +9,121 @@
 #include <utility>
 
 
-char * adapterAlignment(char * readSeq, char * adapterSeq,
-                        int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore) {
-    std::string output;
+// Aligns one read sequence to one adapter sequence. The results go straight into the caller's
+// struct, so nothing needs to be allocated for them.
+void adapterAlignment(char * readSeq, char * adapterSeq,
+                      int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                      AlignmentResult * result) {
+    Dna5String sequenceH = readSeq;
+    Dna5String sequenceV = adapterSeq;
+    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+
+    ScoredAlignment scoredAlignment = alignToAdapter(sequenceH, sequenceV, scoringScheme);
+    scoredAlignment.getResult(result);
+}
+
+
+// Aligns part of one read sequence (usually one end of a read) to many adapters. The read comes
+// already encoded as Dna5 codes (0 to 4, see encode_sequence in cpp_function_wrappers.py), so the
+// same encoded read end can be used for every adapter and for any window of it (readLength codes
+// from readStart). The adapters are given by their handles from registerAdapter. The read is only
+// converted to a Dna5String once, and the results go straight into the caller's array (which must
+// have room for adapterCount results) instead of being returned as strings.
+void adapterAlignmentBatch(char * readCodes, int readStart, int readLength, int * adapterHandles,
+                           int adapterCount, int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore, AlignmentResult * results) {
+    Dna5String sequenceH;
+    codesToDna5String(readCodes + readStart, readLength, sequenceH);
+    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+
+    for (int i = 0; i < adapterCount; ++i) {
+        Dna5String & sequenceV = getRegisteredAdapter(adapterHandles[i]).sequence;
+        ScoredAlignment scoredAlignment = alignToAdapter(sequenceH, sequenceV, scoringScheme);
+        scoredAlignment.getResult(&results[i]);
+    }
+}
+
+
+// Aligns each read sequence window to the adapter at the same index, e.g. the ends of many reads to
+// many adapters, so a whole batch of alignments only needs one call from Python. Like
+// adapterAlignmentBatch, the reads are already encoded (each read window is readLengths[i] codes
+// from readStarts[i] in readCodes[i]) and the adapters are registered.
+//
+// SeqAn has an inter-sequence vectorised version of globalAlignment for StringSets of Gaps, but it
+// needs SSE4/AVX2 at compile time and doesn't build with current compilers, so here the pairs are
+// aligned one at a time (fastAdapterAlignmentPairs packs them into SIMD lanes instead).
+void adapterAlignmentPairs(char ** readCodes, int * readStarts, int * readLengths,
+                           int * adapterHandles, int pairCount,
+                           int matchScore, int mismatchScore, int gapOpenScore,
+                           int gapExtensionScore, AlignmentResult * results) {
+    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+    Dna5String sequenceH;
 
+    for (int i = 0; i < pairCount; ++i) {
+        if (i == 0 || readCodes[i] + readStarts[i] != readCodes[i - 1] + readStarts[i - 1] ||
+                readLengths[i] != readLengths[i - 1])
+            codesToDna5String(readCodes[i] + readStarts[i], readLengths[i], sequenceH);
+        Dna5String & sequenceV = getRegisteredAdapter(adapterHandles[i]).sequence;
+        ScoredAlignment scoredAlignment = alignToAdapter(sequenceH, sequenceV, scoringScheme);
+        scoredAlignment.getResult(&results[i]);
+    }
+}
+
+
+// Finds every hit of the adapter in the read by repeatedly aligning it to the whole read and
+// masking each hit (turning its bases into Ns) until the best alignment's full adapter identity is
+// under minIdentity. Returns the number of hits, but only the first maxResults are put in results.
+int adapterAllHits(char * readSeq, char * adapterSeq,
+                   int matchScore, int mismatchScore, int gapOpenScore, int gapExtensionScore,
+                   double minIdentity, AlignmentResult * results, int maxResults) {
     Dna5String sequenceH = readSeq;
     Dna5String sequenceV = adapterSeq;
-    std::string readName = "";
-    std::string refName = "";
+    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+    if (length(sequenceH) == 0 || length(sequenceV) == 0)
+        return 0;
+
+    int hitCount = 0;
+    while (true) {
+        AlignmentResult result;
+        alignToAdapter(sequenceH, sequenceV, scoringScheme).getResult(&result);
+        if (result.readStartPos == -1 || result.fullAdapterPercentIdentity < minIdentity)
+            break;
+
+        // A hit made only of already-masked bases would be found again and again (only possible
+        // with a threshold near zero), so the search stops there.
+        bool allMasked = true;
+        for (int i = result.readStartPos; i <= result.readEndPos; ++i) {
+            allMasked = allMasked && sequenceH[i] == 'N';
+            sequenceH[i] = 'N';
+        }
+        if (allMasked)
+            break;
+        if (hitCount < maxResults)
+            results[hitCount] = result;
+        ++hitCount;
+    }
+    return hitCount;
+}
+
 
+ScoredAlignment alignToAdapter(Dna5String & readSeq, Dna5String & adapterSeq,
+                               Score<int, Simple> & scoringScheme) {
     Align<Dna5String, ArrayGaps> alignment;
     resize(rows(alignment), 2);
-    assignSource(row(alignment, 0), sequenceH);
-    assignSource(row(alignment, 1), sequenceV);
-    Score<int, Simple> scoringScheme(matchScore, mismatchScore, gapExtensionScore, gapOpenScore);
+    assignSource(row(alignment, 0), readSeq);
+    assignSource(row(alignment, 1), adapterSeq);
 
     AlignConfig<true, true, true, true> alignConfig;
     int score = globalAlignment(alignment, scoringScheme, alignConfig);
 
-    ScoredAlignment scoredAlignment(alignment, length(readSeq), length(adapterSeq), score);
-    return cppStringToCString(scoredAlignment.getString());
-}
-
-
-void freeCString(char * p) {
-    free(p);
+    return ScoredAlignment(alignment, length(readSeq), length(adapterSeq), score);
 }
 
 
-char * cppStringToCString(std::string cpp_string) {
-    char * c_string = (char*)malloc(sizeof(char) * (cpp_string.size() + 1));
-    std::copy(cpp_string.begin(), cpp_string.end(), c_string);
-    c_string[cpp_string.size()] = '\0';
-    return c_string;
+// Fills a Dna5String from Dna5 codes, which are its values as they are, so nothing needs to be
+// looked up.
+void codesToDna5String(char * codes, int length, Dna5String & sequence) {
+    resize(sequence, length);
+    for (int i = 0; i < length; ++i)
+        sequence[i].value = uint8_t(codes[i]);
 }
@@ -0,0 +1,54 @@
+#include "adapter_registry.h"
+#include "adapter_align.h"
+
+#include <mutex>
+
+
+// Handles are indices into this list. Its room is reserved up front and it never shrinks, so
+// registering an adapter never moves the ones other threads may be aligning with.
+const int MAX_REGISTERED_ADAPTERS = 65536;
+std::vector<RegisteredAdapter *> registeredAdapters;
+std::mutex registryMutex;
+
+
+// Registers an adapter (already encoded as Dna5 codes) for a scoring scheme and returns its
+// handle, or -1 if the registry is full. Registering the same adapter again gives a new handle,
+// so the caller should keep the handles it gets.
+int registerAdapter(char * codes, int length, int matchScore, int mismatchScore) {
+    std::lock_guard<std::mutex> lock(registryMutex);
+    if (registeredAdapters.capacity() < size_t(MAX_REGISTERED_ADAPTERS))
+        registeredAdapters.reserve(MAX_REGISTERED_ADAPTERS);
+    if (int(registeredAdapters.size()) >= MAX_REGISTERED_ADAPTERS)
+        return -1;
+
+    RegisteredAdapter * adapter = new RegisteredAdapter();
+    adapter->codes.assign(reinterpret_cast<uint8_t *>(codes),
+                          reinterpret_cast<uint8_t *>(codes) + length);
+    codesToDna5String(codes, length, adapter->sequence);
+    makeScoreProfile(adapter->codes, matchScore, mismatchScore, adapter->scoreProfile);
+    registeredAdapters.push_back(adapter);
+    return int(registeredAdapters.size()) - 1;
+}
+
+
+RegisteredAdapter & getRegisteredAdapter(int handle) {
+    return *registeredAdapters[handle];
+}
+
+
+int registeredAdapterCount() {
+    std::lock_guard<std::mutex> lock(registryMutex);
+    return int(registeredAdapters.size());
+}
+
+
+// Like SeqAn's Simple score, two bases score a match if they are the same (even two Ns).
+void makeScoreProfile(std::vector<uint8_t> & codes, int matchScore, int mismatchScore,
+                      std::vector<int> & scoreProfile) {
+    int length = codes.size();
+    scoreProfile.resize(5 * length);
+    for (int base = 0; base < 5; ++base) {
+        for (int i = 0; i < length; ++i)
+            scoreProfile[base * length + i] = (codes[i] == base) ? matchScore : mismatchScore;
+    }
+}
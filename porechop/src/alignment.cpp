@@ -6,7 +6,8 @@
 ScoredAlignment::ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
                                  int readLength, int adapterLength, int score):
     m_readLength(readLength), m_adapterLength(adapterLength),
-    m_readStartPos(-1), m_adapterStartPos(-1), m_rawScore(score)
+    m_readStartPos(-1), m_readEndPos(-1), m_adapterStartPos(-1), m_adapterEndPos(-1),
+    m_rawScore(score), m_alignedRegionPercentIdentity(0.0), m_fullAdapterPercentIdentity(0.0)
 {
     // Extract the alignment sequences into C++ strings for constant time random access.
     std::ostringstream stream1;
@@ -110,12 +111,12 @@ ScoredAlignment::ScoredAlignment(Align<Dna5String, ArrayGaps> & alignment,
     }
 }
 
-std::string ScoredAlignment::getString() {
-    return std::to_string(m_readStartPos) + "," + 
-           std::to_string(m_readEndPos) + "," + 
-           std::to_string(m_adapterStartPos) + "," + 
-           std::to_string(m_adapterEndPos) + "," + 
-           std::to_string(m_rawScore) + "," +
-           std::to_string(m_alignedRegionPercentIdentity) + "," +
-           std::to_string(m_fullAdapterPercentIdentity);
+void ScoredAlignment::getResult(AlignmentResult * result) {
+    result->readStartPos = m_readStartPos;
+    result->readEndPos = m_readEndPos;
+    result->adapterStartPos = m_adapterStartPos;
+    result->adapterEndPos = m_adapterEndPos;
+    result->rawScore = m_rawScore;
+    result->alignedRegionPercentIdentity = m_alignedRegionPercentIdentity;
+    result->fullAdapterPercentIdentity = m_fullAdapterPercentIdentity;
 }
@@ -0,0 +1,405 @@
+// This is a CPython extension module (porechop.cpp_extension) for the same aligner functions that
+// cpp_function_wrappers.py otherwise calls through ctypes. It takes Python objects directly, so
+// read codes and handle arrays are used from their own buffers (anything with the buffer protocol,
+// e.g. bytes, bytearray, memoryview or array) and the results come back as AlignmentResult struct
+// sequences. The GIL is released for the alignments themselves, so they run in parallel when
+// Porechop uses threads.
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <string>
+#include <vector>
+#include <cstring>
+
+#include "alignment.h"
+#include "adapter_align.h"
+#include "adapter_registry.h"
+#include "fast_align.h"
+
+
+typedef void (*AlignmentFunction)(char *, char *, int, int, int, int, AlignmentResult *);
+typedef void (*BatchFunction)(char *, int, int, int *, int, int, int, int, int,
+                              AlignmentResult *);
+typedef void (*PairsFunction)(char **, int *, int *, int *, int, int, int, int, int,
+                              AlignmentResult *);
+typedef int (*AllHitsFunction)(char *, char *, int, int, int, int, double, AlignmentResult *,
+                               int);
+
+
+static PyTypeObject * alignmentResultType = NULL;
+
+static PyStructSequence_Field alignmentResultFields[] = {
+    {(char *)"read_start", NULL},
+    {(char *)"read_end", NULL},
+    {(char *)"adapter_start", NULL},
+    {(char *)"adapter_end", NULL},
+    {(char *)"raw_score", NULL},
+    {(char *)"aligned_region_percent_identity", NULL},
+    {(char *)"full_adapter_percent_identity", NULL},
+    {NULL, NULL}
+};
+
+static PyStructSequence_Desc alignmentResultDesc = {
+    (char *)"porechop.cpp_extension.AlignmentResult",
+    (char *)"The numeric results of one adapter alignment (the same fields as the ctypes "
+            "AlignmentResult).",
+    alignmentResultFields,
+    7
+};
+
+
+static PyObject * makeResult(AlignmentResult & result) {
+    PyObject * resultObject = PyStructSequence_New(alignmentResultType);
+    if (resultObject == NULL)
+        return NULL;
+    PyStructSequence_SET_ITEM(resultObject, 0, PyLong_FromLong(result.readStartPos));
+    PyStructSequence_SET_ITEM(resultObject, 1, PyLong_FromLong(result.readEndPos));
+    PyStructSequence_SET_ITEM(resultObject, 2, PyLong_FromLong(result.adapterStartPos));
+    PyStructSequence_SET_ITEM(resultObject, 3, PyLong_FromLong(result.adapterEndPos));
+    PyStructSequence_SET_ITEM(resultObject, 4, PyLong_FromLong(result.rawScore));
+    PyStructSequence_SET_ITEM(resultObject, 5,
+                              PyFloat_FromDouble(result.alignedRegionPercentIdentity));
+    PyStructSequence_SET_ITEM(resultObject, 6,
+                              PyFloat_FromDouble(result.fullAdapterPercentIdentity));
+    for (int i = 0; i < 7; ++i) {
+        if (PyStructSequence_GET_ITEM(resultObject, i) == NULL) {
+            Py_DECREF(resultObject);
+            return NULL;
+        }
+    }
+    return resultObject;
+}
+
+
+static PyObject * makeResultList(std::vector<AlignmentResult> & results, int count) {
+    PyObject * resultList = PyList_New(count);
+    if (resultList == NULL)
+        return NULL;
+    for (int i = 0; i < count; ++i) {
+        PyObject * resultObject = makeResult(results[i]);
+        if (resultObject == NULL) {
+            Py_DECREF(resultList);
+            return NULL;
+        }
+        PyList_SET_ITEM(resultList, i, resultObject);
+    }
+    return resultList;
+}
+
+
+// A sequence given as a str (or bytes) is used from the object's own null-terminated buffer, as
+// the aligners expect. Anything else with the buffer protocol is copied into a string first.
+class SequenceArg {
+public:
+    SequenceArg() : m_data(NULL) {}
+
+    bool set(PyObject * sequence) {
+        if (PyUnicode_Check(sequence)) {
+            m_data = PyUnicode_AsUTF8(sequence);
+            return m_data != NULL;
+        }
+        if (PyBytes_Check(sequence)) {
+            m_data = PyBytes_AS_STRING(sequence);
+            return true;
+        }
+        Py_buffer buffer;
+        if (PyObject_GetBuffer(sequence, &buffer, PyBUF_SIMPLE) != 0)
+            return false;
+        m_copy.assign((const char *)buffer.buf, buffer.len);
+        PyBuffer_Release(&buffer);
+        m_data = m_copy.c_str();
+        return true;
+    }
+
+    char * data() {return const_cast<char *>(m_data);}
+
+private:
+    const char * m_data;
+    std::string m_copy;
+};
+
+
+// Reads a list of ints from a buffer of C ints (e.g. an array('i') or a ctypes c_int array, which
+// is used without converting each item) or from any sequence of Python ints.
+static bool getIntArray(PyObject * ints, std::vector<int> & values) {
+    if (PyObject_CheckBuffer(ints)) {
+        Py_buffer buffer;
+        if (PyObject_GetBuffer(ints, &buffer, PyBUF_FORMAT | PyBUF_C_CONTIGUOUS) != 0)
+            return false;
+        size_t formatLength = buffer.format == NULL ? 0 : strlen(buffer.format);
+        bool isIntBuffer = buffer.itemsize == sizeof(int) && formatLength > 0 &&
+                           buffer.format[formatLength - 1] == 'i' && formatLength <= 2;
+        if (isIntBuffer) {
+            const int * data = (const int *)buffer.buf;
+            values.assign(data, data + buffer.len / sizeof(int));
+        }
+        PyBuffer_Release(&buffer);
+        if (!isIntBuffer)
+            PyErr_SetString(PyExc_TypeError, "expected a buffer of C ints");
+        return isIntBuffer;
+    }
+    PyObject * fastInts = PySequence_Fast(ints, "expected a sequence of ints");
+    if (fastInts == NULL)
+        return false;
+    Py_ssize_t count = PySequence_Fast_GET_SIZE(fastInts);
+    values.resize(count);
+    for (Py_ssize_t i = 0; i < count; ++i) {
+        long value = PyLong_AsLong(PySequence_Fast_GET_ITEM(fastInts, i));
+        if (value == -1 && PyErr_Occurred()) {
+            Py_DECREF(fastInts);
+            return false;
+        }
+        values[i] = int(value);
+    }
+    Py_DECREF(fastInts);
+    return true;
+}
+
+
+static bool checkWindow(Py_ssize_t codesLength, int start, int length) {
+    if (start < 0 || length < 0 || start + Py_ssize_t(length) > codesLength) {
+        PyErr_SetString(PyExc_ValueError, "read window is outside the read");
+        return false;
+    }
+    return true;
+}
+
+
+static bool checkHandles(std::vector<int> & handles) {
+    int registeredCount = registeredAdapterCount();
+    for (size_t i = 0; i < handles.size(); ++i) {
+        if (handles[i] < 0 || handles[i] >= registeredCount) {
+            PyErr_SetString(PyExc_ValueError, "unknown adapter handle");
+            return false;
+        }
+    }
+    return true;
+}
+
+
+static PyObject * alignment(PyObject * args, AlignmentFunction function) {
+    PyObject * readObject, * adapterObject;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore;
+    if (!PyArg_ParseTuple(args, "OOiiii", &readObject, &adapterObject, &matchScore,
+                          &mismatchScore, &gapOpenScore, &gapExtensionScore))
+        return NULL;
+    SequenceArg readSeq, adapterSeq;
+    if (!readSeq.set(readObject) || !adapterSeq.set(adapterObject))
+        return NULL;
+    AlignmentResult result;
+    Py_BEGIN_ALLOW_THREADS
+    function(readSeq.data(), adapterSeq.data(), matchScore, mismatchScore, gapOpenScore,
+             gapExtensionScore, &result);
+    Py_END_ALLOW_THREADS
+    return makeResult(result);
+}
+
+
+static PyObject * alignmentBatch(PyObject * args, BatchFunction function) {
+    Py_buffer readCodes;
+    int readStart, readLength;
+    PyObject * handlesObject;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore;
+    if (!PyArg_ParseTuple(args, "y*iiOiiii", &readCodes, &readStart, &readLength,
+                          &handlesObject, &matchScore, &mismatchScore, &gapOpenScore,
+                          &gapExtensionScore))
+        return NULL;
+    std::vector<int> handles;
+    if (!checkWindow(readCodes.len, readStart, readLength) ||
+            !getIntArray(handlesObject, handles) || !checkHandles(handles)) {
+        PyBuffer_Release(&readCodes);
+        return NULL;
+    }
+    int adapterCount = handles.size();
+    std::vector<AlignmentResult> results(adapterCount);
+    if (adapterCount > 0) {
+        Py_BEGIN_ALLOW_THREADS
+        function((char *)readCodes.buf, readStart, readLength, handles.data(), adapterCount,
+                 matchScore, mismatchScore, gapOpenScore, gapExtensionScore, results.data());
+        Py_END_ALLOW_THREADS
+    }
+    PyBuffer_Release(&readCodes);
+    return makeResultList(results, adapterCount);
+}
+
+
+static PyObject * alignmentPairs(PyObject * args, PairsFunction function) {
+    PyObject * codesObject, * startsObject, * lengthsObject, * handlesObject;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore;
+    if (!PyArg_ParseTuple(args, "OOOOiiii", &codesObject, &startsObject, &lengthsObject,
+                          &handlesObject, &matchScore, &mismatchScore, &gapOpenScore,
+                          &gapExtensionScore))
+        return NULL;
+    std::vector<int> readStarts, readLengths, handles;
+    if (!getIntArray(startsObject, readStarts) || !getIntArray(lengthsObject, readLengths) ||
+            !getIntArray(handlesObject, handles) || !checkHandles(handles))
+        return NULL;
+    PyObject * fastCodes = PySequence_Fast(codesObject, "expected a sequence of read codes");
+    if (fastCodes == NULL)
+        return NULL;
+    Py_ssize_t pairCount = PySequence_Fast_GET_SIZE(fastCodes);
+    if (Py_ssize_t(readStarts.size()) != pairCount || Py_ssize_t(readLengths.size()) != pairCount ||
+            Py_ssize_t(handles.size()) != pairCount) {
+        Py_DECREF(fastCodes);
+        PyErr_SetString(PyExc_ValueError, "read windows and adapter handles differ in number");
+        return NULL;
+    }
+
+    // Each read's codes stay in their own buffer (which is held until the alignments are done).
+    std::vector<Py_buffer> buffers(pairCount);
+    std::vector<char *> readCodes(pairCount);
+    Py_ssize_t heldCount = 0;
+    bool ok = true;
+    for (Py_ssize_t i = 0; i < pairCount && ok; ++i) {
+        ok = PyObject_GetBuffer(PySequence_Fast_GET_ITEM(fastCodes, i), &buffers[i],
+                                PyBUF_SIMPLE) == 0;
+        if (ok) {
+            ++heldCount;
+            readCodes[i] = (char *)buffers[i].buf;
+            ok = checkWindow(buffers[i].len, readStarts[i], readLengths[i]);
+        }
+    }
+    std::vector<AlignmentResult> results(pairCount);
+    if (ok && pairCount > 0) {
+        Py_BEGIN_ALLOW_THREADS
+        function(readCodes.data(), readStarts.data(), readLengths.data(), handles.data(),
+                 int(pairCount), matchScore, mismatchScore, gapOpenScore, gapExtensionScore,
+                 results.data());
+        Py_END_ALLOW_THREADS
+    }
+    for (Py_ssize_t i = 0; i < heldCount; ++i)
+        PyBuffer_Release(&buffers[i]);
+    Py_DECREF(fastCodes);
+    if (!ok)
+        return NULL;
+    return makeResultList(results, int(pairCount));
+}
+
+
+static PyObject * allHits(PyObject * args, AllHitsFunction function) {
+    PyObject * readObject, * adapterObject;
+    int matchScore, mismatchScore, gapOpenScore, gapExtensionScore;
+    double minIdentity;
+    if (!PyArg_ParseTuple(args, "OOiiiid", &readObject, &adapterObject, &matchScore,
+                          &mismatchScore, &gapOpenScore, &gapExtensionScore, &minIdentity))
+        return NULL;
+    SequenceArg readSeq, adapterSeq;
+    if (!readSeq.set(readObject) || !adapterSeq.set(adapterObject))
+        return NULL;
+
+    // The function returns how many hits there are, even if there wasn't room for all of them, in
+    // which case it is run again with enough room.
+    std::vector<AlignmentResult> results(8);
+    int hitCount;
+    Py_BEGIN_ALLOW_THREADS
+    while (true) {
+        hitCount = function(readSeq.data(), adapterSeq.data(), matchScore, mismatchScore,
+                            gapOpenScore, gapExtensionScore, minIdentity, results.data(),
+                            int(results.size()));
+        if (hitCount <= int(results.size()))
+            break;
+        results.resize(hitCount);
+    }
+    Py_END_ALLOW_THREADS
+    return makeResultList(results, hitCount);
+}
+
+
+static PyObject * py_adapterAlignment(PyObject *, PyObject * args) {
+    return alignment(args, adapterAlignment);
+}
+static PyObject * py_fastAdapterAlignment(PyObject *, PyObject * args) {
+    return alignment(args, fastAdapterAlignment);
+}
+static PyObject * py_adapterAlignmentBatch(PyObject *, PyObject * args) {
+    return alignmentBatch(args, adapterAlignmentBatch);
+}
+static PyObject * py_fastAdapterAlignmentBatch(PyObject *, PyObject * args) {
+    return alignmentBatch(args, fastAdapterAlignmentBatch);
+}
+static PyObject * py_adapterAlignmentPairs(PyObject *, PyObject * args) {
+    return alignmentPairs(args, adapterAlignmentPairs);
+}
+static PyObject * py_fastAdapterAlignmentPairs(PyObject *, PyObject * args) {
+    return alignmentPairs(args, fastAdapterAlignmentPairs);
+}
+static PyObject * py_adapterAllHits(PyObject *, PyObject * args) {
+    return allHits(args, adapterAllHits);
+}
+static PyObject * py_fastAdapterAllHits(PyObject *, PyObject * args) {
+    return allHits(args, fastAdapterAllHits);
+}
+
+
+static PyObject * py_registerAdapter(PyObject *, PyObject * args) {
+    Py_buffer codes;
+    int matchScore, mismatchScore;
+    if (!PyArg_ParseTuple(args, "y*ii", &codes, &matchScore, &mismatchScore))
+        return NULL;
+    int handle = registerAdapter((char *)codes.buf, int(codes.len), matchScore, mismatchScore);
+    PyBuffer_Release(&codes);
+    return PyLong_FromLong(handle);
+}
+
+
+static PyMethodDef extensionMethods[] = {
+    {"adapter_alignment", py_adapterAlignment, METH_VARARGS,
+     "adapter_alignment(read_seq, adapter_seq, match, mismatch, gap_open, gap_extend)"},
+    {"fast_adapter_alignment", py_fastAdapterAlignment, METH_VARARGS,
+     "fast_adapter_alignment(read_seq, adapter_seq, match, mismatch, gap_open, gap_extend)"},
+    {"adapter_alignment_batch", py_adapterAlignmentBatch, METH_VARARGS,
+     "adapter_alignment_batch(read_codes, start, length, adapter_handles, match, mismatch, "
+     "gap_open, gap_extend)"},
+    {"fast_adapter_alignment_batch", py_fastAdapterAlignmentBatch, METH_VARARGS,
+     "fast_adapter_alignment_batch(read_codes, start, length, adapter_handles, match, "
+     "mismatch, gap_open, gap_extend)"},
+    {"adapter_alignment_pairs", py_adapterAlignmentPairs, METH_VARARGS,
+     "adapter_alignment_pairs(read_codes_list, starts, lengths, adapter_handles, match, "
+     "mismatch, gap_open, gap_extend)"},
+    {"fast_adapter_alignment_pairs", py_fastAdapterAlignmentPairs, METH_VARARGS,
+     "fast_adapter_alignment_pairs(read_codes_list, starts, lengths, adapter_handles, match, "
+     "mismatch, gap_open, gap_extend)"},
+    {"adapter_all_hits", py_adapterAllHits, METH_VARARGS,
+     "adapter_all_hits(read_seq, adapter_seq, match, mismatch, gap_open, gap_extend, "
+     "min_identity)"},
+    {"fast_adapter_all_hits", py_fastAdapterAllHits, METH_VARARGS,
+     "fast_adapter_all_hits(read_seq, adapter_seq, match, mismatch, gap_open, gap_extend, "
+     "min_identity)"},
+    {"register_adapter", py_registerAdapter, METH_VARARGS,
+     "register_adapter(adapter_codes, match, mismatch) - returns a handle, or -1 if the "
+     "registry is full"},
+    {NULL, NULL, 0, NULL}
+};
+
+
+static struct PyModuleDef extensionModule = {
+    PyModuleDef_HEAD_INIT,
+    "cpp_extension",
+    "Porechop's C++ aligners as a CPython extension module.",
+    -1,
+    extensionMethods,
+    NULL,
+    NULL,
+    NULL,
+    NULL
+};
+
+
+PyMODINIT_FUNC PyInit_cpp_extension(void) {
+    PyObject * module = PyModule_Create(&extensionModule);
+    if (module == NULL)
+        return NULL;
+    alignmentResultType = PyStructSequence_NewType(&alignmentResultDesc);
+    if (alignmentResultType == NULL) {
+        Py_DECREF(module);
+        return NULL;
+    }
+    Py_INCREF(alignmentResultType);
+    if (PyModule_AddObject(module, "AlignmentResult", (PyObject *)alignmentResultType) != 0) {
+        Py_DECREF(alignmentResultType);
+        Py_DECREF(module);
+        return NULL;
+    }
+    return module;
+}
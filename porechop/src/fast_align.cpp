@@ -0,0 +1,758 @@
+#include "fast_align.h"
+#include "adapter_registry.h"
+
+#include <algorithm>
+#include <cstdlib>
+#include <cstring>
+#include <limits>
+
+#ifdef __SSE2__
+#include <emmintrin.h>
+#endif
+
+
+// Bits for the traceback matrix. They follow SeqAn's trace values so that the traceback makes the
+// same choices as SeqAn's globalAlignment when there is more than one optimal alignment.
+const uint8_t TRACE_NONE = 0;
+const uint8_t TRACE_DIAGONAL = 1;
+const uint8_t TRACE_HORIZONTAL = 2;
+const uint8_t TRACE_VERTICAL = 4;
+const uint8_t TRACE_HORIZONTAL_OPEN = 8;
+const uint8_t TRACE_VERTICAL_OPEN = 16;
+const uint8_t TRACE_MAX_FROM_HORIZONTAL = 32;
+const uint8_t TRACE_MAX_FROM_VERTICAL = 64;
+
+// Alignment columns: a read base against an adapter base, a read base against a gap or an adapter
+// base against a gap.
+const uint8_t OP_MATCH = 0;
+const uint8_t OP_READ_ONLY = 1;
+const uint8_t OP_ADAPTER_ONLY = 2;
+
+const int NEGATIVE_INFINITY = std::numeric_limits<int>::min() / 2;
+const uint8_t BASE_N = 4;
+
+// With SSE2, up to eight adapters are aligned to the read at once, each in a 16-bit lane.
+const int LANE_COUNT = 8;
+
+// When finding all hits, the scores of every this-many-th column are kept so the matrix can be
+// updated from there after a hit is masked.
+const int CHECKPOINT_SPACING = 64;
+
+
+// Does the same job as adapterAlignment, but with fastAlignToAdapter instead of SeqAn.
+void fastAdapterAlignment(char * readSeq, char * adapterSeq,
+                          int matchScore, int mismatchScore, int gapOpenScore,
+                          int gapExtensionScore, AlignmentResult * result) {
+    thread_local FastAlignBuffers buffers;
+    encodeSequence(readSeq, buffers.readCodes);
+    encodeSequence(adapterSeq, buffers.adapterCodes);
+    makeScoreProfile(buffers.adapterCodes, matchScore, mismatchScore, buffers.scoreProfile);
+    fastAlignToAdapter(buffers.readCodes, buffers.adapterCodes, buffers.scoreProfile.data(),
+                       gapOpenScore, gapExtensionScore, buffers, result);
+}
+
+
+// Does the same job as adapterAlignmentBatch, but with the fast aligner instead of SeqAn. Where
+// possible, the adapters are sorted by length and aligned in groups using SIMD lanes.
+void fastAdapterAlignmentBatch(char * readCodes, int readStart, int readLength,
+                               int * adapterHandles, int adapterCount,
+                               int matchScore, int mismatchScore, int gapOpenScore,
+                               int gapExtensionScore, AlignmentResult * results) {
+    thread_local FastAlignBuffers buffers;
+    copyCodes(readCodes + readStart, readLength, buffers.readCodes);
+    buffers.pairAdapters.resize(adapterCount);
+    for (int i = 0; i < adapterCount; ++i)
+        buffers.pairAdapters[i] = &getRegisteredAdapter(adapterHandles[i]);
+
+    std::vector<std::vector<uint8_t> *> & pairReadCodes = buffers.pairReadCodes;
+    pairReadCodes.assign(adapterCount, &buffers.readCodes);
+    alignPairs(adapterCount, matchScore, mismatchScore, gapOpenScore, gapExtensionScore, buffers,
+               results);
+}
+
+
+// Does the same job as adapterAlignmentPairs, but with the fast aligner instead of SeqAn. Each
+// pair gets its own SIMD lane, so the reads in a group don't need to be the same.
+void fastAdapterAlignmentPairs(char ** readCodes, int * readStarts, int * readLengths,
+                               int * adapterHandles, int pairCount,
+                               int matchScore, int mismatchScore, int gapOpenScore,
+                               int gapExtensionScore, AlignmentResult * results) {
+    thread_local FastAlignBuffers buffers;
+    buffers.pairAdapters.resize(pairCount);
+    if (int(buffers.pairReadCodeStorage.size()) < pairCount)
+        buffers.pairReadCodeStorage.resize(pairCount);
+    buffers.pairReadCodes.resize(pairCount);
+
+    // The same read window usually comes up in many pairs in a row, so it is only copied once.
+    for (int i = 0; i < pairCount; ++i) {
+        char * readWindow = readCodes[i] + readStarts[i];
+        if (i > 0 && readWindow == readCodes[i - 1] + readStarts[i - 1] &&
+                readLengths[i] == readLengths[i - 1])
+            buffers.pairReadCodes[i] = buffers.pairReadCodes[i - 1];
+        else {
+            copyCodes(readWindow, readLengths[i], buffers.pairReadCodeStorage[i]);
+            buffers.pairReadCodes[i] = &buffers.pairReadCodeStorage[i];
+        }
+        buffers.pairAdapters[i] = &getRegisteredAdapter(adapterHandles[i]);
+    }
+    alignPairs(pairCount, matchScore, mismatchScore, gapOpenScore, gapExtensionScore, buffers,
+               results);
+}
+
+
+// Aligns each encoded read in buffers.pairReadCodes to the registered adapter at the same index in
+// buffers.pairAdapters. Pairs which fit in 16-bit lanes are sorted by size and aligned in groups
+// of LANE_COUNT, the rest (and everything when SSE2 isn't available) are aligned one at a time.
+void alignPairs(int pairCount, int matchScore, int mismatchScore, int gapOpenScore,
+                int gapExtensionScore, FastAlignBuffers & buffers, AlignmentResult * results) {
+    std::vector<std::vector<uint8_t> *> & pairReadCodes = buffers.pairReadCodes;
+    std::vector<RegisteredAdapter *> & adapters = buffers.pairAdapters;
+    std::vector<int> & order = buffers.order;
+    order.clear();
+    for (int i = 0; i < pairCount; ++i) {
+        if (canUseLanes(pairReadCodes[i]->size(), adapters[i]->codes.size(), matchScore,
+                        mismatchScore, gapOpenScore, gapExtensionScore))
+            order.push_back(i);
+        else
+            fastAlignToAdapter(*pairReadCodes[i], adapters[i]->codes,
+                               adapters[i]->scoreProfile.data(), gapOpenScore, gapExtensionScore,
+                               buffers, &results[i]);
+    }
+
+    // Grouping pairs of similar size means less of each group's matrix is wasted.
+    std::stable_sort(order.begin(), order.end(), [&pairReadCodes, &adapters](int a, int b) {
+        if (adapters[a]->codes.size() != adapters[b]->codes.size())
+            return adapters[a]->codes.size() < adapters[b]->codes.size();
+        return pairReadCodes[a]->size() < pairReadCodes[b]->size();
+    });
+    std::vector<uint8_t> * laneReadCodes[LANE_COUNT];
+    RegisteredAdapter * laneAdapters[LANE_COUNT];
+    AlignmentResult * laneResults[LANE_COUNT];
+    for (int i = 0; i < int(order.size()); i += LANE_COUNT) {
+        int laneCount = std::min(LANE_COUNT, int(order.size()) - i);
+        for (int k = 0; k < laneCount; ++k) {
+            laneReadCodes[k] = pairReadCodes[order[i + k]];
+            laneAdapters[k] = adapters[order[i + k]];
+            laneResults[k] = &results[order[i + k]];
+        }
+        fastAlignToAdapterLanes(laneReadCodes, laneAdapters, laneCount, matchScore,
+                                mismatchScore, gapOpenScore, gapExtensionScore, buffers,
+                                laneResults);
+    }
+}
+
+
+// Converts bases to the same codes as SeqAn's Dna5 (anything other than A, C, G or T is an N).
+void encodeSequence(char * seq, std::vector<uint8_t> & codes) {
+    codes.clear();
+    for (char * c = seq; *c != '\0'; ++c) {
+        switch (*c) {
+            case 'A': case 'a': codes.push_back(0); break;
+            case 'C': case 'c': codes.push_back(1); break;
+            case 'G': case 'g': codes.push_back(2); break;
+            case 'T': case 't': codes.push_back(3); break;
+            default: codes.push_back(BASE_N);
+        }
+    }
+}
+
+
+// Copies already encoded bases (e.g. a window of an encoded read end) into a code buffer.
+void copyCodes(char * codes, int length, std::vector<uint8_t> & buffer) {
+    buffer.assign(reinterpret_cast<uint8_t *>(codes), reinterpret_cast<uint8_t *>(codes) + length);
+}
+
+
+// Fills one column of the DP matrix (one read base against the whole adapter) from the previous
+// column's scores. baseScores is the adapter's score profile row for the read base.
+//
+// Like SeqAn, the simpler linear gap recursion is used when the gap open and gap extension scores
+// are the same. When there is a tie, the trace gets the bits for all of the best directions. The
+// comparisons are turned into bits without branching, because ties are common and hard to
+// predict.
+inline void fillColumn(const int * baseScores, int rowCount, const int * prevScores,
+                       const int * prevHorizontalScores, int * currScores,
+                       int * currHorizontalScores, uint8_t * columnTrace, bool linearGaps,
+                       int gapOpenScore, int gapExtensionScore) {
+    currScores[0] = 0;
+    currHorizontalScores[0] = NEGATIVE_INFINITY;
+    columnTrace[0] = TRACE_NONE;
+    int verticalScore = NEGATIVE_INFINITY;
+    int upScore = 0, upLeftScore = 0;
+    for (int i = 1; linearGaps && i < rowCount; ++i) {
+        int leftScore = prevScores[i];
+        int diagonalScore = upLeftScore + baseScores[i - 1];
+        int verticalGapScore = upScore + gapExtensionScore;
+        int horizontalGapScore = leftScore + gapExtensionScore;
+        int score = std::max(diagonalScore, std::max(verticalGapScore, horizontalGapScore));
+        columnTrace[i] = (TRACE_DIAGONAL * (diagonalScore == score)) |
+                         ((TRACE_VERTICAL | TRACE_MAX_FROM_VERTICAL) *
+                          (verticalGapScore == score)) |
+                         ((TRACE_HORIZONTAL | TRACE_MAX_FROM_HORIZONTAL) *
+                          (horizontalGapScore == score));
+        currScores[i] = score;
+        currHorizontalScores[i] = NEGATIVE_INFINITY;
+        upScore = score;
+        upLeftScore = leftScore;
+    }
+
+    for (int i = 1; !linearGaps && i < rowCount; ++i) {
+        int leftScore = prevScores[i];
+        int horizontalExtendScore = prevHorizontalScores[i] + gapExtensionScore;
+        int horizontalOpenScore = leftScore + gapOpenScore;
+        int horizontalScore = std::max(horizontalExtendScore, horizontalOpenScore);
+        int verticalExtendScore = verticalScore + gapExtensionScore;
+        int verticalOpenScore = upScore + gapOpenScore;
+        verticalScore = std::max(verticalExtendScore, verticalOpenScore);
+        int gapScore = std::max(verticalScore, horizontalScore);
+        int diagonalScore = upLeftScore + baseScores[i - 1];
+        int score = std::max(gapScore, diagonalScore);
+
+        uint8_t maxTrace = (TRACE_MAX_FROM_VERTICAL * (verticalScore == gapScore)) |
+                           (TRACE_MAX_FROM_HORIZONTAL * (horizontalScore == gapScore));
+        uint8_t traceValue = (TRACE_HORIZONTAL * (horizontalExtendScore == horizontalScore)) |
+                             (TRACE_HORIZONTAL_OPEN * (horizontalOpenScore == horizontalScore)) |
+                             (TRACE_VERTICAL * (verticalExtendScore == verticalScore)) |
+                             (TRACE_VERTICAL_OPEN * (verticalOpenScore == verticalScore)) |
+                             (TRACE_DIAGONAL * (diagonalScore == score)) |
+                             (maxTrace * (gapScore == score));
+
+        currScores[i] = score;
+        currHorizontalScores[i] = horizontalScore;
+        columnTrace[i] = traceValue;
+        upScore = score;
+        upLeftScore = leftScore;
+    }
+}
+
+
+// A semi-global alignment (end gaps are free in both sequences) with affine gap penalties. It
+// gives the same result as alignToAdapter, but it only keeps one column of scores at a time, a
+// one-byte-per-cell traceback matrix and a list of alignment columns, instead of building a SeqAn
+// Align object and then walking its rows as strings.
+//
+// The read runs horizontally and the adapter runs vertically, as in alignToAdapter. The matrix is
+// filled column by column, ties are broken the same way as in SeqAn and the best score in the last
+// row/column is the first one found, so the chosen alignment matches SeqAn's.
+void fastAlignToAdapter(std::vector<uint8_t> & readCodes, std::vector<uint8_t> & adapterCodes,
+                        const int * scoreProfile, int gapOpenScore, int gapExtensionScore,
+                        FastAlignBuffers & buffers, AlignmentResult * result) {
+    int readLength = readCodes.size();
+    int adapterLength = adapterCodes.size();
+    int rowCount = adapterLength + 1;
+    bool linearGaps = gapOpenScore == gapExtensionScore;
+
+    buffers.prevScores.assign(rowCount, 0);
+    buffers.prevHorizontalScores.assign(rowCount, NEGATIVE_INFINITY);
+    buffers.currScores.resize(rowCount);
+    buffers.currHorizontalScores.resize(rowCount);
+    buffers.trace.resize((readLength + 1) * rowCount);
+    uint8_t * trace = buffers.trace.data();
+    for (int i = 0; i < rowCount; ++i)
+        trace[i] = TRACE_NONE;
+
+    // The best score is looked for in the last row and the last column, starting with the cells
+    // of the first column.
+    int bestScore = 0;
+    int bestColumn = 0;
+    int bestRow = (readLength == 0) ? 0 : adapterLength;
+
+    for (int j = 1; j <= readLength; ++j) {
+        int * currScores = buffers.currScores.data();
+        fillColumn(scoreProfile + readCodes[j - 1] * adapterLength, rowCount,
+                   buffers.prevScores.data(), buffers.prevHorizontalScores.data(), currScores,
+                   buffers.currHorizontalScores.data(), trace + j * rowCount, linearGaps,
+                   gapOpenScore, gapExtensionScore);
+
+        int firstTrackedRow = (j == readLength) ? 0 : adapterLength;
+        for (int i = firstTrackedRow; i < rowCount; ++i) {
+            if (currScores[i] > bestScore) {
+                bestScore = currScores[i];
+                bestColumn = j;
+                bestRow = i;
+            }
+        }
+        buffers.prevScores.swap(buffers.currScores);
+        buffers.prevHorizontalScores.swap(buffers.currHorizontalScores);
+    }
+
+    traceBack(trace, rowCount, 1, 0, readLength, adapterLength, bestRow, bestColumn, linearGaps,
+              buffers.ops);
+
+    // SeqAn doesn't align empty sequences and gives the lowest possible score instead.
+    if (readLength == 0 || adapterLength == 0)
+        bestScore = std::numeric_limits<int>::min();
+    scoreAlignmentOps(buffers.ops, readCodes, adapterCodes, bestScore, result);
+}
+
+
+// Finds every hit of the adapter in the read, the same way as repeatedly aligning the adapter to
+// the whole read and masking each hit (turning its bases into Ns) until the best alignment's
+// full adapter identity is under minIdentity. Instead of redoing the whole DP after each hit, the
+// matrix is only refilled from just before the masked bases until its columns are the same as
+// before, so most of the read is only aligned once. Hits are in the order they are found. Returns
+// the number of hits, but only the first maxResults are put in results.
+int fastAdapterAllHits(char * readSeq, char * adapterSeq,
+                       int matchScore, int mismatchScore, int gapOpenScore,
+                       int gapExtensionScore, double minIdentity, AlignmentResult * results,
+                       int maxResults) {
+    thread_local FastAlignBuffers buffers;
+    std::vector<uint8_t> & readCodes = buffers.readCodes;
+    std::vector<uint8_t> & adapterCodes = buffers.adapterCodes;
+    encodeSequence(readSeq, readCodes);
+    encodeSequence(adapterSeq, adapterCodes);
+    int readLength = readCodes.size();
+    int adapterLength = adapterCodes.size();
+    if (readLength == 0 || adapterLength == 0)
+        return 0;
+    makeScoreProfile(adapterCodes, matchScore, mismatchScore, buffers.scoreProfile);
+    const int * scoreProfile = buffers.scoreProfile.data();
+    int rowCount = adapterLength + 1;
+    bool linearGaps = gapOpenScore == gapExtensionScore;
+
+    int checkpointCount = readLength / CHECKPOINT_SPACING + 1;
+    buffers.checkpointScores.assign(checkpointCount * rowCount, 0);
+    buffers.checkpointHorizontalScores.assign(checkpointCount * rowCount, NEGATIVE_INFINITY);
+    buffers.lastRowScores.assign(readLength + 1, 0);
+    buffers.prevScores.resize(rowCount);
+    buffers.prevHorizontalScores.resize(rowCount);
+    buffers.currScores.resize(rowCount);
+    buffers.currHorizontalScores.resize(rowCount);
+    buffers.trace.resize((readLength + 1) * rowCount);
+    uint8_t * trace = buffers.trace.data();
+    memset(trace, TRACE_NONE, rowCount);
+
+    // Fills columns firstColumn onwards (starting from the checkpoint before it) and stops at a
+    // checkpoint past stopAfterColumn which hasn't changed. It keeps the checkpoints, the last
+    // row's scores and the last column's scores up to date.
+    auto fillColumns = [&](int firstColumn, int stopAfterColumn) {
+        int checkpoint = (firstColumn - 1) / CHECKPOINT_SPACING;
+        std::copy_n(&buffers.checkpointScores[checkpoint * rowCount], rowCount,
+                    buffers.prevScores.begin());
+        std::copy_n(&buffers.checkpointHorizontalScores[checkpoint * rowCount], rowCount,
+                    buffers.prevHorizontalScores.begin());
+        for (int j = checkpoint * CHECKPOINT_SPACING + 1; j <= readLength; ++j) {
+            fillColumn(scoreProfile + readCodes[j - 1] * adapterLength, rowCount,
+                       buffers.prevScores.data(), buffers.prevHorizontalScores.data(),
+                       buffers.currScores.data(), buffers.currHorizontalScores.data(),
+                       trace + j * rowCount, linearGaps, gapOpenScore, gapExtensionScore);
+            buffers.lastRowScores[j] = buffers.currScores[adapterLength];
+            buffers.prevScores.swap(buffers.currScores);
+            buffers.prevHorizontalScores.swap(buffers.currHorizontalScores);
+            if (j % CHECKPOINT_SPACING == 0) {
+                int * checkpointScores = &buffers.checkpointScores[j / CHECKPOINT_SPACING *
+                                                                   rowCount];
+                int * checkpointHorizontalScores =
+                    &buffers.checkpointHorizontalScores[j / CHECKPOINT_SPACING * rowCount];
+                if (j > stopAfterColumn &&
+                        std::equal(buffers.prevScores.begin(), buffers.prevScores.end(),
+                                   checkpointScores) &&
+                        std::equal(buffers.prevHorizontalScores.begin(),
+                                   buffers.prevHorizontalScores.end(),
+                                   checkpointHorizontalScores))
+                    return;
+                std::copy(buffers.prevScores.begin(), buffers.prevScores.end(), checkpointScores);
+                std::copy(buffers.prevHorizontalScores.begin(),
+                          buffers.prevHorizontalScores.end(), checkpointHorizontalScores);
+            }
+        }
+        buffers.lastColumnScores = buffers.prevScores;
+    };
+    fillColumns(1, readLength);
+
+    int hitCount = 0;
+    while (true) {
+        // The best cell is chosen in the same order as in fastAlignToAdapter.
+        int bestScore = 0, bestColumn = 0, bestRow = adapterLength;
+        for (int j = 1; j < readLength; ++j) {
+            if (buffers.lastRowScores[j] > bestScore) {
+                bestScore = buffers.lastRowScores[j];
+                bestColumn = j;
+            }
+        }
+        for (int i = 0; i < rowCount; ++i) {
+            if (buffers.lastColumnScores[i] > bestScore) {
+                bestScore = buffers.lastColumnScores[i];
+                bestColumn = readLength;
+                bestRow = i;
+            }
+        }
+
+        AlignmentResult result;
+        traceBack(trace, rowCount, 1, 0, readLength, adapterLength, bestRow, bestColumn,
+                  linearGaps, buffers.ops);
+        scoreAlignmentOps(buffers.ops, readCodes, adapterCodes, bestScore, &result);
+        if (result.readStartPos == -1 || result.fullAdapterPercentIdentity < minIdentity)
+            break;
+
+        // A hit made only of already-masked bases would be found again and again (only possible
+        // with a threshold near zero), so the search stops there.
+        bool allMasked = true;
+        for (int j = result.readStartPos; j <= result.readEndPos; ++j) {
+            allMasked = allMasked && readCodes[j] == BASE_N;
+            readCodes[j] = BASE_N;
+        }
+        if (allMasked)
+            break;
+        if (hitCount < maxResults)
+            results[hitCount] = result;
+        ++hitCount;
+        fillColumns(result.readStartPos + 1, result.readEndPos + 1);
+    }
+    return hitCount;
+}
+
+
+// The lanes hold 16-bit scores, so they are only used when no score can get near the limits of a
+// 16-bit integer. The scores in a column are bounded by the adapter length (not the read length)
+// because the ends of the read are free.
+bool canUseLanes(int readLength, int adapterLength, int matchScore, int mismatchScore,
+                 int gapOpenScore, int gapExtensionScore) {
+#ifdef __SSE2__
+    if (readLength == 0 || adapterLength == 0)
+        return false;
+    int largestScore = std::max(std::max(std::abs(matchScore), std::abs(mismatchScore)),
+                                std::max(std::abs(gapOpenScore), std::abs(gapExtensionScore)));
+    return (adapterLength + 3) * 2 * largestScore < std::numeric_limits<int16_t>::max();
+#else
+    (void)readLength; (void)adapterLength; (void)matchScore; (void)mismatchScore;
+    (void)gapOpenScore; (void)gapExtensionScore;
+    return false;
+#endif
+}
+
+
+// Does the same alignment as fastAlignToAdapter, but for up to LANE_COUNT read/adapter pairs at
+// once: each cell of the DP matrix holds one 16-bit score per pair. Pairs smaller than the largest
+// one in the group still get the whole matrix, but their extra rows and columns are ignored. The
+// result for lane k goes into results[k].
+void fastAlignToAdapterLanes(std::vector<uint8_t> ** readCodes, RegisteredAdapter ** adapters,
+                             int laneCount,
+                             int matchScore, int mismatchScore, int gapOpenScore,
+                             int gapExtensionScore, FastAlignBuffers & buffers,
+                             AlignmentResult ** results) {
+#ifdef __SSE2__
+    int readLengths[LANE_COUNT], adapterLengths[LANE_COUNT];
+    int longestRead = 0, longestAdapter = 0;
+    for (int k = 0; k < laneCount; ++k) {
+        readLengths[k] = readCodes[k]->size();
+        adapterLengths[k] = adapters[k]->codes.size();
+        longestRead = std::max(longestRead, readLengths[k]);
+        longestAdapter = std::max(longestAdapter, adapterLengths[k]);
+    }
+    int rowCount = longestAdapter + 1;
+    bool linearGaps = gapOpenScore == gapExtensionScore;
+
+    // Each row of the adapter profile holds that position's base for every lane, and likewise for
+    // each column of the read profile. Past the end of a sequence (or in an unused lane) the codes
+    // are -1 and -2, so they never match.
+    buffers.laneAdapterCodes.assign(longestAdapter * LANE_COUNT, -1);
+    buffers.laneReadCodes.assign(longestRead * LANE_COUNT, -2);
+    for (int k = 0; k < laneCount; ++k) {
+        for (int i = 0; i < adapterLengths[k]; ++i)
+            buffers.laneAdapterCodes[i * LANE_COUNT + k] = adapters[k]->codes[i];
+        for (int j = 0; j < readLengths[k]; ++j)
+            buffers.laneReadCodes[j * LANE_COUNT + k] = (*readCodes[k])[j];
+    }
+
+    int16_t negativeInfinity = std::numeric_limits<int16_t>::min();
+    buffers.prevLaneScores.assign(rowCount * LANE_COUNT, 0);
+    buffers.prevLaneHorizontalScores.assign(rowCount * LANE_COUNT, negativeInfinity);
+    buffers.currLaneScores.assign(rowCount * LANE_COUNT, 0);
+    buffers.currLaneHorizontalScores.assign(rowCount * LANE_COUNT, negativeInfinity);
+    buffers.trace.resize((longestRead + 1) * rowCount * LANE_COUNT);
+    uint8_t * trace = buffers.trace.data();
+    memset(trace, TRACE_NONE, rowCount * LANE_COUNT);
+
+    int bestScores[LANE_COUNT], bestColumns[LANE_COUNT], bestRows[LANE_COUNT];
+    for (int k = 0; k < laneCount; ++k) {
+        bestScores[k] = 0;
+        bestColumns[k] = 0;
+        bestRows[k] = adapterLengths[k];
+    }
+
+    const __m128i matchDifference = _mm_set1_epi16(matchScore - mismatchScore);
+    const __m128i mismatch = _mm_set1_epi16(mismatchScore);
+    const __m128i gapOpen = _mm_set1_epi16(gapOpenScore);
+    const __m128i gapExtension = _mm_set1_epi16(gapExtensionScore);
+    const __m128i traceDiagonal = _mm_set1_epi16(TRACE_DIAGONAL);
+    const __m128i traceHorizontal = _mm_set1_epi16(TRACE_HORIZONTAL);
+    const __m128i traceVertical = _mm_set1_epi16(TRACE_VERTICAL);
+    const __m128i traceHorizontalOpen = _mm_set1_epi16(TRACE_HORIZONTAL_OPEN);
+    const __m128i traceVerticalOpen = _mm_set1_epi16(TRACE_VERTICAL_OPEN);
+    const __m128i traceMaxFromHorizontal = _mm_set1_epi16(TRACE_MAX_FROM_HORIZONTAL);
+    const __m128i traceMaxFromVertical = _mm_set1_epi16(TRACE_MAX_FROM_VERTICAL);
+    const __m128i traceLinearHorizontal = _mm_set1_epi16(TRACE_HORIZONTAL |
+                                                         TRACE_MAX_FROM_HORIZONTAL);
+    const __m128i traceLinearVertical = _mm_set1_epi16(TRACE_VERTICAL | TRACE_MAX_FROM_VERTICAL);
+    const __m128i * adapterProfile = (const __m128i *)buffers.laneAdapterCodes.data();
+    const __m128i * readProfile = (const __m128i *)buffers.laneReadCodes.data();
+
+    for (int j = 1; j <= longestRead; ++j) {
+        __m128i * prevScores = (__m128i *)buffers.prevLaneScores.data();
+        __m128i * prevHorizontalScores = (__m128i *)buffers.prevLaneHorizontalScores.data();
+        __m128i * currScores = (__m128i *)buffers.currLaneScores.data();
+        __m128i * currHorizontalScores = (__m128i *)buffers.currLaneHorizontalScores.data();
+        uint8_t * columnTrace = trace + j * rowCount * LANE_COUNT;
+        memset(columnTrace, TRACE_NONE, LANE_COUNT);
+        const __m128i readBase = _mm_loadu_si128(readProfile + j - 1);
+
+        // This is the same recursion (and the same handling of ties) as in fastAlignToAdapter,
+        // but with saturating 16-bit arithmetic.
+        __m128i upScore = _mm_setzero_si128();
+        __m128i upLeftScore = _mm_setzero_si128();
+        __m128i verticalScore = _mm_set1_epi16(negativeInfinity);
+        for (int i = 1; i < rowCount; ++i) {
+            __m128i leftScore = _mm_loadu_si128(prevScores + i);
+            __m128i isMatch = _mm_cmpeq_epi16(readBase, _mm_loadu_si128(adapterProfile + i - 1));
+            __m128i diagonalScore = _mm_adds_epi16(upLeftScore,
+                _mm_add_epi16(mismatch, _mm_and_si128(isMatch, matchDifference)));
+            __m128i score, traceValue;
+            if (linearGaps) {
+                __m128i verticalGapScore = _mm_adds_epi16(upScore, gapExtension);
+                __m128i horizontalGapScore = _mm_adds_epi16(leftScore, gapExtension);
+                score = _mm_max_epi16(diagonalScore,
+                                      _mm_max_epi16(verticalGapScore, horizontalGapScore));
+                traceValue = _mm_or_si128(
+                    _mm_and_si128(_mm_cmpeq_epi16(diagonalScore, score), traceDiagonal),
+                    _mm_or_si128(
+                        _mm_and_si128(_mm_cmpeq_epi16(verticalGapScore, score),
+                                      traceLinearVertical),
+                        _mm_and_si128(_mm_cmpeq_epi16(horizontalGapScore, score),
+                                      traceLinearHorizontal)));
+            }
+            else {
+                __m128i horizontalExtendScore =
+                    _mm_adds_epi16(_mm_loadu_si128(prevHorizontalScores + i), gapExtension);
+                __m128i horizontalOpenScore = _mm_adds_epi16(leftScore, gapOpen);
+                __m128i horizontalScore = _mm_max_epi16(horizontalExtendScore,
+                                                        horizontalOpenScore);
+                __m128i verticalExtendScore = _mm_adds_epi16(verticalScore, gapExtension);
+                __m128i verticalOpenScore = _mm_adds_epi16(upScore, gapOpen);
+                verticalScore = _mm_max_epi16(verticalExtendScore, verticalOpenScore);
+                __m128i gapScore = _mm_max_epi16(verticalScore, horizontalScore);
+                score = _mm_max_epi16(gapScore, diagonalScore);
+
+                __m128i maxTrace = _mm_or_si128(
+                    _mm_and_si128(_mm_cmpeq_epi16(verticalScore, gapScore), traceMaxFromVertical),
+                    _mm_and_si128(_mm_cmpeq_epi16(horizontalScore, gapScore),
+                                  traceMaxFromHorizontal));
+                traceValue = _mm_or_si128(
+                    _mm_or_si128(
+                        _mm_and_si128(_mm_cmpeq_epi16(horizontalExtendScore, horizontalScore),
+                                      traceHorizontal),
+                        _mm_and_si128(_mm_cmpeq_epi16(horizontalOpenScore, horizontalScore),
+                                      traceHorizontalOpen)),
+                    _mm_or_si128(
+                        _mm_and_si128(_mm_cmpeq_epi16(verticalExtendScore, verticalScore),
+                                      traceVertical),
+                        _mm_and_si128(_mm_cmpeq_epi16(verticalOpenScore, verticalScore),
+                                      traceVerticalOpen)));
+                traceValue = _mm_or_si128(traceValue, _mm_or_si128(
+                    _mm_and_si128(_mm_cmpeq_epi16(diagonalScore, score), traceDiagonal),
+                    _mm_and_si128(_mm_cmpeq_epi16(gapScore, score), maxTrace)));
+                _mm_storeu_si128(currHorizontalScores + i, horizontalScore);
+            }
+            _mm_storeu_si128(currScores + i, score);
+            _mm_storel_epi64((__m128i *)(columnTrace + i * LANE_COUNT),
+                             _mm_packus_epi16(traceValue, traceValue));
+            upScore = score;
+            upLeftScore = leftScore;
+        }
+
+        int16_t * columnScores = buffers.currLaneScores.data();
+        for (int k = 0; k < laneCount; ++k) {
+            if (j > readLengths[k])
+                continue;
+            int firstTrackedRow = (j == readLengths[k]) ? 0 : adapterLengths[k];
+            for (int i = firstTrackedRow; i <= adapterLengths[k]; ++i) {
+                int score = columnScores[i * LANE_COUNT + k];
+                if (score > bestScores[k]) {
+                    bestScores[k] = score;
+                    bestColumns[k] = j;
+                    bestRows[k] = i;
+                }
+            }
+        }
+        buffers.prevLaneScores.swap(buffers.currLaneScores);
+        buffers.prevLaneHorizontalScores.swap(buffers.currLaneHorizontalScores);
+    }
+
+    for (int k = 0; k < laneCount; ++k) {
+        traceBack(trace, rowCount, LANE_COUNT, k, readLengths[k], adapterLengths[k], bestRows[k],
+                  bestColumns[k], linearGaps, buffers.ops);
+        scoreAlignmentOps(buffers.ops, *readCodes[k], adapters[k]->codes, bestScores[k],
+                          results[k]);
+    }
+#else
+    (void)matchScore; (void)mismatchScore;
+    for (int k = 0; k < laneCount; ++k)
+        fastAlignToAdapter(*readCodes[k], adapters[k]->codes, adapters[k]->scoreProfile.data(),
+                           gapOpenScore, gapExtensionScore, buffers, results[k]);
+#endif
+}
+
+
+// Follows the traceback matrix from the best cell and puts the alignment columns in ops. The
+// matrix can hold more than one alignment (one per lane), in which case laneStride is the number
+// of lanes.
+void traceBack(uint8_t * trace, int rowCount, int laneStride, int lane, int readLength,
+               int adapterLength, int bestRow, int bestColumn, bool linearGaps,
+               std::vector<uint8_t> & ops) {
+    // The columns are collected in reverse order. Like SeqAn, a gap is followed all the way back
+    // to where it was opened.
+    ops.clear();
+    for (int i = adapterLength; i > bestRow; --i)
+        ops.push_back(OP_ADAPTER_ONLY);
+    for (int j = readLength; j > bestColumn; --j)
+        ops.push_back(OP_READ_ONLY);
+
+    // At the best cell, a gap is preferred to the diagonal if both are optimal (only for affine
+    // gaps, as in SeqAn).
+    int i = bestRow, j = bestColumn;
+    uint8_t traceValue = trace[(j * rowCount + i) * laneStride + lane];
+    if (!linearGaps && (traceValue & TRACE_MAX_FROM_VERTICAL))
+        traceValue &= TRACE_VERTICAL | TRACE_VERTICAL_OPEN | TRACE_MAX_FROM_VERTICAL;
+    else if (!linearGaps && (traceValue & TRACE_MAX_FROM_HORIZONTAL))
+        traceValue &= TRACE_HORIZONTAL | TRACE_HORIZONTAL_OPEN | TRACE_MAX_FROM_HORIZONTAL;
+    while (i > 0 && j > 0 && traceValue != TRACE_NONE) {
+        if (traceValue & TRACE_DIAGONAL) {
+            ops.push_back(OP_MATCH);
+            --i;
+            --j;
+        }
+        else if (linearGaps && (traceValue & TRACE_MAX_FROM_VERTICAL)) {
+            ops.push_back(OP_ADAPTER_ONLY);
+            --i;
+        }
+        else if (linearGaps && (traceValue & TRACE_MAX_FROM_HORIZONTAL)) {
+            ops.push_back(OP_READ_ONLY);
+            --j;
+        }
+        else if ((traceValue & TRACE_MAX_FROM_VERTICAL) && (traceValue & TRACE_VERTICAL)) {
+            while (((traceValue & TRACE_VERTICAL) || !(traceValue & TRACE_VERTICAL_OPEN)) &&
+                   i != 1) {
+                ops.push_back(OP_ADAPTER_ONLY);
+                --i;
+                traceValue = trace[(j * rowCount + i) * laneStride + lane];
+            }
+            ops.push_back(OP_ADAPTER_ONLY);
+            --i;
+        }
+        else if ((traceValue & TRACE_MAX_FROM_VERTICAL) && (traceValue & TRACE_VERTICAL_OPEN)) {
+            ops.push_back(OP_ADAPTER_ONLY);
+            --i;
+        }
+        else if ((traceValue & TRACE_MAX_FROM_HORIZONTAL) && (traceValue & TRACE_HORIZONTAL)) {
+            while (((traceValue & TRACE_HORIZONTAL) || !(traceValue & TRACE_HORIZONTAL_OPEN)) &&
+                   j != 1) {
+                ops.push_back(OP_READ_ONLY);
+                --j;
+                traceValue = trace[(j * rowCount + i) * laneStride + lane];
+            }
+            ops.push_back(OP_READ_ONLY);
+            --j;
+        }
+        else if ((traceValue & TRACE_MAX_FROM_HORIZONTAL) &&
+                 (traceValue & TRACE_HORIZONTAL_OPEN)) {
+            ops.push_back(OP_READ_ONLY);
+            --j;
+        }
+        else
+            break;
+        traceValue = trace[(j * rowCount + i) * laneStride + lane];
+    }
+    for (; i > 0; --i)
+        ops.push_back(OP_ADAPTER_ONLY);
+    for (; j > 0; --j)
+        ops.push_back(OP_READ_ONLY);
+
+    std::reverse(ops.begin(), ops.end());
+}
+
+
+// Fills in the result from a list of alignment columns, using the same rules as ScoredAlignment
+// uses on the gapped alignment strings.
+void scoreAlignmentOps(std::vector<uint8_t> & ops, std::vector<uint8_t> & readCodes,
+                       std::vector<uint8_t> & adapterCodes, int score, AlignmentResult * result) {
+    result->readStartPos = -1;
+    result->readEndPos = -1;
+    result->adapterStartPos = -1;
+    result->adapterEndPos = -1;
+    result->rawScore = score;
+    result->alignedRegionPercentIdentity = 0.0;
+    result->fullAdapterPercentIdentity = 0.0;
+
+    int alignmentLength = ops.size();
+    if (alignmentLength == 0)
+        return;
+
+    // The alignment starts once both sequences have started and ends where both have ended.
+    int alignmentStartPos = -1;
+    bool readStarted = false, adapterStarted = false;
+    for (int i = 0; i < alignmentLength; ++i) {
+        readStarted = readStarted || ops[i] != OP_ADAPTER_ONLY;
+        adapterStarted = adapterStarted || ops[i] != OP_READ_ONLY;
+        if (readStarted && adapterStarted) {
+            alignmentStartPos = i;
+            break;
+        }
+    }
+    int alignmentEndPos = -1;
+    bool readEnded = false, adapterEnded = false;
+    for (int i = alignmentLength - 1; i >= 0; --i) {
+        readEnded = readEnded || ops[i] != OP_ADAPTER_ONLY;
+        adapterEnded = adapterEnded || ops[i] != OP_READ_ONLY;
+        if (readEnded && adapterEnded) {
+            alignmentEndPos = i;
+            break;
+        }
+    }
+    if (alignmentStartPos == -1 || alignmentEndPos == -1)
+        return;
+
+    int adapterAlignmentStartPos = -1;
+    for (int i = 0; i < alignmentLength; ++i) {
+        if (ops[i] != OP_READ_ONLY) {
+            adapterAlignmentStartPos = i;
+            break;
+        }
+    }
+    int adapterAlignmentEndPos = -1;
+    for (int i = alignmentLength - 1; i >= 0; --i) {
+        if (ops[i] != OP_READ_ONLY) {
+            adapterAlignmentEndPos = i;
+            break;
+        }
+    }
+
+    // Walk the alignment once, noting the positions and which columns are matches.
+    int alignedMatchCount = 0, fullAdapterMatchCount = 0;
+    int readBases = 0, adapterBases = 0;
+    for (int i = 0; i < alignmentLength; ++i) {
+        if (i == alignmentStartPos) {
+            result->readStartPos = readBases;
+            result->adapterStartPos = adapterBases;
+        }
+        if (i == alignmentEndPos) {
+            result->readEndPos = readBases;
+            result->adapterEndPos = adapterBases;
+        }
+        uint8_t op = ops[i];
+        if (op == OP_MATCH && readCodes[readBases] == adapterCodes[adapterBases]) {
+            if (i >= alignmentStartPos && i <= alignmentEndPos)
+                ++alignedMatchCount;
+            if (i >= adapterAlignmentStartPos && i <= adapterAlignmentEndPos)
+                ++fullAdapterMatchCount;
+        }
+        if (op != OP_ADAPTER_ONLY)
+            ++readBases;
+        if (op != OP_READ_ONLY)
+            ++adapterBases;
+    }
+
+    int alignedRegionLength = alignmentEndPos - alignmentStartPos + 1;
+    result->alignedRegionPercentIdentity = 100.0 * alignedMatchCount / alignedRegionLength;
+    int fullAdapterLength = adapterAlignmentEndPos - adapterAlignmentStartPos + 1;
+    result->fullAdapterPercentIdentity = 100.0 * fullAdapterMatchCount / fullAdapterLength;
+}
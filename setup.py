@@ -46,6 +46,7 @@ class PorechopBuild(build):
             make_cmd = ['make', '-j', str(min(8, multiprocessing.cpu_count()))]
         except NotImplementedError:
             make_cmd = ['make']
+        make_cmd.append('PYTHON=' + sys.executable)  # build the extension module for this Python
 
         def clean_cpp():
             subprocess.call(clean_cmd)
@@ -59,13 +60,17 @@ class PorechopBuild(build):
 
 class PorechopInstall(install):
     """
-    The install process copies the C++ shared library to the install location.
+    The install process copies the C++ shared library (and the extension module, if it was built)
+    to the install location.
     """
 
     def run(self):
         install.run(self)  # Run original install code
         shutil.copyfile(os.path.join('porechop', 'cpp_functions.so'),
                         os.path.join(self.install_lib, 'porechop', 'cpp_functions.so'))
+        for filename in fnmatch.filter(os.listdir('porechop'), 'cpp_extension*.so'):
+            shutil.copyfile(os.path.join('porechop', filename),
+                            os.path.join(self.install_lib, 'porechop', filename))
 
 
 class PorechopClean(Command):
@@ -206,3 +206,21 @@ class TestAlbacoreDirectory(unittest.TestCase):
                                            'f38d7656-735d-4be9-92ce-94a568bada56',
                                            'fb5162ca-4645-4a0d-9336-3aa5fdf18d74',
                                            'ffa40714-6027-4ebc-9f49-ecde4f6511f3'])
+
+    def test_albacore_directory_threads(self):
+        """
+        The files of an Albacore directory are loaded in parallel, but the reads should still come
+        out in the same order as when they are loaded one file at a time.
+        """
+        bin_names = ['BC01.fastq', 'BC02.fastq', 'BC03.fastq', 'none.fastq']
+        self.run_command('porechop -i INPUT -b BARCODE_DIR --extra_end_trim 2 -t 1',
+                         'test_albacore_directory')
+        one_thread_reads = [self.load_trimmed_reads(x) for x in bin_names]
+        shutil.rmtree(self.output_dir)
+        self.run_command('porechop -i INPUT -b BARCODE_DIR --extra_end_trim 2 -t 4',
+                         'test_albacore_directory')
+        self.assertEqual([self.load_trimmed_reads(x) for x in bin_names], one_thread_reads)
+        shutil.rmtree(self.output_dir)
+        self.run_command('porechop -i INPUT -b BARCODE_DIR --extra_end_trim 2 -t 4 '
+                         '--chunk_size 5', 'test_albacore_directory')
+        self.assertEqual([self.load_trimmed_reads(x) for x in bin_names], one_thread_reads)
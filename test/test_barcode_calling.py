@@ -0,0 +1,138 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import random
+import porechop.barcode_calling
+from porechop.barcode_calling import call_barcodes
+from porechop.dual_barcodes import DualBarcodes, make_dual_barcode_adapter_sets
+from porechop.misc import reverse_complement
+from porechop.nanopore_read import NanoporeRead
+
+BARCODES = ['BC01', 'BC02', 'BC03', 'BC04', 'NB05_reverse', 'NB06_reverse']
+
+
+@unittest.skipIf(porechop.barcode_calling.np is None, 'NumPy is not installed')
+class TestBarcodeCalling(unittest.TestCase):
+    """
+    Calling barcodes for a batch of reads must give the same results as determine_barcode does for
+    each read, including how ties between barcodes are broken.
+    """
+    def make_reads(self, seed):
+        rng = random.Random(seed)
+        reads = []
+        for _ in range(500):
+            read = NanoporeRead('read', 'ACGT', '')
+            for barcode_scores in [read.start_barcode_scores, read.end_barcode_scores]:
+                # Few distinct scores, so there are plenty of ties.
+                for name in rng.sample(BARCODES, rng.randint(0, len(BARCODES))):
+                    barcode_scores[name] = rng.choice([0.0, 55.5, 70.0, 75.0, 80.0, 80.0, 100.0])
+            if rng.random() < 0.2:
+                read.albacore_barcode_call = rng.choice(BARCODES)
+            reads.append(read)
+        return reads
+
+    def get_calls(self, reads):
+        return [(r.best_start_barcode, r.second_best_start_barcode, r.best_end_barcode,
+                 r.second_best_end_barcode, r.barcode_call, r.needs_reversing) for r in reads]
+
+    def test_same_as_determine_barcode(self):
+        for require_two_barcodes in [False, True]:
+            for barcode_threshold, barcode_diff in [(75.0, 5.0), (0.0, 0.0), (80.0, 20.0)]:
+                settings = (barcode_threshold, barcode_diff, require_two_barcodes, True)
+                expected_reads = self.make_reads(0)
+                for read in expected_reads:
+                    read.determine_barcode(*settings)
+                reads = self.make_reads(0)
+                call_barcodes(reads, *settings)
+                self.assertEqual(self.get_calls(reads), self.get_calls(expected_reads))
+
+    def test_no_barcode_scores(self):
+        reads = [NanoporeRead('read', 'ACGT', '') for _ in range(3)]
+        call_barcodes(reads, 0.0, 0.0, False, False)
+        self.assertEqual(self.get_calls(reads), [(('none', 0.0), ('none', 0.0), ('none', 0.0),
+                                                  ('none', 0.0), 'none', False)] * 3)
+        call_barcodes([], 75.0, 5.0, True, False)
+
+    def test_dual_barcodes_same_as_determine_barcode(self):
+        dual_barcodes = DualBarcodes([('BC01', 'BC02', 'sample_a'), ('BC02', 'BC04', 'sample_b'),
+                                      ('BC03', 'BC03', 'sample_c'), ('BC04', 'BC03', 'sample_a'),
+                                      ('NB05_reverse', 'BC04', 'sample_d')])
+        for barcode_threshold, barcode_diff in [(75.0, 5.0), (0.0, 0.0), (80.0, 20.0)]:
+            settings = (barcode_threshold, barcode_diff, False, False, dual_barcodes)
+            expected_reads = self.make_reads(1)
+            for read in expected_reads:
+                read.determine_barcode(*settings)
+            reads = self.make_reads(1)
+            call_barcodes(reads, *settings)
+            self.assertEqual(self.get_calls(reads), self.get_calls(expected_reads))
+            self.assertTrue({r.barcode_call for r in reads} <=
+                            {'sample_a', 'sample_b', 'sample_c', 'sample_d', 'none'})
+
+
+class TestDualBarcodes(unittest.TestCase):
+
+    def test_pair_table(self):
+        dual_barcodes = DualBarcodes([('BC01', 'BC02', 'sample_a'), ('BC03', 'BC02', 'sample_b'),
+                                      ('BC01', 'BC04', 'sample_a')])
+        self.assertEqual(dual_barcodes.start_barcodes, ['BC01', 'BC03'])
+        self.assertEqual(dual_barcodes.end_barcodes, ['BC02', 'BC04'])
+        self.assertEqual(dual_barcodes.barcodes, ['BC01', 'BC03', 'BC02', 'BC04'])
+        self.assertEqual(dual_barcodes.sample_names, ['sample_a', 'sample_b'])
+        self.assertEqual(dual_barcodes.pair_table, [[-1, -1, 0, 0, -1], [-1, -1, 1, -1, -1],
+                                                    [0, 1, -1, -1, -1], [0, -1, -1, -1, -1],
+                                                    [-1, -1, -1, -1, -1]])
+        self.assertEqual(dual_barcodes.get_sample('BC03', 'BC02'), 'sample_b')
+        self.assertEqual(dual_barcodes.get_sample('BC02', 'BC03'), 'sample_b')
+        self.assertEqual(dual_barcodes.get_sample('BC03', 'BC04'), 'none')
+        self.assertEqual(dual_barcodes.get_sample('BC01', 'none'), 'none')
+
+    def test_swapped_pair(self):
+        with self.assertRaises(ValueError):
+            DualBarcodes([('BC01', 'BC02', 'sample_a'), ('BC02', 'BC01', 'sample_b')])
+
+    def test_distinct_start_and_end_barcodes(self):
+        """
+        Reads with different barcodes at their start and end are binned by the pair, whichever
+        strand they come from.
+        """
+        dual_barcodes = DualBarcodes([('BC01', 'BC02', 'sample_a'), ('BC03', 'BC04', 'sample_b')])
+        adapters = make_dual_barcode_adapter_sets([], dual_barcodes, 'reverse')
+        barcodes = {x.get_barcode_name(): x for x in adapters}
+        rng = random.Random(0)
+        expected_calls, reads = [], []
+        for start_barcode, end_barcode, sample in [('BC01', 'BC02', 'sample_a'),
+                                                   ('BC03', 'BC04', 'sample_b'),
+                                                   ('BC01', 'BC04', 'none')]:
+            seq = ''.join(rng.choice('ACGT') for _ in range(500))
+            seq = 'ACGTAC' + barcodes[start_barcode].start_sequence[1] + seq + \
+                barcodes[end_barcode].end_sequence[1] + 'GTACGT'
+            for read_seq in [seq, reverse_complement(seq)]:
+                reads.append(NanoporeRead('read', read_seq, ''))
+                expected_calls.append(sample)
+        for read in reads:
+            read.find_start_trim(adapters, 150, 2, 75.0, [3, -6, -5, -2], 4, True, 'reverse',
+                                 False)
+            read.find_end_trim(adapters, 150, 2, 75.0, [3, -6, -5, -2], 4, True, 'reverse', False)
+        call_barcodes(reads, 75.0, 5.0, False, False, dual_barcodes)
+        self.assertEqual([r.barcode_call for r in reads], expected_calls)
+        for read in reads:
+            read.determine_barcode(75.0, 5.0, False, False, dual_barcodes)
+        self.assertEqual([r.barcode_call for r in reads], expected_calls)
+
+    def test_duplicate_pair(self):
+        with self.assertRaises(ValueError):
+            DualBarcodes([('BC01', 'BC02', 'sample_a'), ('BC01', 'BC02', 'sample_b')])
@@ -205,3 +205,70 @@ class TestBarcodes(unittest.TestCase):
         self.assertTrue('BC03         1  6,996' in out)
 
         self.assertTrue('Saving trimmed reads' in out)
+
+    def test_adapter_profile(self):
+        """
+        An adapter profile saved without binning is used for binning in a later run, which
+        chooses the barcode orientation from the saved scores.
+        """
+        profile = 'adapter_profile_' + str(os.getpid()) + '.json'
+        try:
+            self.run_command('porechop -i INPUT -o BARCODE_DIR.fastq --extra_end_trim 2 '
+                             '--save_adapter_profile ' + profile)
+            os.remove(self.output_dir + '.fastq')
+            self.assertTrue(os.path.isfile(profile))
+
+            out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR --extra_end_trim 2 '
+                                      '--chunk_size 4 --adapter_profile ' + profile)
+            self.assertTrue('Loading adapter profile' in out)
+            self.assertFalse('Looking for known adapter sets' in out)
+            self.assertEqual(self.count_output_fastq_files(), 4)
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC01.fastq')),
+                             ['1', '4'])
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC02.fastq')),
+                             ['2', '5'])
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('BC03.fastq')), ['3'])
+            self.assertTrue('BC01         2   8,994' in out)
+            self.assertTrue('none         2  13,496' in out)
+
+            # A profile made with a different list of known adapters can't be used.
+            with open(profile, 'rt') as profile_file:
+                profile_text = profile_file.read()
+            with open(profile, 'wt') as profile_file:
+                profile_file.write(profile_text.replace('"adapter_catalogue": "',
+                                                        '"adapter_catalogue": "old'))
+            _, err = self.run_command('porechop -i INPUT -b BARCODE_DIR --adapter_profile ' +
+                                      profile)
+            self.assertTrue('different list of known adapters' in err)
+        finally:
+            if os.path.isfile(profile):
+                os.remove(profile)
+
+    def test_dual_barcodes(self):
+        """
+        Tests --dual_barcodes, where reads are binned by the pair of their start and end barcodes.
+        """
+        sheet = 'TEMP_SHEET_' + str(os.getpid()) + '.tsv'
+        try:
+            with open(sheet, 'wt') as sheet_file:
+                sheet_file.write('# start\tend\tsample\n'
+                                 'BC01\tBC01\tsample_a\n'
+                                 'BC02\tBC02\n'
+                                 'BC03\tBC01\n')
+            out, _ = self.run_command('porechop -i INPUT -b BARCODE_DIR --extra_end_trim 2 '
+                                      '--dual_barcodes ' + sheet)
+            self.assertEqual(self.count_output_fastq_files(), 3)
+            self.assertEqual([x[0] for x in self.load_trimmed_reads('sample_a.fastq')], ['1'])
+            self.assertEqual([x[0] for x in self.load_trimmed_reads('BC02_BC02.fastq')], ['2'])
+
+            # Read 3 has BC03 at its start, but its pair of barcodes isn't in the sheet.
+            self.assertEqual(sorted(x[0] for x in self.load_trimmed_reads('none.fastq')),
+                             ['3', '4', '5', '6', '8'])
+
+            with open(sheet, 'wt') as sheet_file:
+                sheet_file.write('BC01\tBC99\n')
+            _, err = self.run_command('porechop -i INPUT -b BARCODE_DIR --dual_barcodes ' + sheet)
+            self.assertTrue('BC99 (line 1 of ' + sheet + ') is not a known barcode' in err)
+        finally:
+            if os.path.isfile(sheet):
+                os.remove(sheet)
@@ -0,0 +1,60 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import json
+import subprocess
+import sys
+from benchmark.synthetic_reads import generate_reads
+
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Tests the synthetic read generator and runs a small benchmark.
+    """
+    def test_synthetic_reads_are_reproducible(self):
+        settings = [50, 1, 'gamma', 2000, 1000, 200, 0.1, [0.4, 0.3, 0.3], None, 4, 0.9, 0.5, 0.1]
+        reads_1 = list(generate_reads(*settings))
+        reads_2 = list(generate_reads(*settings))
+        self.assertEqual(reads_1, reads_2)
+        self.assertEqual(len(reads_1), 50)
+        for header, seq, quals in reads_1:
+            self.assertTrue(header.startswith('synthetic_'))
+            self.assertTrue('adapters=Native_barcoding_' in header)
+            self.assertEqual(len(seq), len(quals))
+        settings[1] = 2
+        self.assertNotEqual(list(generate_reads(*settings)), reads_1)
+
+    def test_benchmark(self):
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        command = [sys.executable, '-m', 'benchmark.run_benchmark', '--reads', '100',
+                   '--mean_length', '1000', '--length_sd', '500', '--barcodes', '3', '--',
+                   '--threads', '1', '--aligner', 'fast', '--middle_search', 'seeded']
+        p = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             cwd=root_dir)
+        out, _ = p.communicate()
+        results = json.loads(out.decode())
+        self.assertEqual(results['reads'], 100)
+        self.assertEqual(list(results['phases']), ['loading', 'discovery', 'end_trimming',
+                                                   'middle_splitting', 'output'])
+        for phase in results['phases'].values():
+            self.assertEqual(phase['reads'], 100)
+            self.assertTrue(phase['reads_per_second'] is None or phase['reads_per_second'] > 0)
+            self.assertTrue(phase['peak_rss_mb'] > 0)
+        self.assertTrue(results['phases']['end_trimming']['alignments'] > 0)
+        self.assertEqual(sorted(results['counts']['bins']), ['BC01', 'BC02', 'BC03', 'none'])
+        self.assertTrue(results['counts']['barcoded'] > 80)
@@ -0,0 +1,92 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import gzip
+import random
+import shutil
+from multiprocessing.dummy import Pool as ThreadPool
+import porechop.bin_writer
+from porechop.bin_writer import BinWriter
+from porechop.bgzf_writer import BGZF_EOF
+
+
+class TestBinWriter(unittest.TestCase):
+    """
+    Writes many bins with only a couple of files allowed open at once and small buffers, so the
+    files are closed and reopened many times.
+    """
+    def setUp(self):
+        self.output_dir = 'TEMP_' + str(os.getpid())
+        os.makedirs(self.output_dir)
+        self.old_sizes = porechop.bin_writer.BIN_BUFFER_SIZE, porechop.bin_writer.MAX_BUFFERED_SIZE
+        porechop.bin_writer.BIN_BUFFER_SIZE = 70000
+        porechop.bin_writer.MAX_BUFFERED_SIZE = 200000
+
+    def tearDown(self):
+        porechop.bin_writer.BIN_BUFFER_SIZE, porechop.bin_writer.MAX_BUFFERED_SIZE = self.old_sizes
+        shutil.rmtree(self.output_dir)
+
+    def write_bins(self, gzipped, compression_pool):
+        random.seed(0)
+        expected = {}
+        with BinWriter(self.output_dir, 'fastq', gzipped, compression_pool, threads=2,
+                       max_open_files=2) as bin_writer:
+            for i in range(2000):
+                bin_name = 'BC' + str(random.randint(1, 12)).zfill(2)
+                seq = ''.join(random.choice('ACGT') for _ in range(random.randint(1, 500)))
+                read_str = '@read_' + str(i) + '\n' + seq + '\n+\n' + 'A' * len(seq) + '\n'
+                bin_writer.write(bin_name, read_str)
+                expected[bin_name] = expected.get(bin_name, '') + read_str
+        return bin_writer, expected
+
+    def check_bins(self, bin_writer, expected, gzipped):
+        self.assertEqual(len(os.listdir(self.output_dir)), len(expected))
+        for bin_name, text in expected.items():
+            filename = bin_writer.get_filename(bin_name)
+            if gzipped:
+                self.assertTrue(filename.endswith('.fastq.gz'))
+                with open(filename, 'rb') as bin_file:
+                    self.assertEqual(bin_file.read()[-28:], BGZF_EOF)
+                with gzip.open(filename, 'rt') as bin_file:
+                    self.assertEqual(bin_file.read(), text)
+            else:
+                self.assertTrue(filename.endswith('.fastq'))
+                with open(filename, 'rt') as bin_file:
+                    self.assertEqual(bin_file.read(), text)
+
+    def test_plain_bins(self):
+        bin_writer, expected = self.write_bins(False, None)
+        self.check_bins(bin_writer, expected, False)
+
+    def test_gzipped_bins(self):
+        bin_writer, expected = self.write_bins(True, None)
+        self.check_bins(bin_writer, expected, True)
+
+    def test_gzipped_bins_compression_pool(self):
+        compression_pool = ThreadPool(2)
+        try:
+            bin_writer, expected = self.write_bins(True, compression_pool)
+        finally:
+            compression_pool.terminate()
+        self.check_bins(bin_writer, expected, True)
+
+    def test_bins_replace_old_files(self):
+        with open(os.path.join(self.output_dir, 'BC01.fastq'), 'wt') as old_file:
+            old_file.write('old reads\n')
+        bin_writer, expected = self.write_bins(False, None)
+        self.check_bins(bin_writer, expected, False)
@@ -0,0 +1,160 @@
+"""
+Copyright 2017 Ryan Wick (rrwick@gmail.com)
+https://github.com/rrwick/Porechop
+
+This module contains some tests for Porechop. To run them, execute `python3 -m unittest` from the
+root Porechop directory.
+
+This file is part of Porechop. Porechop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by the Free Software Foundation,
+either version 3 of the License, or (at your option) any later version. Porechop is distributed in
+the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for more
+details. You should have received a copy of the GNU General Public License along with Porechop. If
+not, see <http://www.gnu.org/licenses/>.
+"""
+
+import array
+import unittest
+import random
+import subprocess
+import sys
+import porechop.cpp_function_wrappers
+from porechop.cpp_function_wrappers import EncodedSequence, encode_sequence, set_aligner, \
+    register_adapters, set_backend, adapter_all_hits, cpp_extension
+from porechop.nanopore_read import NanoporeRead, align_adapters, align_adapter_pairs
+from porechop.adapters import ADAPTERS as ADAPTER_SETS
+from porechop.porechop import find_adapters_at_read_ends, register_adapter_sets
+
+SCORING_SCHEME = [3, -6, -5, -2]
+ADAPTERS = ['AATGTACTTCGTTCAGTTACGTATTGCT', 'GCAATACGTAACTGAACGAAGT',
+            'AAGAAAGTTGTCGGTGTCTTTGTG', 'CACAAAGACACCGACAACTTTCTT']
+
+
+class TestEncodedSequence(unittest.TestCase):
+    """
+    Aligning to a window of an encoded sequence must give the same results as aligning to the same
+    part of the sequence encoded on its own, with either aligner.
+    """
+    def setUp(self):
+        self.old_aligner = porechop.cpp_function_wrappers.ALIGNER
+        self.old_backend = porechop.cpp_function_wrappers.BACKEND
+        rng = random.Random(0)
+        self.seqs = []
+        for _ in range(20):
+            seq = ''.join(rng.choice('ACGTN') for _ in range(rng.randint(0, 200)))
+            insert_pos = rng.randint(0, len(seq))
+            self.seqs.append(seq[:insert_pos] + rng.choice(ADAPTERS) + seq[insert_pos:])
+
+    def tearDown(self):
+        set_backend(self.old_backend)
+        set_aligner(self.old_aligner)
+
+    def test_encoding(self):
+        self.assertEqual(list(encode_sequence('ACGTacgtNn-X')),
+                         [0, 1, 2, 3, 0, 1, 2, 3, 4, 4, 4, 4])
+        self.assertEqual(len(EncodedSequence('ACGTN')), 5)
+
+    def test_windows(self):
+        for aligner in ['seqan', 'fast']:
+            set_aligner(aligner)
+            for seq in self.seqs:
+                encoded_seq = EncodedSequence(seq)
+                for start, end in [(0, len(seq)), (0, 40), (len(seq) - 40, len(seq)), (10, 60)]:
+                    start, end = max(start, 0), min(end, len(seq))
+                    # Compared as strings, as an alignment with no matches has a NaN identity.
+                    expected = repr(align_adapters(EncodedSequence(seq[start:end]), ADAPTERS,
+                                                   SCORING_SCHEME))
+                    self.assertEqual(repr(align_adapters(encoded_seq, ADAPTERS, SCORING_SCHEME,
+                                                         start, end - start)), expected)
+                    self.assertEqual(repr(align_adapter_pairs([(encoded_seq, start, end - start)] *
+                                                              len(ADAPTERS), ADAPTERS,
+                                                              SCORING_SCHEME)), expected)
+
+    def test_registered_adapters(self):
+        handles = register_adapters(ADAPTERS, SCORING_SCHEME)
+        self.assertEqual(len(set(handles)), len(ADAPTERS))
+        self.assertEqual(register_adapters(ADAPTERS, SCORING_SCHEME), handles)
+
+        # A different match/mismatch score needs a different score profile, so a new handle.
+        other_handles = register_adapters(ADAPTERS, [2, -4, -5, -2])
+        self.assertFalse(set(handles) & set(other_handles))
+        for aligner in ['seqan', 'fast']:
+            set_aligner(aligner)
+            seq = 'ACGT' * 10 + ADAPTERS[0] + 'TTGCA' * 8
+            results = align_adapters(EncodedSequence(seq), ADAPTERS, [2, -4, -5, -2])
+            self.assertEqual(results[0][0], 100.0)
+            self.assertEqual(results[0][2:], (40, 68))
+
+    def test_handle_array_cache(self):
+        """
+        --kmer_prefilter aligns a different subset of the adapters to each read, and these must not
+        each add a cached array of handles.
+        """
+        adapter_sets = [x for x in ADAPTER_SETS if x.name.startswith('Barcode ') and
+                        x.name.endswith('(forward)')][:24]
+        rng = random.Random(0)
+        reads = []
+        for i in range(200):
+            barcodes = rng.sample(adapter_sets, 2)
+            seq = ''.join(rng.choice('ACGT') for _ in range(400))
+            seq = barcodes[0].start_sequence[1] + seq + barcodes[1].end_sequence[1]
+            reads.append(NanoporeRead(str(i), seq, ''))
+        register_adapter_sets(adapter_sets, SCORING_SCHEME)
+        cache_size = len(porechop.cpp_function_wrappers.ADAPTER_HANDLE_ARRAYS)
+        for aligner in ['seqan', 'fast']:
+            set_aligner(aligner)
+            find_adapters_at_read_ends(reads, adapter_sets, 0, 150, 0, 75.0, SCORING_SCHEME, None,
+                                       4, 1, True, 75.0, 5.0, False, 'forward', False,
+                                       kmer_prefilter=6)
+            self.assertEqual(len(porechop.cpp_function_wrappers.ADAPTER_HANDLE_ARRAYS),
+                             cache_size)
+        self.assertTrue(all(x.start_trim_amount > 0 and x.end_trim_amount > 0 for x in reads))
+
+    @unittest.skipIf(cpp_extension is None, 'the extension module was not built')
+    def test_backends(self):
+        def get_results():
+            results = []
+            for seq in self.seqs:
+                encoded_seq = EncodedSequence(seq)
+                results.append(repr(align_adapters(encoded_seq, ADAPTERS, SCORING_SCHEME, 0,
+                                                   min(50, len(seq)))))
+                results.append(repr(align_adapter_pairs([(encoded_seq, 0, len(seq))] *
+                                                        len(ADAPTERS), ADAPTERS, SCORING_SCHEME)))
+                results.append([(x.read_start, x.read_end, x.raw_score) for x in
+                                adapter_all_hits(seq, ADAPTERS[0][:12], SCORING_SCHEME, 60.0)])
+            return results
+        for aligner in ['seqan', 'fast']:
+            set_aligner(aligner)
+            set_backend('ctypes')
+            ctypes_results = get_results()
+            set_backend('extension')
+            self.assertEqual(get_results(), ctypes_results)
+
+    @unittest.skipIf(cpp_extension is None, 'the extension module was not built')
+    def test_ctypes_library_loaded_lazily(self):
+        # cpp_functions.so is only loaded once the ctypes backend is used.
+        code = ('import porechop.cpp_function_wrappers as w; print(w.C_LIB is None); '
+                'w.set_backend("ctypes"); print(w.C_LIB is None)')
+        out = subprocess.check_output([sys.executable, '-c', code]).decode()
+        self.assertEqual(out.split(), ['True', 'False'])
+
+    @unittest.skipIf(cpp_extension is None, 'the extension module was not built')
+    def test_extension_arguments(self):
+        handles = register_adapters(ADAPTERS, SCORING_SCHEME)
+        codes = encode_sequence(self.seqs[0])
+        vals = SCORING_SCHEME
+        with self.assertRaises(ValueError):
+            cpp_extension.adapter_alignment_batch(codes, 10, len(codes), handles, *vals)
+        with self.assertRaises(ValueError):
+            cpp_extension.fast_adapter_alignment_batch(codes, 0, len(codes), [-1], *vals)
+        with self.assertRaises(ValueError):
+            cpp_extension.adapter_alignment_pairs([codes], [0, 0], [5, 5], handles[:2], *vals)
+        with self.assertRaises(TypeError):
+            cpp_extension.adapter_alignment_batch(codes, 0, 5, array.array('d', [0.0]), *vals)
+
+        # Read codes and handles can come from any buffer.
+        expected = cpp_extension.adapter_alignment_batch(codes, 0, len(codes), handles, *vals)
+        self.assertEqual(cpp_extension.adapter_alignment_batch(
+            memoryview(bytearray(codes)), 0, len(codes), array.array('i', handles), *vals),
+            expected)
@@ -18,7 +18,9 @@ import unittest
 import os
 import subprocess
 import shutil
+import gzip
 import porechop.misc
+import porechop.bgzf_writer
 
 
 def get_read_type(filename):
@@ -141,6 +143,27 @@ class TestOutputFormat(unittest.TestCase):
         self.run_command('porechop -i IN -o OUT.fastq.gz --format fasta.gz', 'test_format.fasta')
         self.assertEqual(get_read_type(self.output_file), 'fasta.gz')
 
+    # Gzipped output is written in the BGZF format: every gzip member has a 'BC' extra field and the
+    # file ends with an empty block.
+
+    def test_gzipped_output_is_bgzf(self):
+        for threads in (1, 4):
+            self.run_command('porechop -i IN -o OUT.fastq.gz -t ' + str(threads),
+                             'test_format.fastq')
+            with open(self.output_file, 'rb') as gz:
+                data = gz.read()
+            self.assertEqual(data[:4], b'\x1f\x8b\x08\x04')
+            self.assertEqual(data[12:16], b'BC\x02\x00')
+            self.assertEqual(data[-28:], porechop.bgzf_writer.BGZF_EOF)
+            with gzip.open(self.output_file, 'rt') as gz:
+                gzipped_reads = gz.read()
+            self.run_command('porechop -i IN -o OUT.fastq -t ' + str(threads),
+                             'test_format.fastq')
+            with open(self.output_file, 'rt') as fastq:
+                self.assertEqual(gzipped_reads, fastq.read())
+            os.remove(self.output_file)
+            os.remove(self.output_file + '.gz')
+
 
 class TestOutputFormatBarcodes(unittest.TestCase):
 
@@ -17,6 +17,8 @@ not, see <http://www.gnu.org/licenses/>.
 import unittest
 import os
 import subprocess
+import shutil
+import json
 import porechop.misc
 
 
@@ -264,6 +266,123 @@ class TestOneAdapterSet(unittest.TestCase):
         self.run_command('porechop -i INPUT -o OUTPUT.fastq --threads 8 --extra_end_trim 2')
         self.check_trimmed_reads()
 
+    def test_worker_processes(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --threads 4 --worker_type processes '
+                         '--extra_end_trim 2')
+        self.check_trimmed_reads()
+
+    def test_chunk_size(self):
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq --chunk_size 2 '
+                                  '--extra_end_trim 2')
+        self.check_trimmed_reads()
+        self.assertTrue('4 / 9 reads' in out)
+        self.assertTrue('3 / 9 reads' in out)
+
+    def test_checkpoint(self):
+        checkpoint = 'checkpoint_' + str(os.getpid()) + '.json'
+        out, _ = self.run_command('porechop -i INPUT -o OUTPUT.fastq --chunk_size 2 '
+                                  '--extra_end_trim 2 --checkpoint ' + checkpoint)
+        self.check_trimmed_reads()
+        self.assertTrue('4 / 9 reads' in out)
+        self.assertFalse(os.path.isfile(checkpoint))
+
+    def test_checkpoint_resume(self):
+        """
+        The first run stops partway because its input ends in the middle of a read. Once the input
+        is complete, the second run carries on from the checkpoint.
+        """
+        input_path = os.path.join(os.path.dirname(__file__), 'test_one_adapter_set.fastq')
+        input_copy = 'checkpoint_input_' + str(os.getpid()) + '.fastq'
+        checkpoint = 'checkpoint_' + str(os.getpid()) + '.json'
+        command = 'porechop -i ' + input_copy + ' -o OUTPUT.fastq --chunk_size 2 ' \
+                  '--check_reads 4 --extra_end_trim 2 --checkpoint ' + checkpoint
+        with open(input_path, 'rt') as full_input:
+            input_lines = full_input.readlines()
+        try:
+            with open(input_copy, 'wt') as partial_input:
+                partial_input.write(''.join(input_lines[:22]))
+            _, err = self.run_command(command)
+            self.assertTrue('could not be parsed' in err)
+            self.assertTrue(os.path.isfile(checkpoint))
+
+            shutil.copyfile(input_path, input_copy)
+            out, _ = self.run_command(command)
+            self.assertTrue('Resuming from checkpoint: 4 reads already done' in out)
+            self.check_trimmed_reads()
+            self.assertTrue('4 / 9 reads' in out)
+            self.assertTrue('3 / 9 reads' in out)
+            self.assertFalse(os.path.isfile(checkpoint))
+        finally:
+            for filename in [input_copy, checkpoint]:
+                if os.path.isfile(filename):
+                    os.remove(filename)
+
+    def test_adaptive_adapter_search(self):
+        """
+        With the input repeated 100 times, the adaptive search has seen every adapter score after
+        the first increment of check reads and so stops after the second.
+        """
+        input_path = os.path.join(os.path.dirname(__file__), 'test_one_adapter_set.fastq')
+        repeated_input = 'adaptive_input_' + str(os.getpid()) + '.fastq'
+        with open(input_path, 'rt') as input_file:
+            input_text = input_file.read()
+        try:
+            with open(repeated_input, 'wt') as input_file:
+                input_file.write(input_text * 100)
+            command = 'porechop -i ' + repeated_input + ' -o OUTPUT.fastq --extra_end_trim 2 ' \
+                      '--no_split --aligner fast'
+            out, _ = self.run_command(command + ' --adapter_search adaptive')
+            self.assertTrue('All adapter sets decided after 500 check reads' in out)
+            self.assertTrue('400 / 900 reads' in out)
+            with open(self.output_file, 'rt') as output_file:
+                adaptive_output = output_file.read()
+            out, _ = self.run_command(command)
+            self.assertFalse('decided' in out)
+            with open(self.output_file, 'rt') as output_file:
+                self.assertEqual(output_file.read(), adaptive_output)
+        finally:
+            os.remove(repeated_input)
+
+    def test_fast_aligner(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --aligner fast --extra_end_trim 2')
+        self.check_trimmed_reads()
+
+    def test_kmer_prefilter(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --kmer_prefilter 6 --extra_end_trim 2')
+        self.check_trimmed_reads()
+
+    def test_metrics(self):
+        metrics_file = 'metrics_' + str(os.getpid())
+        try:
+            self.run_command('porechop -i INPUT -o OUTPUT.fastq --extra_end_trim 2 --metrics ' +
+                             metrics_file + '.json --metrics_adapters')
+            self.check_trimmed_reads()
+            with open(metrics_file + '.json', 'rt') as metrics_json:
+                metrics = json.load(metrics_json)
+            self.assertEqual(list(metrics['phases']), ['loading', 'discovery', 'end_trimming',
+                                                       'middle_splitting', 'output'])
+            self.assertEqual(metrics['phases']['loading']['reads'], 9)
+            end_trimming = metrics['phases']['end_trimming']
+            self.assertEqual(end_trimming['alignments'], 18)
+            self.assertEqual(end_trimming['dp_cells'], 9 * 150 * (28 + 22))
+            self.assertEqual(sorted(end_trimming['adapters']),
+                             ['SQK-NSK007_Y_Bottom', 'SQK-NSK007_Y_Top'])
+
+            self.run_command('porechop -i INPUT -o OUTPUT.fastq --extra_end_trim 2 --chunk_size 4 '
+                             '--metrics ' + metrics_file + '.tsv')
+            self.check_trimmed_reads()
+            with open(metrics_file + '.tsv', 'rt') as metrics_tsv:
+                rows = [x.rstrip('\n').split('\t') for x in metrics_tsv]
+            self.assertEqual(rows[0][:5], ['phase', 'adapter', 'wall_seconds', 'cpu_seconds',
+                                           'reads'])
+            self.assertEqual({x[0]: x[4] for x in rows[2:]},
+                             {'loading': '9', 'discovery': '9', 'output': '9',
+                              'end_trimming': '9', 'middle_splitting': '9'})
+        finally:
+            for filename in [metrics_file + '.json', metrics_file + '.tsv']:
+                if os.path.isfile(filename):
+                    os.remove(filename)
+
     def test_end_size_1(self):
         self.run_command('porechop -i INPUT -o OUTPUT.fastq --end_size 50 --extra_end_trim 2')
         self.check_trimmed_reads()
@@ -354,6 +473,26 @@ class TestOneAdapterSet(unittest.TestCase):
         read_6 = [x for x in trimmed_reads if x[0] == '6'][0]
         self.assertEqual(len(read_6[1]), 12000)
 
+    def test_middle_search_seeded_1(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --middle_search seeded --extra_end_trim 2')
+        self.check_trimmed_reads()
+
+    def test_middle_search_seeded_2(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --middle_search seeded --extra_end_trim 2'
+                         ' --middle_threshold 96')
+        trimmed_reads, read_type = self.load_trimmed_reads()
+        read_6_1 = [x for x in trimmed_reads if x[0] == '6_1'][0]
+        read_6_2 = [x for x in trimmed_reads if x[0] == '6_2'][0]
+        self.assertEqual(len(read_6_1[1]), 3900)
+        self.assertEqual(len(read_6_2[1]), 7962)
+
+    def test_middle_search_seeded_3(self):
+        self.run_command('porechop -i INPUT -o OUTPUT.fastq --middle_search seeded --extra_end_trim 2'
+                         ' --middle_threshold 97')
+        trimmed_reads, read_type = self.load_trimmed_reads()
+        read_6 = [x for x in trimmed_reads if x[0] == '6'][0]
+        self.assertEqual(len(read_6[1]), 12000)
+
     def test_check_reads(self):
         """
         When only one read is checked, no adapters are found and nothing is trimmed.